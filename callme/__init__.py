@@ -31,5 +31,6 @@
 
 from callme.proxy import Proxy      # noqa
 from callme.server import Server    # noqa
+from callme.server import ServerGroup   # noqa
 
 __version__ = '0.2.0'
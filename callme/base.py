@@ -29,21 +29,113 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import logging
+import socket
+import time
+import uuid
+
 import kombu
 
+LOG = logging.getLogger(__name__)
+
+# the retry policy of publishes on connections which reconnect
+RETRY_POLICY = {'max_retries': 5,
+                'interval_start': 0,
+                'interval_step': 1,
+                'interval_max': 5}
+
+# the connection arguments defaulting to the defaults of the amqp transport
+AMQP_DEFAULTS = {'userid': 'guest',
+                 'password': 'guest',
+                 'virtual_host': '/',
+                 'port': 5672,
+                 'ssl': False}
+
+
+def connection_errors(conn):
+    """Return the exceptions raised when the broker connection is lost."""
+    return (socket.error,) + tuple(conn.connection_errors)
+
 
 class Base(object):
-    """Base class for Proxy and Server."""
+    """Base class for Proxy and Server.
+
+    The `amqp_host` may also be a kombu URL such as `memory://` or
+    `redis://localhost:6379/0`. Connection arguments left at the amqp
+    defaults are not passed along with a URL, so that the transport of the
+    URL applies its own defaults, the others are passed to the transport.
+
+    If `reconnect` is set a lost connection is re-established with an
+    exponential backoff between `RECONNECT_INTERVAL_START` and
+    `RECONNECT_INTERVAL_MAX` seconds, and publishes are retried.
+    """
+
+    RECONNECT_INTERVAL_START = 1
+    RECONNECT_INTERVAL_MAX = 32
 
     def __init__(self, amqp_host, amqp_user, amqp_password, amqp_vhost,
-                 amqp_port, ssl):
+                 amqp_port, ssl, transport_options=None,
+                 connection_options=None, reconnect=False):
         # create connection
-        self._conn = kombu.BrokerConnection(hostname=amqp_host,
-                                            userid=amqp_user,
-                                            password=amqp_password,
-                                            virtual_host=amqp_vhost,
-                                            port=amqp_port,
-                                            ssl=ssl)
+        options = dict(connection_options or {})
+        if transport_options is not None:
+            options['transport_options'] = transport_options
+        self._conn_params = dict(userid=amqp_user,
+                                 password=amqp_password,
+                                 virtual_host=amqp_vhost,
+                                 port=amqp_port,
+                                 ssl=ssl,
+                                 **options)
+        self._conn = self._make_connection(amqp_host)
+        self._reconnect = reconnect
+
+    def _make_connection(self, amqp_host):
+        """Make a connection to a broker with the connection arguments of
+        this object.
+        """
+        params = self._conn_params
+        if amqp_host and '://' in amqp_host:
+            params = dict((k, v) for k, v in params.items()
+                          if k not in AMQP_DEFAULTS or AMQP_DEFAULTS[k] != v)
+        return kombu.BrokerConnection(hostname=amqp_host, **params)
+
+    def _retry_options(self):
+        """Return the keyword arguments making a publish retry on connection
+        errors if the connection reconnects.
+        """
+        if not self._reconnect:
+            return {}
+        return {'retry': True, 'retry_policy': RETRY_POLICY}
+
+    def _reestablish(self, conn, stop_event=None, deadline=None):
+        """Re-establish a lost connection, retrying with an exponential
+        backoff.
+
+        :param conn: the lost connection
+        :keyword stop_event: an event aborting the retries when set
+        :keyword deadline: the time after which to give up
+        :rtype: `True` once connected, `False` if the retries were aborted
+        """
+        interval = self.RECONNECT_INTERVAL_START
+        while True:
+            try:
+                conn.collect()
+                conn.connect()
+            except connection_errors(conn) as e:
+                if deadline is not None:
+                    interval = min(interval, deadline - time.time())
+                    if interval <= 0:
+                        return False
+                LOG.warning("Reconnecting to the broker failed: %s, retrying "
+                            "in %s seconds.", e, interval)
+            else:
+                LOG.info("Reconnected to the broker.")
+                return True
+            if stop_event is None:
+                time.sleep(interval)
+            elif stop_event.wait(interval):
+                return False
+            interval = min(interval * 2, self.RECONNECT_INTERVAL_MAX)
 
     @staticmethod
     def _make_exchange(name, durable=False, auto_delete=True):
@@ -53,9 +145,50 @@ class Base(object):
                               auto_delete=auto_delete)
 
     @staticmethod
-    def _make_queue(name, exchange, durable=False, auto_delete=True):
-        """Make named queue for a given exchange."""
+    def _make_queue(name, exchange, durable=False, auto_delete=True,
+                    routing_keys=None, max_priority=None):
+        """Make named queue for a given exchange.
+
+        If `routing_keys` are given the queue is bound to the exchange once
+        per routing key instead of with the default empty routing key. If
+        `max_priority` is given the queue is a priority queue.
+        """
+        queue_arguments = None
+        if max_priority is not None:
+            queue_arguments = {'x-max-priority': max_priority}
+        if routing_keys is not None:
+            return kombu.Queue(name=name,
+                               bindings=[kombu.binding(exchange, routing_key=k)
+                                         for k in routing_keys],
+                               durable=durable,
+                               auto_delete=auto_delete,
+                               queue_arguments=queue_arguments)
         return kombu.Queue(name=name,
                            exchange=exchange,
                            durable=durable,
-                           auto_delete=auto_delete)
+                           auto_delete=auto_delete,
+                           queue_arguments=queue_arguments)
+
+    @staticmethod
+    def _make_control_queue(prefix):
+        """Make an exclusive queue used to wake up a consume loop."""
+        return kombu.Queue(name='{0}_control_{1}'.format(prefix, uuid.uuid4()),
+                           exclusive=True,
+                           auto_delete=True)
+
+    def _wakeup(self, control_queue):
+        """Wake up the consume loop consuming from the control queue, so it
+        doesn't wait for the drain timeout.
+
+        The broker is tried only once, the consume loop notices that it
+        should stop after the drain timeout anyway.
+        """
+        try:
+            with kombu.connections[self._conn].acquire(block=True) as conn:
+                conn.ensure_connection(max_retries=0)
+                conn.Producer().publish(body='wakeup',
+                                        serializer='json',
+                                        exchange='',
+                                        routing_key=control_queue.name)
+        except Exception as e:
+            LOG.warning("Failed to wake up the consume loop: %s", e)
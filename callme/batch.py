@@ -0,0 +1,118 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class Batcher(object):
+    """This class is used to collect items into batches which are passed to
+    a handler on a background thread.
+
+    A batch is handed over as soon as it is full or `max_wait` seconds after
+    the batcher started to fill it.
+
+    :param handler: the callable invoked with a list of items
+    :keyword max_batch: the maximal number of items in a batch
+    :keyword max_wait: the number of seconds to wait for a batch to fill up
+    :keyword name: the name of the background thread
+    """
+
+    def __init__(self, handler, max_batch=256, max_wait=0.005,
+                 name='callme-batcher'):
+        if max_batch < 1:
+            raise ValueError("Batch size must be positive, got {0}."
+                             .format(max_batch))
+        self._handler = handler
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._name = name
+        self._items = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the background thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, item):
+        """Add an item to the batch being filled."""
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify()
+
+    def stop(self, wait=False):
+        """Stop the background thread once the collected items are handled.
+
+        :keyword wait: block until the background thread has exited
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _next_batch(self):
+        """Wait for the next batch.
+
+        :rtype: list of items, an empty list if the batcher is stopped
+        """
+        with self._cond:
+            while self._running and not self._items:
+                self._cond.wait()
+            deadline = time.time() + self._max_wait
+            while self._running and len(self._items) < self._max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._items[:self._max_batch]
+            del self._items[:self._max_batch]
+            return batch
+
+    def _run(self):
+        """Background thread main loop."""
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            LOG.debug("Handle batch of %d items.", len(batch))
+            try:
+                self._handler(batch)
+            except Exception:
+                LOG.exception("Batch handler failed.")
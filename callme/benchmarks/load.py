@@ -0,0 +1,388 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Load generator driving a server at a fixed rate or with closed-loop
+clients, installed as the `callme-bench` command:
+
+    callme-bench fooserver --rate 500 --duration 60 --function echo
+    callme-bench --local --closed --clients 8 --duration 10
+
+With `--rate` the load is open-loop: requests are scheduled at fixed
+intervals regardless of how fast responses come back, and their latency is
+measured from the time they were scheduled, not sent. A server stalling for a
+second is thus charged for every request that should have been sent during
+the stall instead of the single one that was stuck, which is the coordinated
+omission ad-hoc loops suffer from. The latencies measured from the actual send
+are reported too for comparison.
+
+With `--closed` every client calls back-to-back; `--expected-interval`
+corrects its latencies for coordinated omission the way HdrHistogram does, by
+adding the samples a client missed while waiting on a slow call.
+
+`--local` runs a dummy server in this process, by default over kombu's
+`memory://` transport.
+"""
+
+import argparse
+import collections
+import json
+import math
+import platform
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import callme
+from callme import exceptions as exc
+
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p99.9', 99.9),
+               ('p99.99', 99.99), ('max', 100))
+
+
+class LatencyHistogram(object):
+    """This class is used to record latencies the way HdrHistogram does:
+    values are counted in log-linear buckets of microseconds, so memory stays
+    bounded whatever the number of samples and every percentile is reported
+    with a relative error below 1 / 2 ** `significant_bits`.
+
+    A histogram isn't thread-safe, use one per thread and :func:`merge` them.
+
+    :keyword significant_bits: the number of significant bits kept of every
+        value
+    """
+
+    def __init__(self, significant_bits=7):
+        self.significant_bits = significant_bits
+        self.count = 0
+        self.max = 0
+        self._total = 0
+        self._counts = collections.defaultdict(int)
+
+    def _record(self, value, count=1):
+        shift = max(value.bit_length() - self.significant_bits, 0)
+        # buckets are keyed by the highest value they hold
+        self._counts[((value >> shift) + 1 << shift) - 1] += count
+        self.count += count
+        self._total += value * count
+        self.max = max(self.max, value)
+
+    def record(self, latency, expected_interval=None):
+        """Record a latency in seconds.
+
+        :param latency: the latency to record
+        :keyword expected_interval: the interval in seconds between the calls
+            of a closed-loop client, if given the calls it couldn't make while
+            waiting are recorded too, with linearly decreasing latencies
+        """
+        value = int(round(latency * 1e6))
+        self._record(value)
+        if expected_interval:
+            interval = int(round(expected_interval * 1e6))
+            missing = value - interval
+            while missing >= interval:
+                self._record(missing)
+                missing -= interval
+
+    def merge(self, other):
+        """Add the values recorded by another histogram."""
+        for value, count in other._counts.items():
+            self._counts[value] += count
+        self.count += other.count
+        self._total += other._total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Return the latency in seconds at a percentile, `None` if nothing
+        was recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for value in sorted(self._counts):
+            seen += self._counts[value]
+            if seen >= rank:
+                return min(value, self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """Return the mean and percentiles in milliseconds.
+
+        :rtype: dict
+        """
+        summary = {}
+        for name, percent in PERCENTILES:
+            value = self.percentile(percent)
+            summary[name] = value * 1000 if value is not None else None
+        summary['mean'] = (self._total / 1000.0 / self.count
+                           if self.count else None)
+        return summary
+
+
+class _Client(object):
+    """This class is used to make the calls of one load generating thread
+    and to keep its own counts, merged when the run is over.
+    """
+
+    def __init__(self, proxy, func_name, args, expected_interval=None):
+        self._call = getattr(proxy, func_name)
+        self._args = args
+        self._expected_interval = expected_interval
+        self.corrected = LatencyHistogram()
+        self.uncorrected = LatencyHistogram()
+        self.errors = 0
+        self.timeouts = 0
+
+    def call(self, scheduled=None):
+        """Make a call, its corrected latency is measured from `scheduled`."""
+        started = time.time()
+        try:
+            self._call(*self._args)
+        except exc.RpcTimeout:
+            self.timeouts += 1
+            return
+        except Exception:
+            self.errors += 1
+            return
+        finished = time.time()
+        self.uncorrected.record(finished - started)
+        self.corrected.record(finished - (scheduled or started),
+                              self._expected_interval)
+
+    def run_scheduled(self, schedule):
+        """Make a call at every time taken from the `schedule` queue, until
+        `None` is taken.
+        """
+        while True:
+            scheduled = schedule.get()
+            if scheduled is None:
+                return
+            self.call(scheduled)
+
+    def run_closed(self, deadline):
+        """Make calls back-to-back until the `deadline`."""
+        while time.time() < deadline:
+            self.call()
+
+
+def _dispatch(schedule, rate, started, duration, clients):
+    interval = 1.0 / rate
+    i = 0
+    while True:
+        scheduled = started + i * interval
+        if scheduled >= started + duration:
+            break
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        schedule.put(scheduled)
+        i += 1
+    for _ in range(clients):
+        schedule.put(None)
+
+
+def run(proxies, func_name, args, duration, rate=None,
+        expected_interval=None):
+    """Drive a server with one client thread per proxy for `duration`
+    seconds, at a fixed `rate` of calls per second shared by the clients, or
+    back-to-back if `rate` is `None`.
+
+    :rtype: dict with the number of calls, errors and timeouts, the
+        throughput and the latency percentiles in milliseconds
+    """
+    clients = [_Client(p, func_name, args,
+                       None if rate else expected_interval)
+               for p in proxies]
+    started = time.time()
+    if rate:
+        schedule = queue.Queue()
+        threads = [threading.Thread(target=c.run_scheduled, args=(schedule,))
+                   for c in clients]
+        threads.append(threading.Thread(
+            target=_dispatch,
+            args=(schedule, rate, started, duration, len(clients))))
+    else:
+        threads = [threading.Thread(target=c.run_closed,
+                                    args=(started + duration,))
+                   for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    corrected = LatencyHistogram()
+    uncorrected = LatencyHistogram()
+    for c in clients:
+        corrected.merge(c.corrected)
+        uncorrected.merge(c.uncorrected)
+    calls = uncorrected.count
+    return {'calls': calls,
+            'errors': sum(c.errors for c in clients),
+            'timeouts': sum(c.timeouts for c in clients),
+            'elapsed': elapsed,
+            'calls_per_sec': calls / elapsed if elapsed else 0,
+            'latency_ms': corrected.summary(),
+            'uncorrected_latency_ms': uncorrected.summary()}
+
+
+def _start_local_server(server_id, func_name, service_time, threaded,
+                        amqp_params):
+    def dummy(*args):
+        if service_time:
+            time.sleep(service_time)
+        return args
+
+    server = callme.Server(server_id, threaded=threaded, **amqp_params)
+    server.register_function(dummy, func_name)
+    t = threading.Thread(target=server.start)
+    t.daemon = True
+    t.start()
+    server.wait()
+    return server, t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='callme-bench',
+        description="Drive a callme server at a fixed rate or with "
+                    "closed-loop clients and report its latency percentiles "
+                    "corrected for coordinated omission.")
+    parser.add_argument('server_id', nargs='?',
+                        help="the id of the server to call, a random one "
+                             "with --local")
+    parser.add_argument('--local', action='store_true',
+                        help="run a dummy server in this process")
+    parser.add_argument('--amqp-host',
+                        help="the broker to use (default: memory:// with "
+                             "--local, localhost otherwise)")
+    parser.add_argument('--amqp-user', default='guest')
+    parser.add_argument('--amqp-password', default='guest')
+    parser.add_argument('--amqp-vhost', default='/')
+    parser.add_argument('--amqp-port', type=int, default=5672)
+    parser.add_argument('--polling-interval', type=float, default=0.001,
+                        help="seconds between polls of transports without "
+                             "push delivery like memory:// "
+                             "(default: %(default)s)")
+    parser.add_argument('--function', default='echo',
+                        help="the function to call (default: %(default)s)")
+    parser.add_argument('--args', type=json.loads, default=[],
+                        help="the JSON list of arguments of the calls "
+                             "(default: [])")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds to run (default: %(default)s)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--rate', type=float,
+                      help="open-loop load in calls per second")
+    mode.add_argument('--closed', action='store_true',
+                      help="closed-loop load, clients call back-to-back")
+    parser.add_argument('--clients', type=int, default=8,
+                        help="the number of client threads, each with its "
+                             "own proxy (default: %(default)s)")
+    parser.add_argument('--expected-interval', type=float,
+                        help="the expected seconds between calls of a "
+                             "closed-loop client, to correct its latencies "
+                             "for coordinated omission")
+    parser.add_argument('--timeout', type=float, default=10,
+                        help="the timeout of calls in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument('--service-time', type=float, default=0,
+                        help="seconds the dummy server of --local spends in "
+                             "every call (default: %(default)s)")
+    parser.add_argument('--threaded', action='store_true',
+                        help="run the dummy server of --local threaded")
+    parser.add_argument('--output', help="write the JSON report to a file")
+    args = parser.parse_args(argv)
+
+    if not args.rate and not args.closed:
+        parser.error("one of --rate or --closed is required")
+    if args.server_id is None and not args.local:
+        parser.error("a server_id is required without --local")
+    if not isinstance(args.args, list):
+        parser.error("--args must be a JSON list")
+
+    amqp_params = {
+        'amqp_host': args.amqp_host or (
+            'memory://' if args.local else 'localhost'),
+        'amqp_user': args.amqp_user,
+        'amqp_password': args.amqp_password,
+        'amqp_vhost': args.amqp_vhost,
+        'amqp_port': args.amqp_port,
+        'transport_options': {'polling_interval': args.polling_interval},
+    }
+    server_id = args.server_id or 'bench_{0}'.format(uuid.uuid4().hex)
+    server = None
+    if args.local:
+        server, server_thread = _start_local_server(
+            server_id, args.function, args.service_time, args.threaded,
+            amqp_params)
+    try:
+        proxies = [callme.Proxy(server_id, timeout=args.timeout,
+                                **amqp_params)
+                   for _ in range(args.clients)]
+        result = run(proxies, args.function, args.args, args.duration,
+                     rate=args.rate, expected_interval=args.expected_interval)
+    finally:
+        if server is not None:
+            server.stop()
+            server_thread.join()
+
+    sys.stderr.write("{calls} calls, {errors} errors, {timeouts} timeouts, "
+                     "{calls_per_sec:.1f} calls/s\n".format(**result))
+    for name, _ in PERCENTILES:
+        value = result['latency_ms'][name]
+        if value is not None:
+            sys.stderr.write("{0:>7} {1:10.3f} ms\n".format(name, value))
+
+    report = {'callme_version': callme.__version__,
+              'python_version': platform.python_version(),
+              'amqp_host': amqp_params['amqp_host'],
+              'server_id': server_id,
+              'local': args.local,
+              'function': args.function,
+              'duration': args.duration,
+              'rate': args.rate,
+              'clients': args.clients,
+              'expected_interval': args.expected_interval}
+    report.update(result)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
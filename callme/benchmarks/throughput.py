@@ -0,0 +1,215 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Throughput and latency benchmark of the Proxy and the Server.
+
+It runs a server echoing its argument and a number of client threads each
+calling it through its own proxy as fast as possible, for every combination
+of server mode, payload size and number of clients. The results are written
+as JSON, e.g. to compare releases:
+
+    python -m callme.benchmarks --output results.json
+
+By default everything runs in this process over kombu's `memory://`
+transport, polled every millisecond, use `--amqp-host` to benchmark a
+broker.
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import threading
+import time
+import uuid
+
+import callme
+
+MODES = ('serial', 'threaded')
+PAYLOAD_SIZES = (0, 1024, 65536)
+CLIENTS = (1, 4, 16)
+
+
+def percentile(values, percent):
+    """Return the percentile of sorted values by the nearest-rank method."""
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(latencies, elapsed):
+    """Summarize the latencies of the calls made in `elapsed` seconds.
+
+    :rtype: dict with the number of calls, calls per second and latency
+        percentiles in milliseconds
+    """
+    latencies = sorted(latencies)
+    latency_ms = {}
+    for name, percent in (('p50', 50), ('p90', 90), ('p99', 99),
+                          ('max', 100)):
+        value = percentile(latencies, percent)
+        latency_ms[name] = value * 1000 if value is not None else None
+    if latencies:
+        latency_ms['mean'] = sum(latencies) * 1000 / len(latencies)
+    else:
+        latency_ms['mean'] = None
+    return {'calls': len(latencies),
+            'calls_per_sec': len(latencies) / elapsed if elapsed else 0,
+            'latency_ms': latency_ms}
+
+
+def _run_server(server):
+    t = threading.Thread(target=server.start)
+    t.daemon = True
+    t.start()
+    server.wait()
+    return t
+
+
+def run_case(amqp_host, mode, payload_size, clients, duration, timeout=10,
+             transport_options=None):
+    """Benchmark one combination of server mode, payload size and number of
+    clients for `duration` seconds.
+
+    :rtype: dict describing the case and its results
+    """
+    server_id = 'bench_{0}'.format(uuid.uuid4().hex)
+    server = callme.Server(server_id, amqp_host=amqp_host,
+                           threaded=(mode == 'threaded'),
+                           transport_options=transport_options)
+    server.register_function(lambda payload: payload, 'echo')
+    server_thread = _run_server(server)
+
+    payload = b'x' * payload_size
+    proxies = [callme.Proxy(server_id, amqp_host=amqp_host, timeout=timeout,
+                            transport_options=transport_options)
+               for _ in range(clients)]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    start = threading.Event()
+
+    def client(proxy, deadline):
+        start.wait()
+        own_latencies = []
+        own_errors = 0
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                proxy.echo(payload)
+            except Exception:
+                own_errors += 1
+            else:
+                own_latencies.append(time.time() - started)
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    try:
+        started = time.time()
+        threads = [threading.Thread(target=client,
+                                    args=(p, started + duration))
+                   for p in proxies]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+    finally:
+        server.stop()
+        server_thread.join()
+
+    result = {'mode': mode,
+              'payload_size': payload_size,
+              'clients': clients,
+              'errors': errors[0]}
+    result.update(summarize(latencies, elapsed))
+    return result
+
+
+def _parse_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m callme.benchmarks',
+        description="Benchmark callme throughput and latency.")
+    parser.add_argument('--amqp-host', default='memory://',
+                        help="the broker to use (default: %(default)s)")
+    parser.add_argument('--duration', type=float, default=5,
+                        help="seconds per case (default: %(default)s)")
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help="server modes (default: %(default)s)")
+    parser.add_argument('--payload-sizes', type=_parse_list,
+                        default=list(PAYLOAD_SIZES),
+                        help="payload sizes in bytes (default: 0,1024,65536)")
+    parser.add_argument('--clients', type=_parse_list, default=list(CLIENTS),
+                        help="numbers of concurrent clients "
+                             "(default: 1,4,16)")
+    parser.add_argument('--polling-interval', type=float, default=0.001,
+                        help="seconds between polls of transports without "
+                             "push delivery like memory:// "
+                             "(default: %(default)s)")
+    parser.add_argument('--output', help="write the JSON results to a file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes.split(','):
+        if mode not in MODES:
+            parser.error("unknown mode '{0}'".format(mode))
+        for payload_size in args.payload_sizes:
+            for clients in args.clients:
+                result = run_case(
+                    args.amqp_host, mode, payload_size, clients,
+                    args.duration, transport_options={
+                        'polling_interval': args.polling_interval})
+                sys.stderr.write("{mode} payload={payload_size} "
+                                 "clients={clients}: {calls_per_sec:.1f} "
+                                 "calls/s\n".format(**result))
+                results.append(result)
+
+    report = {'callme_version': callme.__version__,
+              'python_version': platform.python_version(),
+              'amqp_host': args.amqp_host,
+              'duration': args.duration,
+              'polling_interval': args.polling_interval,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
@@ -0,0 +1,106 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import pickle
+import threading
+import time
+
+
+def make_key(func_args, func_keywords):
+    """Make a cache key from the arguments of a call.
+
+    :rtype: the pickled arguments or `None` if they can't be pickled
+    """
+    try:
+        return pickle.dumps((tuple(func_args), sorted(func_keywords.items())),
+                            protocol=2)
+    except Exception:
+        return None
+
+
+class ResultCache(object):
+    """This class is used to cache the results of a function.
+
+    It is a thread-safe LRU cache whose entries optionally expire.
+
+    :keyword size: the maximal number of cached results
+    :keyword ttl: the number of seconds a result stays valid, `None` means
+        results never expire
+    """
+
+    def __init__(self, size=128, ttl=None):
+        if size < 1:
+            raise ValueError("Cache size must be positive, got {0}."
+                             .format(size))
+        self._size = size
+        self._ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a `(found, result)` tuple for the given key."""
+        with self._lock:
+            try:
+                expires, result = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return False, None
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return False, None
+            # re-insert to mark the entry as most recently used
+            self._data[key] = (expires, result)
+            self.hits += 1
+            return True, result
+
+    def set(self, key, result):
+        """Cache the result for the given key."""
+        expires = time.time() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, result)
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return the hit and miss counters and the number of entries."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._data)}
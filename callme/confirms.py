@@ -0,0 +1,143 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import socket
+import time
+
+
+class ConfirmWindow(object):
+    """This class is used to track the messages published on a channel in
+    publisher confirm mode, without waiting for the confirm of each one.
+
+    The broker confirms messages asynchronously, in the order they were
+    published, possibly many at once. Confirms are processed whenever the
+    connection of the channel is drained; only when `size` messages are
+    unconfirmed does publishing have to wait for confirms, see
+    :func:`wait`.
+
+    :param channel: the channel to put in confirm mode, the messages have to
+        be published on it
+    :param on_nack: callable called with every message the broker failed to
+        take over
+    :keyword size: the maximal number of unconfirmed messages
+    :raise ValueError: if the transport doesn't support publisher confirms
+    """
+
+    def __init__(self, channel, on_nack, size=1024):
+        if not hasattr(channel, 'confirm_select'):
+            raise ValueError("The transport doesn't support publisher "
+                             "confirms.")
+        self.size = size
+        self._on_nack = on_nack
+        self._next_tag = 1
+        # delivery tag -> message
+        self._unconfirmed = collections.OrderedDict()
+        channel.confirm_select()
+        channel.events['basic_ack'].add(self._ack)
+        channel.events['basic_nack'].add(self._nack)
+
+    def __len__(self):
+        return len(self._unconfirmed)
+
+    def full(self):
+        """Return whether publishing has to wait for confirms."""
+        return len(self._unconfirmed) >= self.size
+
+    def track(self, message):
+        """Track a message just published on the channel.
+
+        :param message: the object passed to `on_nack` if the message isn't
+            confirmed
+        """
+        self._unconfirmed[self._next_tag] = message
+        self._next_tag += 1
+
+    def _settle(self, delivery_tag, multiple):
+        if not multiple:
+            message = self._unconfirmed.pop(delivery_tag, None)
+            return [] if message is None else [message]
+        messages = []
+        while self._unconfirmed:
+            tag = next(iter(self._unconfirmed))
+            if tag > delivery_tag:
+                break
+            messages.append(self._unconfirmed.pop(tag))
+        return messages
+
+    def _ack(self, delivery_tag, multiple):
+        self._settle(delivery_tag, multiple)
+
+    def _nack(self, delivery_tag, multiple):
+        for message in self._settle(delivery_tag, multiple):
+            self._on_nack(message)
+
+    def unconfirmed(self):
+        """Stop tracking the unconfirmed messages, e.g. because the
+        connection was lost, and return them.
+
+        :rtype: list of messages in the order they were published
+        """
+        messages = list(self._unconfirmed.values())
+        self._unconfirmed.clear()
+        return messages
+
+    def wait(self, conn, timeout=None, empty=False):
+        """Process confirms until the window isn't full any more.
+
+        :param conn: the connection of the channel
+        :keyword timeout: the maximal number of seconds to wait
+        :keyword empty: wait until all messages are confirmed
+        :rtype: `True` if the window has room, `False` on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._unconfirmed if empty else self.full():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            try:
+                conn.drain_events(timeout=1)
+            except socket.timeout:
+                pass
+        return True
+
+
+def settle(conn, limit=64):
+    """Process the confirms already received on a connection, without
+    blocking.
+
+    :param conn: the connection to drain
+    :keyword limit: the maximal number of events to process
+    """
+    try:
+        for _ in range(limit):
+            conn.drain_events(timeout=0)
+    except socket.timeout:
+        pass
@@ -40,3 +40,17 @@ class ConnectionError(CallmeException):
 
 class RpcTimeout(CallmeException):
     """Raised when RPC request timed out."""
+
+
+class RpcOverloaded(CallmeException):
+    """Raised when the server rejected RPC request because it is overloaded."""
+
+
+class RpcCancelled(CallmeException):
+    """Raised when the result of a cancelled RPC request is requested."""
+
+
+class RpcPublishFailed(CallmeException):
+    """Raised when the broker failed to take over a RPC request published with
+    publisher confirms.
+    """
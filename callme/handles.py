@@ -0,0 +1,123 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import threading
+import time
+import uuid
+
+
+class HandleTable(object):
+    """This class is used to keep the objects returned by reference to the
+    clients.
+
+    It is thread-safe. Every handle counts its references and is removed
+    when all of them are released or when it wasn't used for `ttl` seconds.
+
+    :keyword ttl: the number of seconds an unused handle is kept
+    :keyword size: the maximal number of handles, the least recently used
+        handles are removed first
+    """
+
+    def __init__(self, ttl=300, size=1024):
+        if size < 1:
+            raise ValueError("Handle table size must be positive, got {0}."
+                             .format(size))
+        self._ttl = ttl
+        self._size = size
+        # handle id -> [object, reference count, expiration time]
+        self._handles = collections.OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+    def _remove(self, handle_id):
+        obj = self._handles.pop(handle_id)[0]
+        self._ids.pop(id(obj), None)
+
+    def _expire(self, now):
+        for handle_id, entry in list(self._handles.items()):
+            if entry[2] >= now:
+                break
+            self._remove(handle_id)
+
+    def add(self, obj):
+        """Add a reference to the object.
+
+        :rtype: the id of the object's handle
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            handle_id = self._ids.get(id(obj))
+            if handle_id is None:
+                handle_id = uuid.uuid4().hex
+                entry = [obj, 0, None]
+                self._ids[id(obj)] = handle_id
+            else:
+                entry = self._handles.pop(handle_id)
+            entry[1] += 1
+            entry[2] = now + self._ttl
+            self._handles[handle_id] = entry
+            while len(self._handles) > self._size:
+                self._remove(next(iter(self._handles)))
+        return handle_id
+
+    def get(self, handle_id):
+        """Return the object of the handle with the given id.
+
+        :raise KeyError: if there is no such handle
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            try:
+                entry = self._handles.pop(handle_id)
+            except KeyError:
+                raise KeyError("Handle '{0}' doesn't exist or expired."
+                               .format(handle_id))
+            # re-insert to keep the handles ordered by expiration time
+            entry[2] = now + self._ttl
+            self._handles[handle_id] = entry
+            return entry[0]
+
+    def release(self, handle_id):
+        """Release a reference to the handle with the given id."""
+        with self._lock:
+            entry = self._handles.get(handle_id)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                self._remove(handle_id)
@@ -0,0 +1,138 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pickle
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class MemoryResultStore(object):
+    """This class is used to keep the results of jobs in memory, e.g. for
+    tests. The results are lost when the server stops.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id):
+        """Add a pending job."""
+        with self._lock:
+            self._jobs[job_id] = (PENDING, None)
+
+    def set_running(self, job_id):
+        """Mark a job as running."""
+        with self._lock:
+            self._jobs[job_id] = (RUNNING, None)
+
+    def set_result(self, job_id, response):
+        """Store the `RpcResponse` of a job and mark it as done."""
+        with self._lock:
+            self._jobs[job_id] = (DONE, response)
+
+    def get(self, job_id):
+        """Return the `(state, response)` tuple of a job, the response is
+        `None` unless the job is done.
+
+        :raise KeyError: if there is no such job
+        """
+        with self._lock:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise KeyError("Job '{0}' doesn't exist.".format(job_id))
+
+    def delete(self, job_id):
+        """Remove a job and its result."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+class SqliteResultStore(object):
+    """This class is used to keep the results of jobs in a SQLite database
+    file, so that they survive restarts and can be shared by the servers of
+    a host.
+
+    :keyword path: the path of the database file
+    """
+
+    def __init__(self, path='callme_jobs.sqlite'):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS callme_jobs ("
+                "job_id TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                "updated REAL NOT NULL, response BLOB)")
+
+    def _execute(self, sql, *args):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, args).fetchone()
+
+    def create(self, job_id):
+        """Add a pending job."""
+        self._execute("INSERT OR REPLACE INTO callme_jobs "
+                      "(job_id, state, updated) VALUES (?, ?, ?)",
+                      job_id, PENDING, time.time())
+
+    def set_running(self, job_id):
+        """Mark a job as running."""
+        self._execute("UPDATE callme_jobs SET state = ?, updated = ? "
+                      "WHERE job_id = ?", RUNNING, time.time(), job_id)
+
+    def set_result(self, job_id, response):
+        """Store the `RpcResponse` of a job and mark it as done."""
+        data = sqlite3.Binary(pickle.dumps(response, protocol=2))
+        self._execute("UPDATE callme_jobs SET state = ?, updated = ?, "
+                      "response = ? WHERE job_id = ?",
+                      DONE, time.time(), data, job_id)
+
+    def get(self, job_id):
+        """Return the `(state, response)` tuple of a job, the response is
+        `None` unless the job is done.
+
+        :raise KeyError: if there is no such job
+        """
+        row = self._execute("SELECT state, response FROM callme_jobs "
+                            "WHERE job_id = ?", job_id)
+        if row is None:
+            raise KeyError("Job '{0}' doesn't exist.".format(job_id))
+        state, data = row
+        return state, pickle.loads(bytes(data)) if data is not None else None
+
+    def delete(self, job_id):
+        """Remove a job and its result."""
+        self._execute("DELETE FROM callme_jobs WHERE job_id = ?", job_id)
@@ -0,0 +1,202 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import bisect
+import threading
+
+try:
+    from http import server as http_server
+except ImportError:  # pragma: no cover
+    import BaseHTTPServer as http_server
+
+# upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+class Histogram(object):
+    """This class is used to count observed values in buckets.
+
+    :keyword buckets: the sorted upper bounds of the buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Count a value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Return `(upper bound, count)` tuples of the cumulative counts,
+        the last upper bound is `+Inf`.
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry(object):
+    """This class is used to collect the metrics of proxies and servers.
+
+    It is the default metrics sink, any object with the `inc` and `observe`
+    methods can be used instead, e.g. to forward the metrics to a statsd or
+    Prometheus client library. It is thread-safe.
+
+    :keyword buckets: the upper bounds in seconds of the histogram buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter.
+
+        :param name: the name of the counter
+        :keyword labels: dict of label values
+        :keyword value: the increment
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """Observe a value, usually a duration in seconds, in a histogram.
+
+        :param name: the name of the histogram
+        :param value: the observed value
+        :keyword labels: dict of label values
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets)
+            histogram.observe(value)
+
+    def get_counter(self, name, labels=None):
+        """Return the value of a counter."""
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def get_histogram(self, name, labels=None):
+        """Return a `(count, sum)` tuple of a histogram."""
+        with self._lock:
+            histogram = self._histograms.get(self._key(name, labels))
+            if histogram is None:
+                return 0, 0.0
+            return histogram.count, histogram.sum
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            last_name = None
+            for (name, labels), value in sorted(self._counters.items()):
+                if name != last_name:
+                    lines.append('# TYPE {0} counter'.format(name))
+                    last_name = name
+                lines.append('{0}{1} {2}'.format(
+                    name, _format_labels(labels), value))
+            last_name = None
+            for (name, labels), histogram in sorted(
+                    self._histograms.items(), key=lambda item: item[0]):
+                if name != last_name:
+                    lines.append('# TYPE {0} histogram'.format(name))
+                    last_name = name
+                for bound, count in histogram.cumulative_counts():
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        name, _format_labels(labels, [('le', bound)]),
+                        count))
+                lines.append('{0}_sum{1} {2}'.format(
+                    name, _format_labels(labels), histogram.sum))
+                lines.append('{0}_count{1} {2}'.format(
+                    name, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(registry, port=9100, host=''):
+    """Serve the metrics of a registry to Prometheus over HTTP from a
+    background thread.
+
+    :param registry: the :class:`MetricsRegistry`
+    :keyword port: the port to listen on
+    :keyword host: the address to listen on, all addresses by default
+    :rtype: the HTTP server, call its `shutdown()` method to stop it
+    """
+    class Handler(http_server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http_server.HTTPServer((host, port), Handler)
+    t = threading.Thread(target=httpd.serve_forever,
+                         name='callme-metrics')
+    t.daemon = True
+    t.start()
+    return httpd
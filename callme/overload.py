@@ -0,0 +1,104 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import threading
+import time
+
+
+class LoadShedder(object):
+    """This class is used to decide whether a server is overloaded.
+
+    The server is overloaded when the number of requests it accepted but
+    didn't finish yet reaches `max_backlog`, or when the mean execution time
+    of the requests finished in the last `window` seconds exceeds
+    `max_latency`.
+
+    :keyword max_backlog: the maximal number of unfinished requests, `None`
+        means no limit
+    :keyword max_latency: the maximal mean execution time in seconds, `None`
+        means no limit
+    :keyword window: the number of seconds execution times are averaged over
+    """
+
+    def __init__(self, max_backlog=None, max_latency=None, window=10):
+        self._max_backlog = max_backlog
+        self._max_latency = max_latency
+        self._window = window
+        self._backlog = 0
+        self._samples = collections.deque()
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def backlog(self):
+        """Return the number of unfinished requests."""
+        return self._backlog
+
+    def accept(self):
+        """Accept a request unless the server is overloaded.
+
+        :rtype: `True` if the request was accepted
+        """
+        with self._lock:
+            if (self._max_backlog is not None and
+                    self._backlog >= self._max_backlog):
+                return False
+            if (self._max_latency is not None and
+                    self._mean_latency() > self._max_latency):
+                return False
+            self._backlog += 1
+            return True
+
+    def finish(self, duration=None, count=1):
+        """Finish accepted requests.
+
+        :keyword duration: the execution time in seconds, `None` if the
+            requests were not executed
+        :keyword count: the number of requests finished
+        """
+        with self._lock:
+            self._backlog -= count
+            if duration is not None:
+                self._samples.append((time.time(), duration))
+                self._total += duration
+
+    def _mean_latency(self):
+        """Return the mean execution time over the window, 0 without
+        samples.
+        """
+        oldest = time.time() - self._window
+        while self._samples and self._samples[0][0] < oldest:
+            self._total -= self._samples.popleft()[1]
+        if not self._samples:
+            self._total = 0.0
+            return 0
+        return self._total / len(self._samples)
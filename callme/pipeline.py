@@ -0,0 +1,138 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+
+from callme import cache
+from callme import exceptions as exc
+from callme import protocol as pr
+
+
+def has_promises(request):
+    """Check whether promises are among the arguments of a request."""
+    values = list(request.func_args) + list(request.func_keywords.values())
+    return any(isinstance(v, pr.RpcPromise) for v in values)
+
+
+class _Waiter(object):
+    """The result of a call the calls passing its promise wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class PromiseTable(object):
+    """This class is used to keep the results of pipelined calls until the
+    calls depending on them are executed.
+
+    It is thread-safe, results are kept in a LRU cache and expire. Calls
+    already waiting for a result get it directly, even if it is evicted
+    from the cache right away.
+
+    :keyword size: the maximal number of kept results
+    :keyword ttl: the number of seconds a result is kept
+    """
+
+    def __init__(self, size=1024, ttl=60):
+        self._results = cache.ResultCache(size, ttl)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def expect(self, correlation_id):
+        """Announce the result of the call with the given correlation id."""
+        with self._lock:
+            self._pending.setdefault(correlation_id, _Waiter())
+
+    def set(self, correlation_id, response=None):
+        """Keep the response of the call with the given correlation id and
+        wake up the calls waiting for it.
+
+        :keyword response: the `RpcResponse` of the call, `None` if the call
+            was dropped, which doesn't replace a kept response
+        """
+        with self._lock:
+            # a dropped call is kept as `None`, so it isn't waited for
+            if response is not None or not self._results.get(
+                    correlation_id)[0]:
+                self._results.set(correlation_id, response)
+            waiter = self._pending.pop(correlation_id, None)
+        if waiter is not None:
+            waiter.response = response
+            waiter.done.set()
+
+    def get(self, correlation_id, timeout=None):
+        """Wait for the result of the call with the given correlation id.
+
+        The result of a call that wasn't announced yet is waited for too,
+        the call may reach the server after the calls passing its promise,
+        e.g. through the dedicated queue of its function.
+
+        :raise ValueError: if the result was dropped
+        :raise RpcTimeout: if the result didn't arrive in time
+        :raise: the exception raised by the call
+        """
+        with self._lock:
+            found, response = self._results.get(correlation_id)
+            if not found:
+                waiter = self._pending.setdefault(correlation_id, _Waiter())
+        if not found:
+            if not waiter.done.wait(timeout):
+                with self._lock:
+                    if self._pending.get(correlation_id) is waiter:
+                        del self._pending[correlation_id]
+                raise exc.RpcTimeout("Promised result of call {0} timed out."
+                                     .format(correlation_id))
+            response = waiter.response
+        if response is None:
+            raise ValueError("Promised result of call {0} is not available."
+                             .format(correlation_id))
+        if response.is_exception:
+            raise response.result
+        return response.result
+
+    def resolve(self, request, timeout=None):
+        """Replace the promises among the arguments of a request with the
+        results they stand for.
+
+        :rtype: the request with resolved arguments
+        """
+        def _resolve(value):
+            if isinstance(value, pr.RpcPromise):
+                return self.get(value.correlation_id, timeout)
+            return value
+
+        if not has_promises(request):
+            return request
+        func_args = tuple(_resolve(v) for v in request.func_args)
+        func_keywords = dict((k, _resolve(v))
+                             for k, v in request.func_keywords.items())
+        return pr.RpcRequest(request.func_name, func_args, func_keywords)
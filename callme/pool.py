@@ -0,0 +1,259 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import math
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """This class is used to execute calls on a number of worker threads.
+
+    :param size: the number of worker threads
+    :param name: the name prefix of the worker threads
+    :param tasks: the queue the calls are dispatched from, e.g. a
+        `callme.scheduler.FairScheduler` (defaults to a FIFO queue)
+    """
+
+    def __init__(self, size, name='callme-worker', tasks=None):
+        if size < 1:
+            raise ValueError("Pool size must be positive, got {0}."
+                             .format(size))
+        self._size = size
+        self._name = name
+        self._tasks = tasks if tasks is not None else queue.Queue()
+        self._threads = []
+        self._spawned = 0
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Return the number of worker threads."""
+        return self._size
+
+    @property
+    def busy(self):
+        """Return the number of workers executing a call."""
+        return self._busy
+
+    @property
+    def pending(self):
+        """Return the approximate number of calls waiting for a worker."""
+        return self._tasks.qsize()
+
+    @property
+    def ready(self):
+        """Return the approximate number of calls waiting for a worker which
+        can be dispatched right away, e.g. not held back by a rate limit of
+        the scheduler.
+        """
+        ready = getattr(self._tasks, 'ready', None)
+        return self._tasks.qsize() if ready is None else ready()
+
+    def start(self):
+        """Start the worker threads."""
+        with self._lock:
+            self._spawn(self._size)
+
+    def resize(self, size):
+        """Change the number of worker threads. Surplus workers exit once
+        the calls submitted before are done.
+
+        :param size: the new number of worker threads
+        """
+        if size < 1:
+            raise ValueError("Pool size must be positive, got {0}."
+                             .format(size))
+        with self._lock:
+            if size > self._size:
+                self._spawn(size - self._size)
+            else:
+                for _ in range(self._size - size):
+                    self._tasks.put(None)
+            self._size = size
+
+    def _spawn(self, count):
+        """Start `count` new worker threads."""
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for _ in range(count):
+            t = threading.Thread(target=self._work,
+                                 name='{0}-{1}'.format(self._name,
+                                                       self._spawned))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+            self._spawned += 1
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` to be executed by a worker."""
+        self._tasks.put((func, args, kwargs))
+
+    def submit_for(self, key, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` on behalf of the client `key`.
+
+        The pool must dispatch from a queue supporting keys like the
+        `callme.scheduler.FairScheduler`.
+        """
+        self._tasks.put((func, args, kwargs), key=key)
+
+    def stop(self, wait=False):
+        """Stop the worker threads once the already submitted calls are done.
+
+        :keyword wait: block until all worker threads have exited
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            for _ in range(self._size):
+                self._tasks.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _work(self):
+        """Worker thread main loop."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            func, args, kwargs = task
+            with self._lock:
+                self._busy += 1
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                LOG.exception("Worker call failed.")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+
+class Slots(object):
+    """This class is used to limit the number of calls taken on, like a
+    semaphore whose waits can time out on any Python version.
+
+    :param size: the number of slots
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Number of slots must be positive, got {0}."
+                             .format(size))
+        self._free = size
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting for one to be released if all are taken.
+
+        :keyword timeout: the maximal number of seconds to wait
+        :rtype: `True` if a slot was taken, `False` on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._free:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+            self._free -= 1
+            return True
+
+    def release(self):
+        """Give a slot back."""
+        with self._cond:
+            self._free += 1
+            self._cond.notify()
+
+
+class Autoscaler(object):
+    """This class is used to decide the size of a worker pool.
+
+    The pool grows right away to the number of busy workers plus the
+    backlog of calls, but only shrinks after the utilization of its workers
+    stayed below `low_utilization` for `cooldown` seconds. It then shrinks
+    to the size keeping the utilization below `high_utilization`.
+
+    :param min_workers: the minimal pool size
+    :param max_workers: the maximal pool size
+    :keyword low_utilization: the fraction of busy workers below which the
+        pool may shrink
+    :keyword high_utilization: the fraction of busy workers the shrunk pool
+        is sized for
+    :keyword cooldown: the number of seconds the utilization must stay low
+        before the pool shrinks
+    """
+
+    def __init__(self, min_workers, max_workers, low_utilization=0.3,
+                 high_utilization=0.8, cooldown=30):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError("Invalid pool size range {0}-{1}."
+                             .format(min_workers, max_workers))
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self._low_utilization = low_utilization
+        self._high_utilization = high_utilization
+        self._cooldown = cooldown
+        self._low_since = None
+
+    def desired_size(self, size, busy, backlog):
+        """Return the pool size for the observed load.
+
+        :param size: the current pool size
+        :param busy: the number of busy workers
+        :param backlog: the number of calls waiting for a worker
+        """
+        demand = busy + backlog
+        if demand > size:
+            self._low_since = None
+            return min(self.max_workers, demand)
+
+        if backlog or busy >= size * self._low_utilization:
+            self._low_since = None
+            return size
+
+        now = time.time()
+        if self._low_since is None:
+            self._low_since = now
+        if now - self._low_since < self._cooldown:
+            return size
+        self._low_since = None
+        return max(self.min_workers,
+                   int(math.ceil(busy / self._high_utilization)))
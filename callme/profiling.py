@@ -0,0 +1,94 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import cProfile
+import pstats
+import threading
+
+
+class Profiler(object):
+    """This class is used to profile the calls of a function with cProfile
+    and to aggregate their statistics. It is called like the function.
+
+    Every call is profiled on its own, so concurrent calls from many threads
+    are profiled too. Python versions allowing a single active profiler run
+    the calls made while another call is profiled without profiling them.
+
+    :param func: the profiled function
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.skipped = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            with self._lock:
+                self.skipped += 1
+            return self.func(*args, **kwargs)
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self.calls += 1
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    def summary(self, limit=30):
+        """Return the aggregated statistics of the profiled calls.
+
+        :keyword limit: the number of functions with the highest cumulative
+            time to include
+        :rtype: dict with the numbers of profiled and skipped calls, and a
+            list of dicts with the statistics of each function
+        """
+        with self._lock:
+            rows = []
+            if self._stats is not None:
+                for key, value in self._stats.stats.items():
+                    ncalls, tottime, cumtime = value[1:4]
+                    rows.append({'function': '{0}:{1}({2})'.format(*key),
+                                 'ncalls': ncalls,
+                                 'tottime': tottime,
+                                 'cumtime': cumtime})
+            rows.sort(key=lambda row: row['cumtime'], reverse=True)
+            return {'calls': self.calls,
+                    'skipped': self.skipped,
+                    'functions': rows[:limit]}
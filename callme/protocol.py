@@ -29,6 +29,64 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import pickle
+
+try:
+    import reprlib
+except ImportError:  # pragma: no cover
+    import repr as reprlib
+
+# content type of pickled message bodies, as used by kombu
+CONTENT_TYPE = 'application/x-python-serialize'
+
+# name of the control function used to cancel a request
+CANCEL_FUNC_NAME = 'callme.cancel'
+# prefix of the names used to call the methods of objects kept on the server
+HANDLE_FUNC_PREFIX = 'callme.handle.'
+
+_summary_repr = reprlib.Repr()
+_summary_repr.maxstring = 60
+_summary_repr.maxother = 60
+_summary_repr.maxlevel = 3
+
+
+def summarize(value):
+    """Return a repr of a value truncated to a bounded size, without
+    building the full repr of large containers and strings.
+    """
+    return _summary_repr.repr(value)
+
+
+class Summary(object):
+    """This class is used to pass a value to a log call, the truncated repr
+    is only computed if the message is emitted.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return summarize(self.value)
+
+
+def dumps(obj):
+    """Pickle a request or response before it is published, e.g. to measure
+    the serialization time.
+
+    :rtype: bytes to publish with :func:`publish_options`
+    """
+    return pickle.dumps(obj, protocol=2)
+
+
+def publish_options(body):
+    """Return the kombu publish keyword arguments for a message body, which
+    is pickled by kombu unless it already is.
+    """
+    if isinstance(body, bytes):
+        return {'content_type': CONTENT_TYPE, 'content_encoding': 'binary'}
+    return {'serializer': 'pickle'}
+
 
 class RpcRequest(object):
     """This class is used to transport the RPC Request to the server.
@@ -44,7 +102,8 @@ class RpcRequest(object):
 
     def __str__(self):
         return ("<RpcRequest(func_name={0}, func_args={1}, func_keywords={2})>"
-                .format(self.func_name, self.func_args, self.func_keywords))
+                .format(self.func_name, summarize(self.func_args),
+                        summarize(self.func_keywords)))
 
 
 class RpcResponse(object):
@@ -56,8 +115,40 @@ class RpcResponse(object):
         self.result = result
 
     def __str__(self):
-        return "<RpcResponse(result={0})>".format(self.result)
+        return "<RpcResponse(result={0})>".format(summarize(self.result))
 
     @property
     def is_exception(self):
         return isinstance(self.result, BaseException)
+
+
+class RpcPromise(object):
+    """This class is used to pass the pending result of a call as an
+    argument of another call to the same server.
+
+    :keyword correlation_id: the correlation id of the call
+    """
+    def __init__(self, correlation_id):
+        self.correlation_id = correlation_id
+
+    def __str__(self):
+        return "<RpcPromise(correlation_id={0})>".format(self.correlation_id)
+
+
+class RpcHandle(object):
+    """This class is used to transport a reference to an object kept on the
+    server to the client.
+
+    :keyword handle_id: the id of the handle on the server
+    :keyword server_id: the id of the server keeping the object
+    :keyword instance_id: the id of the server instance keeping the object,
+        among the servers running with the same id
+    """
+    def __init__(self, handle_id, server_id, instance_id=None):
+        self.handle_id = handle_id
+        self.server_id = server_id
+        self.instance_id = instance_id
+
+    def __str__(self):
+        return ("<RpcHandle(handle_id={0}, server_id={1}, instance_id={2})>"
+                .format(self.handle_id, self.server_id, self.instance_id))
@@ -37,8 +37,12 @@ import uuid
 import kombu
 
 from callme import base
+from callme import confirms as cf
 from callme import exceptions as exc
+from callme import jobs
 from callme import protocol as pr
+from callme import sharding
+from callme import tracing
 
 LOG = logging.getLogger(__name__)
 
@@ -51,7 +55,8 @@ class Proxy(base.Base):
 
     :keyword server_id: default id of the Server (can be declared later
         see :func:`use_server`)
-    :keyword amqp_host: the host of where the AMQP Broker is running
+    :keyword amqp_host: the host of where the AMQP Broker is running, or a
+        kombu URL selecting another transport, e.g. `memory://`
     :keyword amqp_user: the username for the AMQP Broker
     :keyword amqp_password: the password for the AMQP Broker
     :keyword amqp_vhost: the virtual host of the AMQP Broker
@@ -61,6 +66,43 @@ class Proxy(base.Base):
     :keyword durable: make all exchanges and queues durable
     :keyword auto_delete: delete server queues after all connections are closed
         not applicable for client queues
+    :keyword client_id: id sent along with the requests, servers with fair
+        scheduling share their workers fairly between client ids (defaults
+        to one id per proxy)
+    :keyword max_priority: declare server queues as priority queues, must
+        match the `max_priority` of the server
+    :keyword priority: default priority of calls, from 0 to `max_priority`
+    :keyword transport_options: dict of options of the kombu transport,
+        e.g. `{'polling_interval': 0.01}`
+    :keyword connection_options: dict of further keyword arguments of the
+        kombu connection, e.g. `{'heartbeat': 10, 'connect_timeout': 5}`
+    :keyword metrics: a metrics sink such as
+        :class:`callme.metrics.MetricsRegistry` recording the requests,
+        errors, timeouts, latency and serialization time of calls
+    :keyword tracer: an object whose `record(span)` method is called with the
+        :class:`callme.tracing.Span` of every phase of a call, such as a
+        :class:`callme.tracing.JsonLinesExporter`
+    :keyword reconnect: reconnect when the broker connection is lost while
+        waiting for a result, re-declare the reply queue and retry failed
+        publishes instead of raising `ConnectionError`
+    :keyword idempotent: names of the functions which are safe to call
+        twice, their calls in flight when the connection is lost are
+        published again after reconnecting, the other ones fail with
+        `ConnectionError`
+    :keyword brokers: list of broker URLs to use instead of `amqp_host`,
+        calls are published to the broker their server id, or the shard key
+        set with :func:`use_server`, is mapped to by a
+        :class:`callme.sharding.HashRing`, the servers must be configured
+        with the same brokers
+    :keyword confirms: publish requests with publisher confirms, a request
+        the broker failed to take over fails with `RpcPublishFailed`;
+        confirms are tracked in a window of unconfirmed requests, so
+        publishing only waits for them when the window is full
+    :keyword queues: dict mapping the names of functions the servers serve
+        from dedicated queues to the names of those queues, as registered
+        with :func:`callme.server.Server.register_function`; their calls are
+        published to the dedicated queues directly instead of being
+        forwarded by the server
     """
 
     def __init__(self,
@@ -73,21 +115,54 @@ class Proxy(base.Base):
                  ssl=False,
                  timeout=REQUEST_TIMEOUT,
                  durable=False,
-                 auto_delete=True):
+                 auto_delete=True,
+                 client_id=None,
+                 max_priority=None,
+                 priority=None,
+                 transport_options=None,
+                 connection_options=None,
+                 metrics=None,
+                 tracer=None,
+                 reconnect=False,
+                 idempotent=None,
+                 brokers=None,
+                 confirms=False,
+                 queues=None):
 
         super(Proxy, self).__init__(amqp_host, amqp_user, amqp_password,
-                                    amqp_vhost, amqp_port, ssl)
+                                    amqp_vhost, amqp_port, ssl,
+                                    transport_options, connection_options,
+                                    reconnect)
         self._uuid = str(uuid.uuid4())
         self._server_id = server_id
         self._timeout = timeout
-        self._is_received = False
-        self._corr_id = None
-        self._response = None
+        self._pending = {}
+        self._metrics = metrics
+        self._tracer = tracer
+        self._idempotent = frozenset(idempotent or ())
+        self._ring = sharding.HashRing(brokers) if brokers else None
+        self._conns = {}
+        self._shard_key = None
+        self._confirms = confirms
+        self._queues = dict(queues or {})
+        # id of connection -> (producer, confirm window)
+        self._confirmers = {}
         self._exchange_name = 'client_{0}_ex_{1}'.format(amqp_user, self._uuid)
         self._queue_name = 'client_{0}_queue_{1}'.format(amqp_user, self._uuid)
         self._durable = durable
         self._auto_delete = auto_delete
-
+        self._max_priority = max_priority
+        self._priority = priority
+        self._headers = {}
+        if client_id is not None:
+            self._headers['client_id'] = client_id
+        if self._ring is None:
+            self._consume_replies(self._conn)
+
+    def _consume_replies(self, conn):
+        """Declare the reply queue on a connection and start consuming the
+        responses.
+        """
         # create exchange
         exchange = self._make_exchange(self._exchange_name,
                                        durable=self._durable,
@@ -99,15 +174,34 @@ class Proxy(base.Base):
                                  auto_delete=True)
 
         # create consumer
-        consumer = kombu.Consumer(channel=self._conn,
+        consumer = kombu.Consumer(channel=conn,
                                   queues=queue,
                                   callbacks=[self._on_response],
                                   accept=['pickle'])
         consumer.consume()
-
-    def use_server(self, server_id=None, timeout=None):
-        """Use the specified server and set an optional timeout for the method
-        call.
+        if self._confirms:
+            channel = conn.channel()
+            window = cf.ConfirmWindow(channel, self._on_publish_nacked)
+            self._confirmers[id(conn)] = (kombu.Producer(channel), window)
+
+    def _get_connection(self, key):
+        """Return the connection to the broker a server id or shard key is
+        mapped to, the responses are consumed on it from its first use.
+        """
+        if self._ring is None:
+            return self._conn
+        broker = self._ring.get(key)
+        conn = self._conns.get(broker)
+        if conn is None:
+            conn = self._make_connection(broker)
+            self._consume_replies(conn)
+            self._conns[broker] = conn
+        return conn
+
+    def use_server(self, server_id=None, timeout=None, priority=None,
+                   shard_key=None):
+        """Use the specified server and set an optional timeout, priority
+        and shard key for the method call.
 
         Typical use:
 
@@ -115,25 +209,32 @@ class Proxy(base.Base):
 
         :keyword server_id: the server id where the call will be made
         :keyword timeout: set or overrides the call timeout in seconds
+        :keyword priority: set or overrides the call priority
+        :keyword shard_key: set or overrides the key mapping the requests to
+            a broker if the proxy has several brokers, instead of the server
+            id; the server must consume on all of them
         :rtype: return `self` to cascade further calls
         """
         if server_id is not None:
             self._server_id = server_id
         if timeout is not None:
             self._timeout = timeout
+        if priority is not None:
+            self._priority = priority
+        if shard_key is not None:
+            self._shard_key = shard_key
         return self
 
     def _on_response(self, response, message):
         """This method is automatically called when a response is incoming and
-        decides if it is the message we are waiting for - the message with the
-        result.
+        passes it to the pending call it belongs to.
 
         :param response: the body of the amqp message already deserialized
             by kombu
         :param message: the plain amqp kombu.message with additional
             information
         """
-        LOG.debug("Got response: {0}".format(response))
+        LOG.debug("Got response: %s", response)
         try:
             message.ack()
         except Exception:
@@ -148,11 +249,202 @@ class Proxy(base.Base):
 
             # process response
             try:
-                if self._corr_id == message.properties['correlation_id']:
-                    self._response = response
-                    self._is_received = True
+                corr_id = message.properties['correlation_id']
             except KeyError:
                 LOG.error("Message has no `correlation_id` property.")
+                return
+            handle = self._pending.pop(corr_id, None)
+            if handle is None:
+                LOG.debug("Response of a cancelled or timed out call.")
+                return
+            handle._set_response(response)
+            if response.is_exception:
+                self._finish_span(handle, error=repr(response.result))
+            else:
+                self._finish_span(handle)
+
+    def _publish(self, server_id, request, corr_id, reply_to=None,
+                 headers=None, expiration=None, shard_key=None,
+                 func_name=None, instance_id=None):
+        """Publish a message to the server with the given id, through the
+        broker the shard key or else the server id is mapped to.
+
+        The message goes to the exclusive queue of the server instance with
+        the given id, or to the dedicated queue of the function `func_name`
+        if the proxy knows of one, otherwise to the default queue.
+        """
+        conn = self._get_connection(
+            shard_key if shard_key is not None else server_id)
+        exchange = self._make_exchange(
+            'server_{0}_ex'.format(server_id),
+            durable=self._durable,
+            auto_delete=self._auto_delete)
+        queue_name = self._queues.get(func_name)
+        if instance_id is not None:
+            # the queue of the instance is only declared by the instance
+            routing_key = instance_id
+            declare = [exchange]
+        elif queue_name is None:
+            routing_key = None
+            declare = [self._make_queue(
+                'server_{0}_queue'.format(server_id), exchange,
+                durable=self._durable,
+                auto_delete=self._auto_delete,
+                max_priority=self._max_priority)]
+        else:
+            routing_key = func_name
+            declare = [self._make_queue(
+                'server_{0}_queue_{1}'.format(server_id, queue_name),
+                exchange,
+                durable=self._durable,
+                auto_delete=self._auto_delete,
+                routing_keys=[func_name],
+                max_priority=self._max_priority)]
+        options = dict(body=request,
+                       routing_key=routing_key,
+                       exchange=exchange,
+                       reply_to=reply_to,
+                       correlation_id=corr_id,
+                       headers=headers or {},
+                       expiration=expiration,
+                       priority=self._priority or 0,
+                       declare=declare,
+                       **pr.publish_options(request))
+        if self._confirms:
+            self._publish_confirmed(conn, corr_id, options)
+            return
+        with kombu.producers[conn].acquire(block=True) as producer:
+            producer.publish(**dict(options, **self._retry_options()))
+
+    def _publish_confirmed(self, conn, corr_id, options):
+        """Publish a message on the confirm channel of a connection and track
+        its confirm.
+
+        :raise RpcTimeout: if the window of unconfirmed messages stays full
+        """
+        producer, window = self._confirmers[id(conn)]
+        if window.full() and not window.wait(conn, self._timeout or None):
+            raise exc.RpcTimeout("Publisher confirms timeout")
+        producer.publish(**options)
+        window.track(corr_id)
+
+    def _settle_confirms(self, conn):
+        """Process the confirms of the requests published to the brokers
+        other than the one of `conn`, which is drained anyway.
+        """
+        for other in self._conns.values():
+            if other is conn:
+                continue
+            try:
+                cf.settle(other)
+            except Exception:
+                LOG.exception("Failed to process publisher confirms.")
+
+    def _on_publish_nacked(self, corr_id):
+        """Fail the call whose request the broker failed to take over."""
+        handle = self._pending.pop(corr_id, None)
+        if handle is None:
+            return
+        LOG.error("Request %s not confirmed by the broker.", corr_id)
+        handle._set_response(pr.RpcResponse(exc.RpcPublishFailed(
+            "The broker failed to take over request {0}.".format(corr_id))))
+        self._finish_span(handle, received=False, error='not confirmed')
+
+    def _send(self, func_name, func_args, func_keywords, pipelined=False,
+              server_id=None, job=False, instance_id=None):
+        """Publish a request and register it as pending.
+
+        :keyword pipelined: the server keeps the result for calls passing
+            the promise of this call
+        :keyword job: the call is a job, the server replies with the job id
+            and stores the result
+        :keyword server_id: the id of the server to call, defaults to the
+            server in use
+        :keyword instance_id: the id of the server instance to call, by
+            default any server with the server id takes the call
+        :rtype: :class:`AsyncResult` of the call
+        """
+        corr_id = str(uuid.uuid4())
+        request = pr.RpcRequest(func_name, func_args, func_keywords)
+        LOG.debug("Publish request: %s", request)
+
+        headers = dict(self._headers)
+        headers['sent_at'] = time.time()
+        if pipelined:
+            headers['pipelined'] = True
+        if job:
+            headers['job'] = True
+        # the server drops the request once the caller gave up waiting
+        expiration = None
+        if self._timeout > 0 and not job:
+            headers['deadline'] = time.time() + self._timeout
+            expiration = self._timeout
+
+        server_id = server_id if server_id is not None else self._server_id
+        span = None
+        if self._tracer is not None:
+            span = self._start_span(func_name, server_id)
+            headers['trace_id'] = span.trace_id
+            headers['span_id'] = span.span_id
+        body = request
+        if self._metrics is not None:
+            started = time.time()
+            body = pr.dumps(request)
+            self._metrics.observe('callme_client_serialization_seconds',
+                                  time.time() - started,
+                                  {'function': func_name})
+
+        handle = AsyncResult(self, corr_id, server_id, self._timeout)
+        handle._pipelined = pipelined
+        handle._span = span
+        # the server replies through the broker of its id
+        handle._conn = self._get_connection(server_id)
+        handle._request = (func_name, body, headers, expiration,
+                           self._shard_key)
+        self._pending[corr_id] = handle
+        try:
+            self._publish(server_id, body, corr_id,
+                          reply_to=self._exchange_name,
+                          headers=headers,
+                          expiration=expiration,
+                          shard_key=self._shard_key,
+                          func_name=func_name,
+                          instance_id=instance_id)
+        except Exception:
+            self._pending.pop(corr_id, None)
+            raise
+        if span is not None:
+            handle._published_at = time.time()
+            tracing.record(self._tracer, 'callme.publish', span, span.start,
+                           handle._published_at)
+        return handle
+
+    def _start_span(self, func_name, server_id):
+        """Start the span of a call, continuing the trace of the call the
+        current thread is executing on a server, if any.
+        """
+        parent = tracing.current_context()
+        attributes = {'function': func_name, 'server_id': server_id}
+        if parent is None:
+            return tracing.Span('callme.call', tracing.new_trace_id(),
+                                attributes=attributes)
+        return tracing.Span('callme.call', parent.trace_id, parent.span_id,
+                            attributes=attributes)
+
+    def _finish_span(self, handle, received=True, **attributes):
+        """Record the span of a call when its response arrived or it was
+        cancelled.
+        """
+        span = handle._span
+        if span is None:
+            return
+        handle._span = None
+        if received:
+            tracing.record(self._tracer, 'callme.receive', span,
+                           handle._published_at)
+        span.attributes.update(attributes)
+        span.finish()
+        self._tracer.record(span)
 
     def __request(self, func_name, func_args, func_keywords):
         """The remote-method-call execution function.
@@ -164,51 +456,174 @@ class Proxy(base.Base):
         :type func_args: list of parameters
         :rtype: result of the method
         """
-        self._corr_id = str(uuid.uuid4())
-        request = pr.RpcRequest(func_name, func_args, func_keywords)
-        LOG.debug("Publish request: {0}".format(request))
+        if self._metrics is None:
+            return self._send(func_name, func_args, func_keywords).result()
 
-        # publish request
-        with kombu.producers[self._conn].acquire(block=True) as producer:
-            exchange = self._make_exchange(
-                'server_{0}_ex'.format(self._server_id),
-                durable=self._durable,
-                auto_delete=self._auto_delete)
-            queue = self._make_queue(
-                'server_{0}_queue'.format(self._server_id), exchange,
-                durable=self._durable,
-                auto_delete=self._auto_delete)
-            producer.publish(body=request,
-                             serializer='pickle',
-                             exchange=exchange,
-                             reply_to=self._exchange_name,
-                             correlation_id=self._corr_id,
-                             declare=[queue])
-
-        # start waiting for the response
-        self._wait_for_result()
-        self._is_received = False
-
-        # handler response
-        result = self._response.result
-        LOG.debug("Result: {!r}".format(result))
-        if self._response.is_exception:
-            raise result
-        return result
+        labels = {'function': func_name}
+        self._metrics.inc('callme_client_requests_total', labels)
+        started = time.time()
+        try:
+            return self._send(func_name, func_args, func_keywords).result()
+        except exc.RpcTimeout:
+            self._metrics.inc('callme_client_timeouts_total', labels)
+            raise
+        except Exception:
+            self._metrics.inc('callme_client_errors_total', labels)
+            raise
+        finally:
+            self._metrics.observe('callme_client_latency_seconds',
+                                  time.time() - started, labels)
+
+    def call_async(self, func_name, *args, **kwargs):
+        """Call a remote function without waiting for its result.
+
+        Typical use:
+
+            >> handle = my_proxy.call_async('a_remote_func', 1, 2)
+            >> handle.result()
+
+        :param func_name: name of the function on the server
+        :rtype: :class:`AsyncResult` of the call
+        """
+        return self._send(func_name, args, kwargs)
+
+    def pipeline(self, func_name, *args, **kwargs):
+        """Call a remote function without waiting for its result, like
+        :func:`call_async`, and have the server keep the result for the
+        calls passing its promise.
+
+        The pending result can be passed on to other calls to the same
+        server as :attr:`AsyncResult.promise`, the server then resolves it
+        without a round trip through the client:
+
+            >> user = my_proxy.pipeline('get_user', 42)
+            >> my_proxy.get_orders(user.promise)
+
+        :param func_name: name of the function on the server
+        :rtype: :class:`AsyncResult` of the call
+        """
+        return self._send(func_name, args, kwargs, pipelined=True)
+
+    @property
+    def submit(self):
+        """Submit a job, a call whose result is stored on the server instead
+        of being waited for. It returns the job id right away:
+
+            >> job_id = my_proxy.submit.a_remote_func(1, 2)
+            >> my_proxy.job_result(job_id)
+
+        The result can be fetched later by any proxy of the same server.
+        """
+        return _Submit(self._submit_job)
+
+    def _submit_job(self, func_name, func_args, func_keywords):
+        return self._send(func_name, func_args, func_keywords,
+                          job=True).result()
+
+    def job_status(self, job_id):
+        """Return the state of a job, `pending`, `running` or `done`.
+
+        :raise KeyError: if there is no such job
+        """
+        return self.__request('callme.job_status', (job_id,), {})
+
+    def job_result(self, job_id, timeout=None, poll_interval=1):
+        """Wait for a job to be done and return its result. If the job raised
+        an exception it is raised here.
+
+        :param job_id: the id returned when the job was submitted
+        :keyword timeout: the number of seconds to wait, `None` waits
+            forever
+        :keyword poll_interval: the number of seconds between polls
+        :raise KeyError: if there is no such job
+        :raise RpcTimeout: if the job isn't done in time
+        """
+        start_time = time.time()
+        while self.job_status(job_id) != jobs.DONE:
+            if timeout is not None and time.time() - start_time > timeout:
+                raise exc.RpcTimeout("Job '{0}' timeout".format(job_id))
+            time.sleep(poll_interval)
+        return self.__request('callme.job_result', (job_id,), {})
+
+    def forget_job(self, job_id):
+        """Remove a job and its result from the server."""
+        self.__request('callme.forget_job', (job_id,), {})
+
+    def _cancel(self, handle):
+        """Discard a pending call and ask its server to cancel it."""
+        self._pending.pop(handle.correlation_id, None)
+        self._finish_span(handle, received=False, cancelled=True)
+        request = pr.RpcRequest(pr.CANCEL_FUNC_NAME,
+                                (handle.correlation_id,), {})
+        LOG.debug("Publish cancel request: %s", request)
+        try:
+            self._publish(handle.server_id, request, str(uuid.uuid4()))
+        except Exception:
+            LOG.exception("Failed to publish cancel request.")
 
-    def _wait_for_result(self):
-        """Waits for the result from the server, checks every second if
-        a timeout occurred. If a timeout occurred - the `RpcTimeout` exception
-        will be raised.
+    def _wait_for_result(self, handle, timeout):
+        """Waits for the result of a call, checks every second if a timeout
+        occurred. If a timeout occurred - the call is cancelled and the
+        `RpcTimeout` exception will be raised.
         """
+        conn = handle._conn if handle._conn is not None else self._conn
         start_time = time.time()
-        while not self._is_received:
+        while not handle.ready():
+            if self._confirms and len(self._conns) > 1:
+                self._settle_confirms(conn)
             try:
-                self._conn.drain_events(timeout=1)
+                if conn.heartbeat:
+                    conn.heartbeat_check()
+                conn.drain_events(timeout=1)
             except socket.timeout:
-                if self._timeout > 0:
-                    if time.time() - start_time > self._timeout:
-                        raise exc.RpcTimeout("RPC Request timeout")
+                pass
+            except base.connection_errors(conn):
+                if not self._reconnect:
+                    self._pending.pop(handle.correlation_id, None)
+                    raise exc.ConnectionError("Broker connection lost")
+                deadline = start_time + timeout if timeout > 0 else None
+                if not self._recover(conn, deadline):
+                    self._pending.pop(handle.correlation_id, None)
+                    raise exc.ConnectionError("Broker connection lost")
+            if (not handle.ready() and timeout > 0 and
+                    time.time() - start_time > timeout):
+                self._cancel(handle)
+                raise exc.RpcTimeout("RPC Request timeout")
+
+    def _recover(self, conn, deadline=None):
+        """Reconnect after a connection was lost, consume the responses
+        again and publish the calls in flight to idempotent functions again,
+        the other calls in flight fail.
+
+        :param conn: the lost connection
+        :keyword deadline: the time after which to give up reconnecting
+        :rtype: `True` once reconnected
+        """
+        LOG.warning("Broker connection lost, reconnecting.")
+        if not self._reestablish(conn, deadline=deadline):
+            return False
+        self._consume_replies(conn)
+        for corr_id, handle in list(self._pending.items()):
+            if handle._conn is not conn:
+                continue
+            func_name, body, headers, expiration, shard_key = handle._request
+            if func_name in self._idempotent:
+                LOG.info("Publish request %s to '%s' again.", corr_id,
+                         func_name)
+                try:
+                    self._publish(handle.server_id, body, corr_id,
+                                  reply_to=self._exchange_name,
+                                  headers=headers, expiration=expiration,
+                                  shard_key=shard_key, func_name=func_name)
+                    continue
+                except Exception:
+                    LOG.exception("Failed to publish request again.")
+            self._pending.pop(corr_id, None)
+            handle._set_response(pr.RpcResponse(exc.ConnectionError(
+                "Broker connection lost while the call was in flight")))
+            self._finish_span(handle, received=False,
+                              error='connection lost')
+        return True
 
     def __getattr__(self, name):
         """This method is invoked, if a method is being called, which doesn't
@@ -216,12 +631,177 @@ class Proxy(base.Base):
         be called on the Server.
         """
         # magic method dispatcher
-        LOG.debug("Recursion: {0}".format(name))
+        LOG.debug("Recursion: %s", name)
         return _Method(self.__request, name)
 
 # ===========================================================================
 
 
+class AsyncResult(object):
+    """This class is used to represent the pending result of a call, see
+    :func:`Proxy.call_async` and :func:`Proxy.pipeline`.
+
+    :param proxy: the proxy which made the call
+    :param correlation_id: the correlation id of the call
+    :param server_id: the id of the server the call was made to
+    :param timeout: the default timeout for waiting on the result
+    """
+
+    def __init__(self, proxy, correlation_id, server_id, timeout):
+        self._proxy = proxy
+        self.correlation_id = correlation_id
+        self.server_id = server_id
+        self._timeout = timeout
+        self._pipelined = False
+        self._response = None
+        self._cancelled = False
+        self._span = None
+        self._published_at = None
+        self._request = None
+        self._conn = None
+
+    @property
+    def cancelled(self):
+        """Return whether the call was cancelled."""
+        return self._cancelled
+
+    @property
+    def promise(self):
+        """Return a promise of the result, which can be passed as an argument
+        of other calls to the same server.
+
+        :raise ValueError: if the call wasn't made with
+            :func:`Proxy.pipeline`, the server doesn't keep its result
+        """
+        if not self._pipelined:
+            raise ValueError("The result of call {0} isn't kept by the "
+                             "server, make the call with Proxy.pipeline."
+                             .format(self.correlation_id))
+        return pr.RpcPromise(self.correlation_id)
+
+    def ready(self):
+        """Return whether the result has arrived."""
+        return self._response is not None
+
+    def _set_response(self, response):
+        self._response = response
+
+    def result(self, timeout=None):
+        """Wait for the result of the call and return it. If the remote
+        function raised an exception it is raised here.
+
+        :keyword timeout: overrides the timeout of the call in seconds
+        :raise RpcCancelled: if the call was cancelled
+        :raise RpcTimeout: if the result didn't arrive in time, the call is
+            cancelled then
+        """
+        if self._cancelled:
+            raise exc.RpcCancelled("RPC Request cancelled")
+        if not self.ready():
+            self._proxy._wait_for_result(
+                self, timeout if timeout is not None else self._timeout)
+
+        result = self._response.result
+        LOG.debug("Result: %s", pr.Summary(result))
+        if self._response.is_exception:
+            raise result
+        if isinstance(result, pr.RpcHandle):
+            return RemoteObject(self._proxy, result)
+        return result
+
+    def cancel(self):
+        """Cancel the call. The result is discarded and the server drops
+        the request if it isn't executed yet, or signals the function if it
+        is running and cancellable.
+
+        :rtype: `True` if the call was cancelled, `False` if the result has
+            already arrived
+        """
+        if self.ready() or self._cancelled:
+            return False
+        self._cancelled = True
+        self._proxy._cancel(self)
+        return True
+
+# ===========================================================================
+
+
+class RemoteObject(object):
+    """This class is used to represent an object kept on the server, as
+    returned by functions registered with `by_reference`.
+
+    Calling a method of the remote object calls it on the server. Plain
+    attributes are read by calling them without arguments:
+
+        >> dataset = my_proxy.load_dataset('sales')
+        >> len(dataset), dataset.columns()
+        >> dataset.release()
+
+    :param proxy: the proxy which received the object
+    :param handle: the :class:`callme.protocol.RpcHandle` of the object
+    """
+
+    def __init__(self, proxy, handle):
+        self._proxy = proxy
+        self._handle = handle
+        # handles of older servers don't know their instance
+        self._instance_id = getattr(handle, 'instance_id', None)
+
+    def _call(self, name, args, kwargs):
+        func_name = "{0}{1}.{2}".format(pr.HANDLE_FUNC_PREFIX,
+                                        self._handle.handle_id, name)
+        return self._proxy._send(func_name, args, kwargs,
+                                 server_id=self._handle.server_id,
+                                 instance_id=self._instance_id).result()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Method(self._call, name)
+
+    def __len__(self):
+        return self._call('__len__', (), {})
+
+    def __getitem__(self, key):
+        return self._call('__getitem__', (key,), {})
+
+    def __contains__(self, item):
+        return self._call('__contains__', (item,), {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        """Release the object on the server. It is removed from the server
+        when all its references are released or after it wasn't used for a
+        while.
+        """
+        self._proxy._send('callme.release_handle', (self._handle.handle_id,),
+                          {}, server_id=self._handle.server_id,
+                          instance_id=self._instance_id).result()
+
+# ===========================================================================
+
+
+class _Submit(object):
+    """This class is used to realize job submissions, see
+    :attr:`Proxy.submit`.
+
+    :param send: function submitting the job on the Proxy
+    """
+
+    def __init__(self, send):
+        self._send = send
+
+    def __getattr__(self, name):
+        return _Method(self._send, name)
+
+# ===========================================================================
+
+
 class _Method:
     """This class is used to realize remote-method-calls.
 
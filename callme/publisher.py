@@ -0,0 +1,321 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import logging
+import re
+import threading
+import time
+
+import kombu
+
+from callme import base
+from callme import confirms as cf
+from callme import protocol as pr
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+# the number of times a response the broker didn't confirm is published again
+MAX_NACKS = 3
+# the number of seconds a stopping publisher waits for outstanding confirms
+CONFIRM_TIMEOUT = 10
+# the text of the error closing a channel published to a deleted exchange
+MISSING_EXCHANGE = re.compile(r"no exchange '(.*)' in vhost")
+
+
+class ReplyPublisher(object):
+    """This class is used to publish responses from a single background
+    thread with its own broker connection.
+
+    Responses queued by the worker threads are published back-to-back in
+    bursts, and reply exchanges are only declared the first time a response
+    is published to them. A response whose publish failed because the
+    connection was lost is published again on a new connection.
+
+    Reply exchanges are deleted by the broker once their proxy is gone, and
+    the broker closes the channel a response is published on to a deleted
+    exchange, discarding everything published on it afterwards. The
+    publisher processes the frames received from the broker between bursts
+    and while idle; when the channel was closed it is revived and the
+    discarded responses are published again, declaring their exchanges.
+
+    With publisher confirms the confirms are tracked in a window of
+    unconfirmed responses instead of waiting for each one. Responses the
+    broker failed to take over are published again, as are the unconfirmed
+    ones when the connection is lost.
+
+    :param connection: the connection the publisher's connection is cloned
+        from
+    :param make_exchange: callable returning the exchange for a reply_to name
+    :keyword max_burst: the maximal number of responses published in a row
+    :keyword max_declared: the maximal number of exchange names remembered as
+        declared
+    :keyword name: the name of the background thread
+    :keyword confirms: publish with publisher confirms
+    """
+
+    def __init__(self, connection, make_exchange, max_burst=64,
+                 max_declared=1024, name='callme-publisher', confirms=False):
+        self._conn = connection
+        self._make_exchange = make_exchange
+        self._max_burst = max_burst
+        self._max_declared = max_declared
+        self._name = name
+        self._confirms = confirms
+        self._queue = queue.Queue()
+        # (item, number of nacks)
+        self._pending = collections.deque()
+        # (item, declared) of the last responses published
+        self._sent = collections.deque(maxlen=4 * max_burst)
+        self._declared = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the background thread."""
+        with self._lock:
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=False, timeout=None):
+        """Stop the background thread once the queued responses are
+        published.
+
+        :keyword wait: block until the background thread has exited
+        :keyword timeout: the maximal number of seconds to wait
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        if wait:
+            self._thread.join(timeout)
+
+    def publish(self, response, reply_to, correlation_id, published=None):
+        """Queue a response for publishing.
+
+        :keyword published: callable invoked with the start time of the
+            publish once the response is published
+        :rtype: `False` if the publisher is not running and the response
+            was not queued
+        """
+        with self._lock:
+            if not self._running:
+                return False
+            self._queue.put((response, reply_to, correlation_id, published))
+            return True
+
+    def _run(self):
+        """Background thread main loop."""
+        while True:
+            conn = self._conn.clone()
+            window = None
+            try:
+                producer = kombu.Producer(conn)
+                if self._confirms:
+                    window = self._make_window(producer.channel)
+                if self._publish_bursts(producer, conn, window):
+                    return
+            except Exception:
+                LOG.exception("Publishing responses failed.")
+                self._declared.clear()
+                if window is not None:
+                    self._pending.extendleft(reversed(window.unconfirmed()))
+                time.sleep(1)
+            finally:
+                conn.release()
+
+    def _make_window(self, channel):
+        """Put the channel in confirm mode, unless the transport doesn't
+        support it.
+
+        :rtype: :class:`callme.confirms.ConfirmWindow` of the channel or
+            `None`
+        """
+        try:
+            return cf.ConfirmWindow(channel, self._on_nack)
+        except ValueError as e:
+            LOG.error("%s Publishing responses without confirms.", e)
+            self._confirms = False
+            return None
+
+    def _publish_bursts(self, producer, conn, window=None):
+        """Publish the queued responses until the publisher is stopped.
+
+        :param producer: the producer to publish with
+        :param conn: the connection of the producer
+        :keyword window: the :class:`callme.confirms.ConfirmWindow` of the
+            producer's channel if it publishes with confirms
+        :rtype: `True` once all responses are published after a stop
+        """
+        self._sent.clear()
+        while True:
+            if not self._pending:
+                self._fill(producer, conn, window)
+            while self._pending:
+                item, nacks = self._pending[0]
+                if item is None:
+                    if window is not None and len(window):
+                        window.wait(conn, CONFIRM_TIMEOUT, empty=True)
+                        if self._pending[0][0] is not None:
+                            # responses to publish again were added
+                            continue
+                    return True
+                if window is not None and window.full():
+                    window.wait(conn)
+                    continue
+                try:
+                    self._publish(producer, *item)
+                except base.connection_errors(conn):
+                    raise
+                except Exception:
+                    LOG.exception("Failed to publish a response, dropped.")
+                else:
+                    if window is not None:
+                        window.track((item, nacks))
+                self._pending.popleft()
+            self._check(producer, conn, window)
+
+    def _fill(self, producer, conn, window=None):
+        """Wait for queued responses and take up to `max_burst` of them,
+        checking the heartbeats of the connection and processing the frames
+        received from the broker while idle.
+        """
+        while not self._pending:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                if conn.heartbeat:
+                    conn.heartbeat_check()
+                if self._check(producer, conn, window):
+                    # a channel closed by now would have been noticed
+                    self._sent.clear()
+                continue
+            self._pending.append((item, 0))
+        while len(self._pending) < self._max_burst:
+            try:
+                self._pending.append((self._queue.get_nowait(), 0))
+            except queue.Empty:
+                break
+
+    def _check(self, producer, conn, window=None):
+        """Process the frames received from the broker, such as confirms or
+        the close of the producer's channel.
+
+        Without publisher confirms a closed channel is revived and the
+        responses the broker discarded are queued to be published again,
+        with confirms it is handled like a lost connection.
+
+        :rtype: `True` if the channel is still open
+        """
+        try:
+            cf.settle(conn)
+        except tuple(conn.channel_errors) as e:
+            if window is not None:
+                raise
+            self._recover_channel(producer, conn, e)
+            return False
+        return True
+
+    def _recover_channel(self, producer, conn, error):
+        """Revive the channel of the producer closed by the broker and queue
+        the responses published from the failed one on again.
+        """
+        match = MISSING_EXCHANGE.search(str(error))
+        name = match.group(1) if match else None
+        sent = list(self._sent)
+        self._sent.clear()
+        # only a publish without declaring the exchange can fail, and the
+        # broker discards everything published after it
+        failed = [i for i, (item, declared) in enumerate(sent)
+                  if not declared and name in (
+                      None, self._make_exchange(item[1]).name)]
+        lost = sent[failed[0]:] if failed else []
+        LOG.warning("The broker closed the channel of the publisher: %s. "
+                    "Publishing %s responses again.", error, len(lost))
+        channel = producer.channel
+        producer.revive(conn.channel())
+        try:
+            channel.close()
+        except Exception:
+            LOG.debug("Failed to close the closed channel.", exc_info=True)
+        if name is None:
+            self._declared.clear()
+        for item, _ in lost:
+            self._declared.pop(item[1], None)
+        # the published callbacks were called already
+        self._pending.extendleft(reversed([(item[:3] + (None,), 0)
+                                           for item, _ in lost]))
+
+    def _on_nack(self, entry):
+        """Publish a response the broker failed to take over again."""
+        item, nacks = entry
+        if nacks >= MAX_NACKS:
+            LOG.error("Response %s not confirmed by the broker, dropped.",
+                      item[2])
+            return
+        LOG.warning("Response %s not confirmed by the broker, publishing it "
+                    "again.", item[2])
+        self._pending.appendleft((item, nacks + 1))
+
+    def _publish(self, producer, response, reply_to, correlation_id,
+                 published=None):
+        """Publish a single response."""
+        LOG.debug("Publish response: %s", response)
+        started = time.time()
+        exchange = self._make_exchange(reply_to)
+        declared = reply_to in self._declared
+        producer.publish(body=response,
+                         exchange=exchange,
+                         correlation_id=correlation_id,
+                         declare=[] if declared else [exchange],
+                         **pr.publish_options(response))
+        self._sent.append(((response, reply_to, correlation_id, published),
+                           not declared))
+        if not declared:
+            self._declared[reply_to] = True
+            if len(self._declared) > self._max_declared:
+                self._declared.popitem(last=False)
+        if published is not None:
+            try:
+                published(started)
+            except Exception:
+                LOG.exception("Published callback of response %s failed.",
+                              correlation_id)
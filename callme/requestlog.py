@@ -0,0 +1,97 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import itertools
+import logging
+
+from callme import protocol as pr
+
+LOG = logging.getLogger('callme.requests')
+SLOW_LOG = logging.getLogger('callme.slow')
+
+
+class RequestLog(object):
+    """This class is used to log the requests processed by a server.
+
+    One out of `sample_every` successful calls is logged at the INFO level to
+    the `callme.requests` logger, failed calls are always logged at the
+    WARNING level, and calls lasting at least `slow_threshold` seconds are
+    always logged at the WARNING level to the `callme.slow` logger. Arguments
+    are logged as truncated summaries, and nothing is formatted unless the
+    logger is enabled for the level of the record.
+
+    The fields of a record are also set as its `callme` attribute, so they
+    can be emitted as structured data by a formatter.
+
+    :keyword sample_every: log one out of this number of successful calls,
+        none if set to `None`
+    :keyword slow_threshold: the duration in seconds from which calls are
+        logged as slow
+    """
+
+    def __init__(self, sample_every=100, slow_threshold=None):
+        if sample_every is not None and sample_every < 1:
+            raise ValueError("The 'sample_every' must be at least 1.")
+        self.sample_every = sample_every
+        self.slow_threshold = slow_threshold
+        self._counter = itertools.count()
+
+    def log(self, request, duration, error=None, correlation_id=None):
+        """Log a processed request if it is sampled, failed or slow.
+
+        :param request: the processed `RpcRequest`
+        :param duration: the execution time of the call in seconds
+        :keyword error: the exception raised by the call
+        :keyword correlation_id: the correlation id of the request
+        """
+        if (self.slow_threshold is not None and
+                duration >= self.slow_threshold):
+            logger, level = SLOW_LOG, logging.WARNING
+        elif error is not None:
+            logger, level = LOG, logging.WARNING
+        elif (self.sample_every is not None and
+                next(self._counter) % self.sample_every == 0):
+            logger, level = LOG, logging.INFO
+        else:
+            return
+        if not logger.isEnabledFor(level):
+            return
+        fields = {
+            'func_name': request.func_name,
+            'args': pr.summarize(request.func_args),
+            'kwargs': pr.summarize(request.func_keywords),
+            'duration': duration,
+            'correlation_id': correlation_id,
+            'error': None if error is None else pr.summarize(error),
+        }
+        logger.log(level, "%(func_name)s(*%(args)s, **%(kwargs)s) "
+                   "[%(correlation_id)s] took %(duration).6fs, "
+                   "error: %(error)s", fields, extra={'callme': fields})
@@ -0,0 +1,284 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import itertools
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+_EMPTY = object()
+
+
+class TokenBucket(object):
+    """This class is used to limit the rate of a client's requests.
+
+    :param rate: the number of tokens added per second
+    :param burst: the maximal number of tokens
+    """
+
+    def __init__(self, rate, burst):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = self._burst
+        self._stamp = time.time()
+
+    def _refill(self, now):
+        self._tokens = min(self._burst,
+                           self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def take(self, now):
+        """Take a token if one is available.
+
+        :rtype: `True` if a token was taken
+        """
+        self._refill(now)
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def delay(self, now):
+        """Return the number of seconds until a token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+    def available(self, now):
+        """Return the number of whole tokens available."""
+        self._refill(now)
+        return int(self._tokens)
+
+    def is_full(self, now):
+        """Return whether the bucket is full, so it can be discarded."""
+        self._refill(now)
+        return self._tokens >= self._burst
+
+
+class FairScheduler(object):
+    """This class is used to dispatch calls of many clients fairly to the
+    workers of a worker pool.
+
+    Each client has its own queue and the queues are served by weighted
+    round-robin: a client gets as many calls dispatched in a row as its
+    weight before the next client is served. Clients can additionally be
+    rate limited by a token bucket, calls beyond the rate wait in the
+    client's queue.
+
+    :keyword rate: the number of calls per second dispatched for each client,
+        `None` means no limit
+    :keyword burst: the number of calls a client may get dispatched in a row
+        beyond the rate (defaults to `rate`)
+    :keyword weights: dict of client weights keyed by client id
+    :keyword default_weight: the weight of clients missing in `weights`
+    :keyword max_buckets: the number of token buckets kept before the full
+        ones are discarded
+    """
+
+    def __init__(self, rate=None, burst=None, weights=None, default_weight=1,
+                 max_buckets=1024):
+        self._rate = rate
+        self._burst = burst if burst is not None else max(1, rate or 1)
+        self._weights = dict(weights or {})
+        self._default_weight = default_weight
+        self._max_buckets = max_buckets
+        self._queues = {}
+        self._active = collections.deque()
+        self._credit = None
+        self._control = collections.deque()
+        self._buckets = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, item, key=None):
+        """Queue an item of the given client.
+
+        Items without client are control items, they are only dispatched
+        once no client has items queued.
+        """
+        with self._cond:
+            if key is None:
+                self._control.append(item)
+            else:
+                client_queue = self._queues.get(key)
+                if client_queue is None:
+                    client_queue = self._queues[key] = collections.deque()
+                    self._active.append(key)
+                client_queue.append(item)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next item.
+
+        :raise queue.Empty: if no item is available in time
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                now = time.time()
+                item, delay = self._pop(now)
+                if item is not _EMPTY:
+                    self._size -= 1
+                    return item
+                if deadline is not None:
+                    remaining = deadline - now
+                    delay = remaining if delay is None else min(delay,
+                                                                remaining)
+                if not block or (delay is not None and delay <= 0):
+                    raise queue.Empty
+                self._cond.wait(delay)
+
+    def get_nowait(self):
+        """Remove and return the next item without blocking."""
+        return self.get(block=False)
+
+    def qsize(self):
+        """Return the number of queued items."""
+        return self._size
+
+    def ready(self):
+        """Return the number of queued items that can be dispatched right
+        away, the items of clients beyond their rate and the control items
+        waiting for them are not counted.
+        """
+        now = time.time()
+        with self._cond:
+            if self._rate is None or not self._queues:
+                return self._size
+            count = 0
+            for key, client_queue in self._queues.items():
+                bucket = self._buckets.get(key)
+                tokens = (int(self._burst) if bucket is None
+                          else bucket.available(now))
+                count += min(len(client_queue), tokens)
+            return count
+
+    def _weight(self, key):
+        return self._weights.get(key, self._default_weight)
+
+    def _bucket(self, key, now):
+        """Return the token bucket of a client, `None` if not rate limited."""
+        if self._rate is None:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                # a full bucket behaves like a new one
+                for k in [k for k, b in self._buckets.items()
+                          if b.is_full(now)]:
+                    del self._buckets[k]
+            bucket = self._buckets[key] = TokenBucket(self._rate,
+                                                      self._burst)
+        return bucket
+
+    def _pop(self, now):
+        """Pop the next item.
+
+        :rtype: `(item, delay)` tuple, if no item is ready the item is
+            `_EMPTY` and delay the number of seconds until a rate limited
+            client may be served or `None` to wait for new items
+        """
+        delay = None
+        for _ in range(len(self._active)):
+            key = self._active[0]
+            bucket = self._bucket(key, now)
+            if bucket is not None and not bucket.take(now):
+                wait = bucket.delay(now)
+                delay = wait if delay is None else min(delay, wait)
+                self._active.rotate(-1)
+                self._credit = None
+                continue
+
+            if self._credit is None:
+                self._credit = self._weight(key)
+            client_queue = self._queues[key]
+            item = client_queue.popleft()
+            self._credit -= 1
+            if not client_queue:
+                del self._queues[key]
+                self._active.popleft()
+                self._credit = None
+            elif self._credit <= 0:
+                self._active.rotate(-1)
+                self._credit = None
+            return item, None
+
+        if not self._active and self._control:
+            return self._control.popleft(), None
+        return _EMPTY, delay
+
+
+class PriorityScheduler(object):
+    """This class is used to dispatch calls to the workers of a worker pool
+    by priority.
+
+    Items with a higher priority are dispatched first, items of equal
+    priority in the order they were queued.
+    """
+
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+
+    def put(self, item, key=None):
+        """Queue an item with the given priority.
+
+        Items without priority are control items, they are only dispatched
+        once no other items are queued.
+        """
+        rank = float('inf') if key is None else -key
+        self._queue.put((rank, next(self._counter), item))
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next item.
+
+        :raise queue.Empty: if no item is available in time
+        """
+        return self._queue.get(block, timeout)[2]
+
+    def get_nowait(self):
+        """Remove and return the next item without blocking."""
+        return self.get(block=False)
+
+    def qsize(self):
+        """Return the number of queued items."""
+        return self._queue.qsize()
+
+    def ready(self):
+        """Return the number of queued items that can be dispatched right
+        away, all of them.
+        """
+        return self._queue.qsize()
@@ -29,24 +29,52 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import collections
+import copy
+import functools
 import logging
 import socket
 import threading
+import time
+import uuid
 
 import kombu
 
 from callme import base
+from callme import batch
+from callme import cache
 from callme import exceptions as exc
+from callme import handles
+from callme import jobs
+from callme import overload
+from callme import pipeline
+from callme import pool
+from callme import profiling
 from callme import protocol as pr
+from callme import publisher
+from callme import scheduler as sch
+from callme import sharding
+from callme import tracing
 
 LOG = logging.getLogger(__name__)
 
+AUTOSCALE_INTERVAL = 1
+# the maximal number of remembered cancelled requests
+MAX_CANCELLED = 10000
+# the number of seconds a call waits for a promised result without deadline
+PROMISE_TIMEOUT = 60
+# the special methods of objects kept on the server callable by the clients
+HANDLE_METHODS = ('__len__', '__getitem__', '__contains__')
+# the maximal number of seconds a function can be profiled for
+MAX_PROFILE_DURATION = 600
+
 
 class Server(base.Base):
     """This Server class is used to provide an RPC server.
 
     :keyword server_id: id of the server
-    :keyword amqp_host: the host of where the AMQP Broker is running
+    :keyword amqp_host: the host of where the AMQP Broker is running, or a
+        kombu URL selecting another transport, e.g. `memory://`
     :keyword amqp_user: the username for the AMQP Broker
     :keyword amqp_password: the password for the AMQP Broker
     :keyword amqp_vhost: the virtual host of the AMQP Broker
@@ -57,6 +85,48 @@ class Server(base.Base):
         improves performance
     :keyword durable: make all exchanges and queues durable
     :keyword auto_delete: delete queues after all connections are closed
+    :keyword max_backlog: reject requests with an `RpcOverloaded` error while
+        this many accepted requests are unfinished
+    :keyword max_latency: reject requests with an `RpcOverloaded` error while
+        the mean execution time of the recently finished requests exceeds
+        this number of seconds
+    :keyword min_workers: the minimal number of worker threads of the
+        autoscaling worker pool (defaults to 1)
+    :keyword max_workers: execute calls on a worker pool which grows and
+        shrinks with the load up to this number of threads, overrides
+        `threaded`
+    :keyword scheduler: a `callme.scheduler.FairScheduler` dispatching the
+        calls of the autoscaling worker pool fairly across clients, requires
+        `max_workers`
+    :keyword max_priority: declare the server's queues as priority queues
+        and dispatch calls waiting for a worker by priority, proxies must use
+        the same `max_priority`
+    :keyword result_store: the store keeping the results of jobs submitted
+        with `Proxy.submit`, a `callme.jobs.SqliteResultStore` in the
+        current directory is opened on the first job by default
+    :keyword transport_options: dict of options of the kombu transport,
+        e.g. `{'polling_interval': 0.01}`
+    :keyword connection_options: dict of further keyword arguments of the
+        kombu connection, e.g. `{'heartbeat': 10, 'connect_timeout': 5}`
+    :keyword metrics: a metrics sink such as
+        :class:`callme.metrics.MetricsRegistry` recording the requests,
+        errors, timeouts, queue wait, execution and serialization time of
+        calls
+    :keyword tracer: an object whose `record(span)` method is called with the
+        :class:`callme.tracing.Span` of every phase of a traced call, such as
+        a :class:`callme.tracing.JsonLinesExporter`
+    :keyword request_log: a :class:`callme.requestlog.RequestLog` logging
+        sampled, failed and slow calls
+    :keyword reconnect: reconnect when the broker connection is lost,
+        re-declare the queues and resume consuming instead of raising
+        `ConnectionError` from :func:`start`
+    :keyword brokers: list of broker URLs to use instead of `amqp_host`, the
+        server consumes its queues on all of them and replies through the
+        broker its id is mapped to by a :class:`callme.sharding.HashRing`,
+        the proxies must be configured with the same brokers
+    :keyword confirms: publish the responses with publisher confirms tracked
+        asynchronously, responses the broker failed to take over are
+        published again
     """
 
     def __init__(self,
@@ -69,21 +139,128 @@ class Server(base.Base):
                  ssl=False,
                  threaded=False,
                  durable=False,
-                 auto_delete=True):
+                 auto_delete=True,
+                 max_backlog=None,
+                 max_latency=None,
+                 min_workers=None,
+                 max_workers=None,
+                 scheduler=None,
+                 max_priority=None,
+                 result_store=None,
+                 transport_options=None,
+                 connection_options=None,
+                 metrics=None,
+                 tracer=None,
+                 request_log=None,
+                 reconnect=False,
+                 brokers=None,
+                 confirms=False):
+        ring = sharding.HashRing(brokers) if brokers else None
+        if ring is not None:
+            amqp_host = ring.get(server_id)
         super(Server, self).__init__(amqp_host, amqp_user, amqp_password,
-                                     amqp_vhost, amqp_port, ssl)
+                                     amqp_vhost, amqp_port, ssl,
+                                     transport_options, connection_options,
+                                     reconnect)
+        self._shard_conns = []
+        if ring is not None:
+            self._shard_conns = [self._make_connection(broker)
+                                 for broker in ring.brokers
+                                 if broker != amqp_host]
+        self._consume_threads = []
+        self._consumers_stopped = None
+        self._serial_lock = threading.Lock()
+        self._confirms = confirms
         self._server_id = server_id
         self._threaded = threaded
         self._running = threading.Event()
+        self._stop_requested = threading.Event()
         self._durable = durable
         self._auto_delete = auto_delete
         self._func_dict = {}
+        self._func_queues = {}
+        self._queue_limits = {}
+        self._pools = {}
+        self._slots = {}
+        self._caches = {}
+        self._batch_dict = {}
+        self._batchers = {}
+        self._publisher = None
+        self._owns_publisher = True
+        self._control_queue = self._make_control_queue(
+            'server_{0}'.format(server_id))
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        self._drain_deadline = None
+        self._shedder = None
+        if max_backlog is not None or max_latency is not None:
+            self._shedder = overload.LoadShedder(max_backlog=max_backlog,
+                                                 max_latency=max_latency)
+        self._autoscaler = None
+        self._default_pool = None
+        self._next_autoscale = 0
+        if max_workers is not None:
+            self._autoscaler = pool.Autoscaler(min_workers or 1, max_workers)
+        elif min_workers is not None:
+            raise ValueError("The 'min_workers' requires 'max_workers'.")
+        elif scheduler is not None:
+            raise ValueError("The 'scheduler' requires 'max_workers'.")
+        self._scheduler = scheduler
+        self._max_priority = max_priority
+        self._func_priorities = {}
+        self._cancellable = set()
+        self._cancelled = collections.OrderedDict()
+        self._running_calls = {}
+        self._calls_lock = threading.Lock()
+        self._promises = pipeline.PromiseTable()
+        self._handles = handles.HandleTable()
+        self._by_reference = set()
+        # the objects kept by reference are only reachable through the
+        # queue of this instance, not through the queues shared with the
+        # other servers running with the same id
+        self._instance_id = uuid.uuid4().hex
+        self._result_store = result_store
+        self._result_store_lock = threading.Lock()
+        self._metrics = metrics
+        self._tracer = tracer
+        self._request_log = request_log
+        self._profiling = set()
+        self._profiling_lock = threading.Lock()
+        self._control_dict = {
+            'callme.invalidate_cache': self.invalidate_cache,
+            'callme.cache_stats': self.cache_stats,
+            'callme.release_handle': self._handles.release,
+            'callme.job_status': self.job_status,
+            'callme.job_result': self.job_result,
+            'callme.forget_job': self.forget_job,
+            'callme.profile': self._remote_profile,
+        }
 
     @property
     def is_running(self):
         """Return whether server is running."""
         return self._running.is_set()
 
+    def _accept_request(self, request, message):
+        """Acknowledge the incoming message and check that it carries a
+        request.
+
+        :rtype: `True` if the request should be processed
+        """
+        LOG.debug("Got request: %s", request)
+        try:
+            message.ack()
+        except Exception:
+            LOG.exception("Failed to acknowledge AMQP message.")
+            return False
+        LOG.debug("AMQP message acknowledged.")
+
+        # check request type
+        if not isinstance(request, pr.RpcRequest):
+            LOG.warning("Request is not a `RpcRequest` instance.")
+            return False
+        return True
+
     def _on_request(self, request, message):
         """This method is automatically called when a request is incoming.
 
@@ -92,115 +269,1297 @@ class Server(base.Base):
         :param message: the plain amqp kombu.message with additional
             information
         """
-        LOG.debug("Got request: {0}".format(request))
-        try:
-            message.ack()
-        except Exception:
-            LOG.exception("Failed to acknowledge AMQP message.")
-        else:
-            LOG.debug("AMQP message acknowledged.")
-
-            # check request type
-            if not isinstance(request, pr.RpcRequest):
-                LOG.warning("Request is not a `RpcRequest` instance.")
-                return
+        if not self._accept_request(request, message):
+            return
+        if request.func_name == pr.CANCEL_FUNC_NAME:
+            self._cancel_request(*request.func_args)
+            return
+        self._expect_result(message)
+        if request.func_name in self._func_queues:
+            self._forward_request(request, message)
+            return
+        if not self._admit_request(request, message):
+            return
 
-            # process request
-            if self._threaded:
-                p = threading.Thread(target=self._process_request,
+        # process request
+        if request.func_name in self._batchers:
+            if pipeline.has_promises(request):
+                # the promised calls may end up in the same batch, so they
+                # are waited for before batching and not by the batcher
+                p = threading.Thread(target=self._batch_resolved,
                                      args=(request, message))
                 p.daemon = True
                 p.start()
-                LOG.debug("New thread spawned to process the {0} request."
-                          .format(request))
             else:
+                self._batchers[request.func_name].add((request, message))
+        elif self._default_pool is not None:
+            self._submit(self._default_pool, request, message)
+        elif self._threaded:
+            p = threading.Thread(target=self._process_request,
+                                 args=(request, message))
+            p.daemon = True
+            p.start()
+            LOG.debug("New thread spawned to process the %s request.",
+                      request)
+        else:
+            # requests may come from the consume loops of several brokers
+            with self._serial_lock:
                 self._process_request(request, message)
 
-    def _process_request(self, request, message):
-        """Process incoming request."""
-        LOG.debug("Start processing request {0}.".format(request))
+    def _on_queue_request(self, queue_name, conn, stopped, request,
+                          message):
+        """This method is automatically called when a request is incoming on
+        the dedicated queue of a function registered with a `queue`.
+
+        The message is only acknowledged once a worker of the queue is free,
+        so together with the prefetch count of the consumer the calls the
+        server can't start yet wait in the broker, where other servers
+        consuming the queue can take them.
+
+        :param queue_name: the name the function's queue was registered with
+        :param conn: the connection the queue is consumed on
+        :param stopped: the event set when consuming stops
+        :param request: the body of the amqp message already deserialized
+            by kombu
+        :param message: the plain amqp kombu.message with additional
+            information
+        """
+        slots = self._slots[queue_name]
+        while not slots.acquire(timeout=1):
+            if stopped.is_set():
+                # the broker delivers the unacknowledged message again
+                return
+            if conn.heartbeat:
+                conn.heartbeat_check()
+        if not self._accept_request(request, message):
+            slots.release()
+            return
+        self._expect_result(message)
+        if not self._admit_request(request, message):
+            slots.release()
+            return
+        self._submit(self._pools[queue_name], request, message,
+                     functools.partial(self._process_queue_request, slots))
+
+    def _process_queue_request(self, slots, request, message):
+        """Process a request from a dedicated queue and free its slot."""
+        try:
+            self._process_request(request, message)
+        finally:
+            slots.release()
+
+    def _submit(self, worker_pool, request, message, process=None):
+        """Submit a request to a worker pool, keyed by client if the pool
+        schedules fairly or by priority if the server has priorities.
+
+        :keyword process: the callable processing the request, defaults to
+            :func:`_process_request`
+        """
+        process = process or self._process_request
+        if worker_pool is self._default_pool and self._scheduler is not None:
+            key = self._get_client_id(message)
+        elif self._max_priority is not None:
+            key = self._get_priority(request, message)
+        else:
+            worker_pool.submit(process, request, message)
+            return
+        worker_pool.submit_for(key, process, request, message)
+
+    def _cancel_request(self, correlation_id):
+        """Cancel the request with the given correlation id. A request that
+        isn't executed yet is dropped, a running cancellable function gets
+        its cancellation flag set.
+        """
+        LOG.debug("Cancel request %s.", correlation_id)
+        with self._calls_lock:
+            cancelled = self._running_calls.get(correlation_id)
+            if cancelled is not None:
+                cancelled.set()
+                return
+            self._cancelled[correlation_id] = True
+            while len(self._cancelled) > MAX_CANCELLED:
+                self._cancelled.popitem(last=False)
+
+    def _start_call(self, correlation_id, cancellable):
+        """Mark the request with the given correlation id as running.
+
+        :rtype: `(skip, cancelled)` tuple, `skip` is `True` if the request
+            was cancelled before, `cancelled` is the cancellation flag of a
+            cancellable call or `None`
+        """
+        with self._calls_lock:
+            if self._cancelled.pop(correlation_id, None):
+                return True, None
+            if not cancellable:
+                return False, None
+            cancelled = threading.Event()
+            self._running_calls[correlation_id] = cancelled
+            return False, cancelled
+
+    def _end_call(self, correlation_id):
+        with self._calls_lock:
+            self._running_calls.pop(correlation_id, None)
+
+    def _expect_result(self, message):
+        """Announce the result of a pipelined request, so that requests
+        passing its promise wait for it.
+        """
+        if (message.headers or {}).get('pipelined'):
+            self._promises.expect(message.properties.get('correlation_id'))
+
+    def _keep_result(self, message, response=None):
+        """Keep the response of a pipelined request for the requests passing
+        its promise, `None` if the request was dropped.
+        """
+        if (message.headers or {}).get('pipelined'):
+            self._promises.set(message.properties.get('correlation_id'),
+                               response)
+
+    def _resolve_promises(self, request, message):
+        """Replace the promises among the arguments of a request with the
+        results of the calls they stand for, waiting for them until the
+        deadline of the request.
+        """
+        deadline = (message.headers or {}).get('deadline')
+        if deadline is None:
+            timeout = PROMISE_TIMEOUT
+        else:
+            timeout = max(deadline - time.time(), 0)
+        return self._promises.resolve(request, timeout)
+
+    def _batch_resolved(self, request, message):
+        """Add a request for a batch function to its batcher once the
+        promises among its arguments are resolved, or reply with the error
+        if they can't be resolved.
+        """
+        try:
+            request = self._resolve_promises(request, message)
+        except Exception as e:
+            self._reply_error(message, e)
+            self._keep_result(message)
+            self._finish_requests()
+            return
+        batcher = self._batchers.get(request.func_name)
+        if batcher is None:
+            LOG.warning("Request %s arrived after stop, dropped.", request)
+            self._keep_result(message)
+            self._finish_requests()
+            return
+        batcher.add((request, message))
+
+    def _reply_error(self, message, error):
+        """Reply to a request which failed before its function was called.
+        """
+        properties = self._get_reply_properties(message)
+        if properties is None:
+            return
+        correlation_id, reply_to = properties
+        response = pr.RpcResponse(error)
+        self._keep_result(message, response)
+        if not self._store_job(message, response):
+            self._publish_response(response, reply_to, correlation_id)
+
+    def _get_priority(self, request, message):
+        """Get the priority of a request, the `priority` message property or
+        the default priority of the function for calls without priority.
+        """
+        return (message.properties.get('priority') or
+                self._func_priorities.get(request.func_name, 0))
+
+    @staticmethod
+    def _get_client_id(message):
+        """Get the id of the client which sent a request message, the
+        `client_id` header if present or else the `reply_to` property.
+        """
+        client_id = (message.headers or {}).get('client_id')
+        if client_id is None:
+            client_id = message.properties.get('reply_to', '')
+        return client_id
+
+    def _admit_request(self, request, message):
+        """Check that the server is not overloaded, otherwise the request is
+        rejected with an `RpcOverloaded` error.
+
+        :rtype: `True` if the request should be processed
+        """
+        if self._shedder is None or self._shedder.accept():
+            with self._inflight_cond:
+                self._inflight += 1
+            return self._accept_job(request, message)
+
+        LOG.warning("Server is overloaded, request %s rejected.", request)
+        self._keep_result(message)
+        properties = self._get_reply_properties(message)
+        if properties is not None:
+            correlation_id, reply_to = properties
+            error = exc.RpcOverloaded("Server with id='{0}' is overloaded."
+                                      .format(self._server_id))
+            self._publish_response(pr.RpcResponse(error), reply_to,
+                                   correlation_id)
+        return False
+
+    @staticmethod
+    def _is_job(message):
+        """Return whether a request message submits a job."""
+        return bool((message.headers or {}).get('job'))
+
+    def _get_result_store(self):
+        """Return the result store of jobs, opening the default one on the
+        first use.
+        """
+        with self._result_store_lock:
+            if self._result_store is None:
+                self._result_store = jobs.SqliteResultStore()
+            return self._result_store
+
+    def _accept_job(self, request, message):
+        """Record the job submitted with an admitted request and reply with
+        its id, the correlation id of the request.
+
+        :rtype: `True` if the request should be processed
+        """
+        if not self._is_job(message):
+            return True
+        properties = self._get_reply_properties(message)
+        if properties is None:
+            self._finish_requests()
+            return False
+        correlation_id, reply_to = properties
+        try:
+            self._get_result_store().create(correlation_id)
+        except Exception as e:
+            LOG.exception("Failed to record job %s.", request)
+            self._finish_requests()
+            self._publish_response(pr.RpcResponse(e), reply_to,
+                                   correlation_id)
+            return False
+        LOG.debug("Job %s submitted.", correlation_id)
+        self._publish_response(pr.RpcResponse(correlation_id), reply_to,
+                               correlation_id)
+        return True
+
+    def _start_job(self, message):
+        """Mark the job submitted with a request message as running."""
+        if not self._is_job(message):
+            return
+        try:
+            self._get_result_store().set_running(
+                message.properties.get('correlation_id'))
+        except Exception:
+            LOG.exception("Failed to update the state of a job.")
+
+    def _store_job(self, message, response):
+        """Store the response of a job instead of replying with it. If the
+        response can't be stored, e.g. because its result can't be pickled,
+        the error is stored in its place so that the job is done anyway.
+
+        :rtype: `True` if the request message submitted a job
+        """
+        if not self._is_job(message):
+            return False
+        job_id = message.properties.get('correlation_id')
+        store = self._get_result_store()
+        try:
+            store.set_result(job_id, response)
+        except Exception as e:
+            LOG.error("Failed to store the result of job %s: %s", job_id, e)
+            try:
+                store.set_result(job_id, pr.RpcResponse(e))
+            except Exception:
+                LOG.exception("Failed to store the error of a job.")
+        return True
+
+    def job_status(self, job_id):
+        """Return the state of a job, `pending`, `running` or `done`. This
+        function is also callable over RPC as `callme.job_status`.
+
+        :raise KeyError: if there is no such job
+        """
+        return self._get_result_store().get(job_id)[0]
+
+    def job_result(self, job_id):
+        """Return the result of a job or raise the exception it raised. This
+        function is also callable over RPC as `callme.job_result`.
+
+        :raise KeyError: if there is no such job
+        :raise ValueError: if the job is not done
+        """
+        state, response = self._get_result_store().get(job_id)
+        if state != jobs.DONE:
+            raise ValueError("Job '{0}' is {1}.".format(job_id, state))
+        if response.is_exception:
+            raise response.result
+        return response.result
+
+    def forget_job(self, job_id):
+        """Remove a job and its result. This function is also callable over
+        RPC as `callme.forget_job`.
+        """
+        self._get_result_store().delete(job_id)
+
+    def _finish_requests(self, duration=None, count=1):
+        """Account admitted requests as finished.
+
+        :keyword duration: the execution time in seconds, `None` if the
+            requests were not executed
+        :keyword count: the number of finished requests
+        """
+        if self._shedder is not None:
+            self._shedder.finish(duration, count)
+        with self._inflight_cond:
+            self._inflight -= count
+            if self._inflight <= 0:
+                self._inflight_cond.notify_all()
+
+    def _wait_for_requests(self, deadline):
+        """Wait until all admitted requests are finished.
+
+        :param deadline: the time until which to wait at most
+        :rtype: `True` if all requests are finished
+        """
+        with self._inflight_cond:
+            while self._inflight > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    LOG.warning("Server with id='%s' stopped with %s "
+                                "requests in flight.", self._server_id,
+                                self._inflight)
+                    return False
+                self._inflight_cond.wait(remaining)
+        return True
+
+    def _forward_request(self, request, message):
+        """Re-publish a request that arrived on the default queue to the
+        dedicated queue of its function.
+
+        Proxies always publish to the default queue, the function name is used
+        as routing key to reach the dedicated queues.
+        """
+        LOG.debug("Forward request %s to the '%s' queue.", request,
+                  self._func_queues[request.func_name])
+        properties = message.properties
+        expiration = properties.get('expiration')
+        if expiration is not None:
+            # the property is in milliseconds, kombu takes seconds
+            expiration = float(expiration) / 1000
+        with kombu.producers[self._conn].acquire(block=True) as producer:
+            producer.publish(body=request,
+                             serializer='pickle',
+                             exchange=self._make_server_exchange(),
+                             routing_key=request.func_name,
+                             reply_to=properties.get('reply_to'),
+                             correlation_id=properties.get('correlation_id'),
+                             priority=properties.get('priority'),
+                             expiration=expiration,
+                             headers=message.headers)
+
+    @staticmethod
+    def _is_expired(message):
+        """Return whether the caller already gave up waiting for the reply
+        to a request message, according to its `deadline` header.
+
+        Deadlines are absolute times, so the clocks of clients and servers
+        should be synchronized.
+        """
+        deadline = (message.headers or {}).get('deadline')
+        return deadline is not None and deadline < time.time()
+
+    @staticmethod
+    def _get_reply_properties(message):
+        """Get the properties needed to reply to a request message.
+
+        :rtype: `(correlation_id, reply_to)` tuple or `None` if a property
+            is missing
+        """
         # get the correlation_id message property
         try:
             correlation_id = message.properties['correlation_id']
         except KeyError:
             LOG.error("The 'correlation_id' message property is missing.")
-            return
+            return None
         else:
-            LOG.debug("Correlation id: {0}".format(correlation_id))
+            LOG.debug("Correlation id: %s", correlation_id)
 
         # get the reply_to message property
         try:
             reply_to = message.properties['reply_to']
         except KeyError:
             LOG.error("The 'reply_to' message property is missing.")
-            return
+            return None
         else:
-            LOG.debug("Reply to: {0}".format(reply_to))
+            LOG.debug("Reply to: %s", reply_to)
+
+        return correlation_id, reply_to
+
+    def _process_request(self, request, message):
+        """Process incoming request."""
+        LOG.debug("Start processing request %s.", request)
+        properties = self._get_reply_properties(message)
+        if properties is None:
+            self._finish_requests()
+            return
+        correlation_id, reply_to = properties
+        labels = self._record_request(request, message)
+        if self._is_expired(message):
+            LOG.warning("Request %s expired, dropped.", request)
+            if labels is not None:
+                self._metrics.inc('callme_server_timeouts_total', labels)
+            self._keep_result(message)
+            self._finish_requests()
+            return
+        skip, cancelled = self._start_call(
+            correlation_id, request.func_name in self._cancellable)
+        if skip:
+            LOG.info("Request %s cancelled, dropped.", request)
+            self._keep_result(message)
+            self._store_job(message, pr.RpcResponse(
+                exc.RpcCancelled("Job cancelled.")))
+            self._finish_requests()
+            return
+        self._start_job(message)
+        span = self._start_span(request, message)
 
         # execute function
+        error = None
+        started = time.time()
         try:
-            LOG.debug("Call function with args {!r}, keywords {!r}".format(request.func_args, request.func_keywords))
-            result = self._func_dict[request.func_name](*request.func_args, **request.func_keywords)
+            LOG.debug("Call function with args %s, keywords %s",
+                      pr.Summary(request.func_args),
+                      pr.Summary(request.func_keywords))
+            result = self._execute(request, message, cancelled, span)
+            if request.func_name in self._by_reference:
+                result = pr.RpcHandle(self._handles.add(result),
+                                      self._server_id, self._instance_id)
         except Exception as e:
-            LOG.error("Exception happened: {0}".format(e))
+            LOG.error("Exception happened: %s", e)
+            error = e
             response = pr.RpcResponse(e)
+            if labels is not None:
+                self._metrics.inc('callme_server_errors_total', labels)
+            if span is not None:
+                span.attributes['error'] = repr(e)
         else:
-            LOG.debug("Result: {!r}".format(result))
+            LOG.debug("Result: %s", pr.Summary(result))
             response = pr.RpcResponse(result)
+        finally:
+            if cancelled is not None:
+                self._end_call(correlation_id)
+        duration = time.time() - started
+        if labels is not None:
+            self._metrics.observe('callme_server_execution_seconds',
+                                  duration, labels)
+        if span is not None:
+            span.finish()
+            self._tracer.record(span)
+        if self._request_log is not None:
+            self._request_log.log(request, duration, error, correlation_id)
+        self._keep_result(message, response)
+
+        try:
+            if self._store_job(message, response):
+                LOG.debug("Result of job %s stored.", correlation_id)
+            # nobody waits for the response of a cancelled call
+            elif cancelled is None or not cancelled.is_set():
+                self._publish_response(
+                    self._serialize_response(response, labels), reply_to,
+                    correlation_id, span)
+        finally:
+            self._finish_requests(duration)
+
+    def _start_span(self, request, message):
+        """Start the execution span of a request if the server has a tracer,
+        continuing the trace of the `trace_id` and `span_id` headers. The
+        wait in the queue is recorded as a span too.
+
+        :rtype: the execution :class:`callme.tracing.Span` or `None`
+        """
+        if self._tracer is None:
+            return None
+        headers = message.headers or {}
+        trace_id = headers.get('trace_id')
+        parent_id = headers.get('span_id')
+        if trace_id is None:
+            trace_id, parent_id = tracing.new_trace_id(), None
+        attributes = {'function': request.func_name,
+                      'server_id': self._server_id}
+        span = tracing.Span('callme.execute', trace_id, parent_id,
+                            attributes=attributes)
+        sent_at = headers.get('sent_at')
+        if sent_at is not None and parent_id is not None:
+            tracing.record(self._tracer, 'callme.queue_wait',
+                           tracing.SpanContext(trace_id, parent_id),
+                           sent_at, span.start, attributes)
+        return span
+
+    def _execute(self, request, message, cancelled, span):
+        """Call the requested function with its promises resolved, within the
+        trace context of its execution span if it is traced.
+        """
+        request = self._resolve_promises(request, message)
+        if span is None:
+            return self._call_function(request, cancelled)
+        with tracing.activate(span.context):
+            return self._call_function(request, cancelled)
+
+    def _record_request(self, request, message):
+        """Count a request and record its queue wait time, from its `sent_at`
+        header to now, if the server has metrics.
+
+        :rtype: the metric labels of the request or `None` without metrics
+        """
+        if self._metrics is None:
+            return None
+        func_name = request.func_name
+        if func_name.startswith(pr.HANDLE_FUNC_PREFIX):
+            func_name = pr.HANDLE_FUNC_PREFIX.rstrip('.')
+        elif (func_name not in self._func_dict and
+                func_name not in self._batch_dict and
+                func_name not in self._control_dict):
+            # don't let clients create a metric per unknown name
+            func_name = 'unknown'
+        labels = {'function': func_name}
+        self._metrics.inc('callme_server_requests_total', labels)
+        sent_at = (message.headers or {}).get('sent_at')
+        if sent_at is not None:
+            self._metrics.observe('callme_server_queue_seconds',
+                                  max(time.time() - sent_at, 0), labels)
+        return labels
+
+    def _serialize_response(self, response, labels):
+        """Pickle a response to record the serialization time if the server
+        has metrics, otherwise the response is pickled when published.
+        """
+        if labels is None:
+            return response
+        started = time.time()
+        try:
+            body = pr.dumps(response)
+        except Exception as e:
+            LOG.error("Failed to serialize response: %s", e)
+            self._metrics.inc('callme_server_errors_total', labels)
+            body = pr.dumps(pr.RpcResponse(e))
+        self._metrics.observe('callme_server_serialization_seconds',
+                              time.time() - started, labels)
+        return body
+
+    def _process_batch(self, func_name, items):
+        """Process a batch of requests for a batch function with a single
+        call and reply to each request with its own result.
+
+        :param func_name: the name of the batch function
+        :param items: list of `(request, message)` tuples
+        """
+        duration = None
+        try:
+            calls = []
+            func_args = []
+            for request, message in items:
+                properties = self._get_reply_properties(message)
+                if properties is None:
+                    continue
+                labels = self._record_request(request, message)
+                if self._is_expired(message):
+                    LOG.warning("Request %s expired, dropped.", request)
+                    if labels is not None:
+                        self._metrics.inc('callme_server_timeouts_total',
+                                          labels)
+                    continue
+                if self._start_call(properties[0], False)[0]:
+                    LOG.info("Request %s cancelled, dropped.", request)
+                    continue
+                if request.func_keywords:
+                    if labels is not None:
+                        self._metrics.inc('callme_server_errors_total',
+                                          labels)
+                    self._reply_error(message, TypeError(
+                        "Batch function '{0}' doesn't accept keyword "
+                        "arguments.".format(func_name)))
+                    continue
+                self._start_job(message)
+                span = self._start_span(request, message)
+                calls.append((request, message, properties, labels, span))
+                func_args.append(tuple(request.func_args))
+            if not calls:
+                return
+
+            LOG.debug("Call batch function '%s' with %d argument tuples.",
+                      func_name, len(func_args))
+            error = None
+            started = time.time()
+            try:
+                results = list(self._batch_dict[func_name][0](func_args))
+                if len(results) != len(func_args):
+                    raise ValueError("Batch function '{0}' returned {1} "
+                                     "results for {2} calls."
+                                     .format(func_name, len(results),
+                                             len(func_args)))
+            except Exception as e:
+                LOG.error("Exception happened: %s", e)
+                error = e
+                results = [e] * len(func_args)
+            finished = time.time()
+            duration = finished - started
+
+            # every call of the batch is accounted with the duration of the
+            # whole batch
+            for call, result in zip(calls, results):
+                request, message, properties, labels, span = call
+                correlation_id, reply_to = properties
+                if labels is not None:
+                    if error is not None:
+                        self._metrics.inc('callme_server_errors_total',
+                                          labels)
+                    self._metrics.observe('callme_server_execution_seconds',
+                                          duration, labels)
+                if span is not None:
+                    span.attributes['batch_size'] = len(calls)
+                    if error is not None:
+                        span.attributes['error'] = repr(error)
+                    span.finish(finished)
+                    self._tracer.record(span)
+                if self._request_log is not None:
+                    self._request_log.log(request, duration, error,
+                                          correlation_id)
+                response = pr.RpcResponse(result)
+                self._keep_result(message, response)
+                if not self._store_job(message, response):
+                    self._publish_response(
+                        self._serialize_response(response, labels),
+                        reply_to, correlation_id, span)
+        finally:
+            # release the requests waiting for dropped results
+            for _, message in items:
+                self._keep_result(message)
+            self._finish_requests(duration, count=len(items))
+
+    def _publish_response(self, response, reply_to, correlation_id,
+                          span=None):
+        """Publish the response to the exchange the client listens on.
+
+        While the server is running responses are handed over to the reply
+        publisher, otherwise they are published right away.
 
-        LOG.debug("Publish response: {0}".format(response))
+        :keyword span: the execution span of the request, the publish is
+            traced as its child once the response is actually published
+        """
+        published = None
+        if span is not None:
+            published = functools.partial(tracing.record, self._tracer,
+                                          'callme.reply_publish', span)
+        reply_publisher = self._publisher
+        if reply_publisher is not None and reply_publisher.publish(
+                response, reply_to, correlation_id, published):
+            return
+
+        LOG.debug("Publish response: %s", response)
+        started = time.time()
         with kombu.producers[self._conn].acquire(block=True) as producer:
             exchange = self._make_exchange(reply_to,
                                            durable=self._durable,
                                            auto_delete=True)
             producer.publish(body=response,
-                             serializer='pickle',
                              exchange=exchange,
                              correlation_id=correlation_id,
-                             declare=[exchange])
+                             declare=[exchange],
+                             **dict(pr.publish_options(response),
+                                    **self._retry_options()))
+        if published is not None:
+            published(started)
+
+    def _lookup_function(self, name):
+        """Return the registered or control function with the given name.
+
+        :raise KeyError: if there is no such function
+        """
+        if name.startswith(pr.HANDLE_FUNC_PREFIX):
+            return self._lookup_method(name)
+        try:
+            return self._control_dict[name]
+        except KeyError:
+            return self._func_dict[name]
+
+    def _lookup_method(self, name):
+        """Return the attribute of an object kept on the server, named
+        `callme.handle.<handle id>.<attribute>`. Plain attributes are
+        returned by a function, so that clients can read them.
+
+        :raise KeyError: if there is no such handle
+        :raise AttributeError: if there is no such public attribute
+        """
+        handle_id, _, path = name[len(pr.HANDLE_FUNC_PREFIX):].partition('.')
+        attr = self._handles.get(handle_id)
+        for attr_name in path.split('.'):
+            if attr_name.startswith('_') and attr_name not in HANDLE_METHODS:
+                raise AttributeError("The '{0}' attribute is private."
+                                     .format(attr_name))
+            attr = getattr(attr, attr_name)
+        if callable(attr):
+            return attr
+        return lambda: attr
+
+    def _call_function(self, request, cancelled=None):
+        """Call the requested function, the result is taken from and stored
+        in the function's cache if it is memoized.
+
+        :param cancelled: the cancellation flag passed to a cancellable
+            function as the `cancelled` keyword argument
+        """
+        func = self._lookup_function(request.func_name)
+        func_keywords = request.func_keywords
+        if cancelled is not None:
+            func_keywords = dict(func_keywords, cancelled=cancelled)
+        result_cache = self._caches.get(request.func_name)
+        if result_cache is None:
+            return func(*request.func_args, **func_keywords)
 
-    def register_function(self, func, name=None):
+        key = cache.make_key(request.func_args, request.func_keywords)
+        if key is None:
+            LOG.debug("Arguments can't be pickled, cache is bypassed.")
+            return func(*request.func_args, **func_keywords)
+        found, result = result_cache.get(key)
+        if not found:
+            result = func(*request.func_args, **func_keywords)
+            # the result of a cancelled call may be incomplete
+            if cancelled is None or not cancelled.is_set():
+                result_cache.set(key, result)
+        return result
+
+    def invalidate_cache(self, name=None):
+        """Remove the cached results of a memoized function. This function is
+        also callable over RPC as `callme.invalidate_cache`.
+
+        :param name: the name of the memoized function, `None` invalidates
+            the caches of all functions
+        """
+        if name is None:
+            result_caches = list(self._caches.values())
+        else:
+            result_caches = [self._caches[name]]
+        for result_cache in result_caches:
+            result_cache.clear()
+
+    def cache_stats(self, name=None):
+        """Return the hit and miss counters of the memoized functions. This
+        function is also callable over RPC as `callme.cache_stats`.
+
+        :param name: the name of the memoized function, `None` returns the
+            statistics of all functions
+        :rtype: dict of statistics keyed by function name
+        """
+        names = sorted(self._caches) if name is None else [name]
+        return dict((n, self._caches[n].stats()) for n in names)
+
+    def profile(self, func_name, duration=30, limit=30):
+        """Profile the calls of a registered function with cProfile for a
+        while, without restarting the server, and return the aggregated
+        statistics. This function is also callable over RPC as
+        `callme.profile` if the server is threaded or has `max_workers`.
+
+        :param func_name: the name of the registered function
+        :keyword duration: the number of seconds to profile, at most
+            `MAX_PROFILE_DURATION`
+        :keyword limit: the number of functions with the highest cumulative
+            time to include in the statistics
+        :rtype: dict with the numbers of profiled and skipped calls, and a
+            list of dicts with the statistics of each function
+        """
+        if not 0 < duration <= MAX_PROFILE_DURATION:
+            raise ValueError("The 'duration' must be between 0 and {0} "
+                             "seconds.".format(MAX_PROFILE_DURATION))
+        with self._profiling_lock:
+            if func_name in self._profiling:
+                raise RuntimeError("The '{0}' is already profiled."
+                                   .format(func_name))
+            profiler = profiling.Profiler(self._func_dict[func_name])
+            self._func_dict[func_name] = profiler
+            self._profiling.add(func_name)
+        LOG.info("Profile '%s' for %s seconds.", func_name, duration)
+        try:
+            time.sleep(duration)
+        finally:
+            with self._profiling_lock:
+                # the function may have been replaced in the meantime
+                if self._func_dict.get(func_name) is profiler:
+                    self._func_dict[func_name] = profiler.func
+                self._profiling.discard(func_name)
+        return profiler.summary(limit)
+
+    def _remote_profile(self, func_name, duration=30, limit=30):
+        # a serial server can't execute calls while it waits here
+        if not self._threaded and self._default_pool is None:
+            raise RuntimeError("Profiling over RPC requires a threaded "
+                               "server or one with 'max_workers'.")
+        return self.profile(func_name, duration, limit)
+
+    def register_function(self, func, name=None, queue=None,
+                          max_concurrency=None, memoize=False,
+                          cache_size=128, ttl=None, priority=None,
+                          cancellable=False, by_reference=False):
         """Registers a function as rpc function so that is accessible from the
         proxy.
 
         :param func: the function we want to provide as rpc method
         :param name: the name with which the function is visible to the clients
+        :param queue: the name of a dedicated queue the function is served
+            from, so that slow functions don't block the other ones
+        :param max_concurrency: the number of calls executed in parallel from
+            the dedicated queue (defaults to 1)
+        :param memoize: cache the results of the function on the server,
+            calls with equal arguments are answered from the cache
+        :param cache_size: the maximal number of cached results
+        :param ttl: the number of seconds a cached result stays valid, `None`
+            means results never expire
+        :param priority: the priority of calls made without priority, used
+            when dispatching calls waiting for a worker of a server with
+            `max_priority`
+        :param cancellable: the function accepts a `cancelled` keyword
+            argument, a `threading.Event` that is set when the call is
+            cancelled by the client while running
+        :param by_reference: the results of the function are kept on the
+            server and the clients get remote objects whose methods are
+            called on the server, instead of copies of the results
+        """
+        if not callable(func):
+            raise ValueError("The '{0}' is not callable.".format(func))
+        if queue is None:
+            if max_concurrency is not None:
+                raise ValueError("The 'max_concurrency' requires a 'queue'.")
+        else:
+            limit = self._queue_limits.get(queue)
+            if max_concurrency is None:
+                max_concurrency = limit or 1
+            elif limit is not None and limit != max_concurrency:
+                raise ValueError("The '{0}' queue is already limited to {1} "
+                                 "concurrent calls.".format(queue, limit))
+            if max_concurrency < 1:
+                raise ValueError("The 'max_concurrency' must be positive.")
+
+        result_cache = cache.ResultCache(cache_size, ttl) if memoize else None
+
+        name = name if name is not None else func.__name__
+        self._batch_dict.pop(name, None)
+        self._func_dict[name] = func
+        if queue is None:
+            self._func_queues.pop(name, None)
+        else:
+            self._func_queues[name] = queue
+            self._queue_limits[queue] = max_concurrency
+        if result_cache is not None:
+            self._caches[name] = result_cache
+        else:
+            self._caches.pop(name, None)
+        if priority is not None:
+            self._func_priorities[name] = priority
+        else:
+            self._func_priorities.pop(name, None)
+        if cancellable:
+            self._cancellable.add(name)
+        else:
+            self._cancellable.discard(name)
+        if by_reference:
+            self._by_reference.add(name)
+        else:
+            self._by_reference.discard(name)
+
+    def reload_functions(self, functions):
+        """Atomically replace all functions registered with
+        :func:`register_function` and their settings, e.g. to deploy new code
+        into a running server. Requests in flight finish with the previous
+        functions.
+
+        A function given as a callable gets the default settings, the
+        settings of the function it replaces don't carry over. Cached results
+        of replaced memoized functions are invalidated.
+
+            >> server.reload_functions({'add': add,
+            ..                          'fib': {'func': fib, 'queue': 'slow'}})
+
+        :param functions: dict keyed by name of functions, or of dicts of the
+            keyword arguments of :func:`register_function`
+        :raise ValueError: if a function is invalid, or if a running server
+            would have to serve a new queue
+        """
+        # register the functions on a copy of the server, so that the
+        # registration state is swapped as a whole once it is complete
+        staged = copy.copy(self)
+        staged._func_dict = {}
+        staged._func_queues = {}
+        staged._queue_limits = dict(self._queue_limits)
+        staged._caches = {}
+        staged._func_priorities = {}
+        staged._cancellable = set()
+        staged._by_reference = set()
+        staged._batch_dict = dict(self._batch_dict)
+        for name, options in functions.items():
+            if not isinstance(options, dict):
+                options = {'func': options}
+            staged.register_function(name=name, **options)
+        if self.is_running:
+            for queue in set(staged._func_queues.values()):
+                if queue not in self._queue_limits:
+                    raise ValueError("The '{0}' queue can't be added to a "
+                                     "running server.".format(queue))
+
+        for name in list(staged._caches):
+            if (name in self._caches and
+                    staged._func_dict[name] is self._func_dict.get(name)):
+                staged._caches[name] = self._caches[name]
+        self._func_queues = staged._func_queues
+        self._queue_limits = staged._queue_limits
+        self._caches = staged._caches
+        self._func_priorities = staged._func_priorities
+        self._cancellable = staged._cancellable
+        self._by_reference = staged._by_reference
+        self._func_dict = staged._func_dict
+
+    def register_batch_function(self, func, name=None, max_batch=256,
+                                max_wait_ms=5):
+        """Registers a batch function as rpc function so that is accessible
+        from the proxy like any other function.
+
+        Concurrent calls are collected into batches and the function is
+        called once per batch with the list of the calls' argument tuples.
+        It must return a list with one result per call, in the same order.
+        Exception instances in that list are raised on the calling clients.
+
+        :param func: the batch function we want to provide as rpc method
+        :param name: the name with which the function is visible to the clients
+        :param max_batch: the maximal number of calls in a batch
+        :param max_wait_ms: the number of milliseconds to wait for a batch to
+            fill up after its first call arrived
         """
         if not callable(func):
             raise ValueError("The '{0}' is not callable.".format(func))
+        if max_batch < 1:
+            raise ValueError("The 'max_batch' must be positive.")
+
+        name = name if name is not None else func.__name__
+        self._func_dict.pop(name, None)
+        self._func_queues.pop(name, None)
+        self._caches.pop(name, None)
+        self._cancellable.discard(name)
+        self._by_reference.discard(name)
+        self._batch_dict[name] = (func, max_batch, max_wait_ms / 1000.0)
+
+    def _make_server_exchange(self):
+        """Make the exchange all requests of this server are published to."""
+        return self._make_exchange('server_{0}_ex'.format(self._server_id),
+                                   durable=self._durable,
+                                   auto_delete=self._auto_delete)
+
+    def _make_consumers(self, conn, exchange):
+        """Make the consumers of the default queue, and of the queue of the
+        instance if it has functions returning objects by reference.
+        """
+        queue = self._make_queue('server_{0}_queue'.format(self._server_id),
+                                 exchange,
+                                 durable=self._durable,
+                                 auto_delete=self._auto_delete,
+                                 max_priority=self._max_priority)
+        consumers = [conn.Consumer(queues=queue,
+                                   callbacks=[self._on_request],
+                                   accept=['pickle'])]
+        if self._by_reference:
+            consumers.append(conn.Consumer(
+                queues=self._make_instance_queue(exchange),
+                callbacks=[self._on_request],
+                accept=['pickle']))
+        return consumers
+
+    def _make_instance_queue(self, exchange):
+        """Make the exclusive queue of the server instance, the calls to the
+        objects it keeps by reference are routed to it with the instance id.
+        """
+        name = 'server_{0}_instance_{1}'.format(self._server_id,
+                                                self._instance_id)
+        return kombu.Queue(name=name,
+                           exchange=exchange,
+                           routing_key=self._instance_id,
+                           exclusive=True,
+                           auto_delete=True)
+
+    def _make_queue_consumers(self, conn, exchange, queue_name, stopped):
+        """Make the consumers of a dedicated function queue, with a prefetch
+        count of the queue's `max_concurrency`.
+
+        :param stopped: the event set when consuming stops
+        """
+        routing_keys = sorted(name for name, q in self._func_queues.items()
+                              if q == queue_name)
+        queue = self._make_queue(
+            'server_{0}_queue_{1}'.format(self._server_id, queue_name),
+            exchange,
+            durable=self._durable,
+            auto_delete=self._auto_delete,
+            routing_keys=routing_keys,
+            max_priority=self._max_priority)
+        callback = functools.partial(self._on_queue_request, queue_name,
+                                     conn, stopped)
+        return [conn.Consumer(queues=queue,
+                              callbacks=[callback],
+                              accept=['pickle'],
+                              prefetch_count=self._queue_limits[queue_name])]
+
+    def _make_tasks(self):
+        """Make the task queue of a worker pool, a priority scheduler if the
+        server has priorities or `None` for a FIFO queue.
+        """
+        if self._max_priority is not None:
+            return sch.PriorityScheduler()
+        return None
+
+    def _start_pools(self):
+        """Start the autoscaling worker pool and a worker pool for each
+        dedicated function queue.
+        """
+        if self._autoscaler is not None:
+            self._default_pool = pool.WorkerPool(
+                self._autoscaler.min_workers,
+                name='server_{0}'.format(self._server_id),
+                tasks=self._scheduler or self._make_tasks())
+            self._default_pool.start()
+        for queue_name in set(self._func_queues.values()):
+            worker_pool = pool.WorkerPool(
+                self._queue_limits[queue_name],
+                name='server_{0}_{1}'.format(self._server_id, queue_name),
+                tasks=self._make_tasks())
+            worker_pool.start()
+            self._pools[queue_name] = worker_pool
+            self._slots[queue_name] = pool.Slots(
+                self._queue_limits[queue_name])
+
+    def _stop_pools(self):
+        """Stop all worker pools."""
+        default_pool, self._default_pool = self._default_pool, None
+        if default_pool is not None:
+            default_pool.stop()
+        pools, self._pools = self._pools, {}
+        for worker_pool in pools.values():
+            worker_pool.stop()
+
+    def _autoscale(self, channel, queue):
+        """Resize the autoscaling worker pool to the observed load.
+
+        The load is made of the busy workers, the calls waiting for a worker
+        which can be dispatched right away and the messages waiting in the
+        broker's queue. Calls held back by the rate limit of a fair scheduler
+        don't count, more workers wouldn't dispatch them any sooner.
+
+        :param channel: the channel used to passively declare the queue
+        :param queue: the default queue of the server
+        """
+        worker_pool = self._default_pool
+        if worker_pool is None or time.time() < self._next_autoscale:
+            return
+        self._next_autoscale = time.time() + AUTOSCALE_INTERVAL
+
+        try:
+            depth = queue(channel).queue_declare(passive=True).message_count
+        except Exception:
+            LOG.exception("Failed to get the depth of the '%s' queue.",
+                          queue.name)
+            depth = 0
+        size = self._autoscaler.desired_size(worker_pool.size,
+                                             worker_pool.busy,
+                                             worker_pool.ready + depth)
+        if size != worker_pool.size:
+            LOG.info("Resize the worker pool of server with id='%s' from %s "
+                     "to %s threads.", self._server_id, worker_pool.size,
+                     size)
+            worker_pool.resize(size)
+
+    def _start_batchers(self):
+        """Start a batcher for each batch function."""
+        for name, (_, max_batch, max_wait) in self._batch_dict.items():
+            batcher = batch.Batcher(
+                functools.partial(self._process_batch, name),
+                max_batch=max_batch,
+                max_wait=max_wait,
+                name='server_{0}_{1}'.format(self._server_id, name))
+            batcher.start()
+            self._batchers[name] = batcher
+
+    def _stop_batchers(self):
+        """Stop the batchers of the batch functions."""
+        batchers, self._batchers = self._batchers, {}
+        for batcher in batchers.values():
+            batcher.stop()
+
+    def _start_publisher(self):
+        """Start the reply publisher."""
+        self._publisher = publisher.ReplyPublisher(
+            self._conn,
+            functools.partial(self._make_exchange,
+                              durable=self._durable,
+                              auto_delete=True),
+            name='server_{0}_publisher'.format(self._server_id),
+            confirms=self._confirms)
+        self._publisher.start()
+        self._owns_publisher = True
+
+    def _stop_publisher(self, deadline=None):
+        """Stop the reply publisher unless it is shared with other servers.
+
+        :keyword deadline: the time until which to wait for the queued
+            replies to be published, `None` not to wait
+        """
+        reply_publisher, self._publisher = self._publisher, None
+        if reply_publisher is not None and self._owns_publisher:
+            if deadline is None:
+                reply_publisher.stop()
+            else:
+                reply_publisher.stop(wait=True,
+                                     timeout=max(0, deadline - time.time()))
+
+    def _open(self, conn, reply_publisher=None):
+        """Start consuming the server's queues on the connection and start
+        the helper threads.
+
+        :param conn: the connection to consume on
+        :param reply_publisher: a reply publisher shared with other servers,
+            `None` to start an own one
+        :rtype: list of consumers to pass to :func:`_close`
+        """
+        consumers = self._make_consumers(conn, self._make_server_exchange())
+        if reply_publisher is None:
+            self._start_publisher()
+        else:
+            self._publisher = reply_publisher
+            self._owns_publisher = False
+        self._start_pools()
+        self._start_batchers()
+        try:
+            for consumer in consumers:
+                consumer.consume()
+        except Exception:
+            self._close(consumers)
+            raise
+        self._running.set()
+        self._start_consumers()
+        return consumers
+
+    def _close(self, consumers):
+        """Stop consuming and stop the helper threads.
+
+        :param consumers: the consumers returned by :func:`_open`
+        """
+        self._running.clear()
+        deadline, self._drain_deadline = self._drain_deadline, None
+        try:
+            for consumer in consumers:
+                _cancel_consumer(consumer)
+        finally:
+            self._stop_consumers()
+            if deadline is not None:
+                self._wait_for_requests(deadline)
+            self._stop_pools()
+            self._stop_batchers()
+            self._stop_publisher(deadline)
+
+    def _start_consumers(self):
+        """Start consuming the server's default queue on the other brokers of
+        its shard and its dedicated function queues on all of its brokers,
+        each in its own thread.
+
+        A dedicated queue is consumed on a connection of its own, since its
+        consumer waits for free workers of the queue.
+        """
+        self._consumers_stopped = threading.Event()
+        targets = [(conn, None) for conn in self._shard_conns]
+        for queue_name in sorted(set(self._func_queues.values())):
+            targets.extend((conn.clone(), queue_name)
+                           for conn in [self._conn] + self._shard_conns)
+        for conn, queue_name in targets:
+            t = threading.Thread(
+                target=self._consume,
+                args=(conn, self._consumers_stopped, queue_name),
+                name='server_{0}_{1}'.format(self._server_id,
+                                             queue_name or 'shard'))
+            t.daemon = True
+            t.start()
+            self._consume_threads.append(t)
+
+    def _stop_consumers(self):
+        """Stop the threads consuming on the other brokers of the shard and
+        the dedicated queues.
+        """
+        if self._consumers_stopped is not None:
+            self._consumers_stopped.set()
+        threads, self._consume_threads = self._consume_threads, []
+        for t in threads:
+            t.join()
 
-        self._func_dict[name if name is not None else func.__name__] = func
+    def _consume(self, conn, stopped, queue_name=None):
+        """Consume the server's default queue, or the dedicated queue with the
+        given name, on a connection until `stopped` is set, reconnecting if
+        the server reconnects. The replies are published through the server's
+        own broker.
+
+        The connection of a dedicated queue is released when done.
+        """
+        try:
+            while not stopped.is_set():
+                try:
+                    self._drain(conn, stopped, queue_name)
+                    return
+                except base.connection_errors(conn) as e:
+                    if not self._reconnect:
+                        LOG.error("Consuming on %s failed: %s",
+                                  conn.as_uri(), e)
+                        return
+                    LOG.warning("Connection to %s lost: %s, reconnecting.",
+                                conn.as_uri(), e)
+                except Exception:
+                    LOG.exception("Consuming on %s failed.", conn.as_uri())
+                    return
+                if not self._reestablish(conn, stopped):
+                    return
+        finally:
+            if queue_name is not None:
+                conn.release()
+
+    def _drain(self, conn, stopped, queue_name=None):
+        """Consume the server's default queue, or the dedicated queue with the
+        given name, on a connection until `stopped` is set.
+        """
+        exchange = self._make_server_exchange()
+        if queue_name is None:
+            consumers = self._make_consumers(conn, exchange)
+        else:
+            consumers = self._make_queue_consumers(conn, exchange, queue_name,
+                                                   stopped)
+        try:
+            for consumer in consumers:
+                consumer.consume()
+            while not stopped.is_set():
+                if conn.heartbeat:
+                    conn.heartbeat_check()
+                try:
+                    conn.drain_events(timeout=1)
+                except socket.timeout:
+                    pass
+        finally:
+            for consumer in consumers:
+                _cancel_consumer(consumer)
+
+    def _tick(self, conn, consumers):
+        """Do the periodic work of a running server.
+
+        :param conn: the connection the server consumes on
+        :param consumers: the consumers returned by :func:`_open`
+        """
+        self._autoscale(conn.default_channel, consumers[0].queues[0])
 
     def start(self):
         """Start the server."""
-        LOG.info("Server with id='{0}' started.".format(self._server_id))
+        LOG.info("Server with id='%s' started.", self._server_id)
+        self._stop_requested.clear()
         try:
             with kombu.connections[self._conn].acquire(block=True) as conn:
-                exchange = self._make_exchange(
-                    'server_{0}_ex'.format(self._server_id),
-                    durable=self._durable,
-                    auto_delete=self._auto_delete)
-                queue = self._make_queue(
-                    'server_{0}_queue'.format(self._server_id), exchange,
-                    durable=self._durable,
-                    auto_delete=self._auto_delete)
-                with conn.Consumer(queues=queue,
-                                   callbacks=[self._on_request],
-                                   accept=['pickle']):
-                    self._running.set()
-                    while self.is_running:
-                        try:
-                            conn.drain_events(timeout=1)
-                        except socket.timeout:
-                            pass
-                        except Exception:
-                            LOG.exception("Draining events failed.")
-                            return
-                        except KeyboardInterrupt:
-                            LOG.info("Server with id='{0}' stopped.".format(
-                                self._server_id))
-                            return
-        except socket.error:
+                _serve_until_stopped(
+                    self, conn, [self], self._running, self._control_queue,
+                    "Server with id='{0}'".format(self._server_id))
+        except base.connection_errors(self._conn):
             raise exc.ConnectionError("Broker connection failed")
 
     def wait(self):
@@ -209,5 +1568,263 @@ class Server(base.Base):
 
     def stop(self):
         """Stop the server."""
-        LOG.debug("Stopping the '{0}' server.".format(self._server_id))
+        LOG.debug("Stopping the '%s' server.", self._server_id)
+        running = self.is_running
+        self._stop_requested.set()
+        self._running.clear()
+        if running:
+            self._wakeup(self._control_queue)
+
+    def drain(self, timeout=30):
+        """Stop the server gracefully. The server stops consuming requests
+        but :func:`start` only returns once the requests in flight are
+        finished and their replies are published, or the timeout expired.
+
+        :keyword timeout: the maximal number of seconds to wait for the
+            requests in flight
+        """
+        LOG.debug("Draining the '%s' server.", self._server_id)
+        self._drain_deadline = time.time() + timeout
+        self.stop()
+
+
+class ServerGroup(base.Base):
+    """This ServerGroup class is used to run many servers on one connection
+    with one consume loop and one reply publisher.
+
+    Typical use:
+
+        >> group = ServerGroup()
+        >> group.add_service('fooserver', {'add': add})
+        >> group.add_service('barserver', [fib], threaded=True)
+        >> group.start()
+
+    :keyword amqp_host: the host of where the AMQP Broker is running, or a
+        kombu URL selecting another transport, e.g. `memory://`
+    :keyword amqp_user: the username for the AMQP Broker
+    :keyword amqp_password: the password for the AMQP Broker
+    :keyword amqp_vhost: the virtual host of the AMQP Broker
+    :keyword amqp_port: the port of the AMQP Broker
+    :keyword ssl: use SSL connection for the AMQP Broker
+    :keyword durable: make all exchanges and queues of all servers durable
+    :keyword auto_delete: delete queues after all connections are closed
+    :keyword transport_options: dict of options of the kombu transport,
+        e.g. `{'polling_interval': 0.01}`
+    :keyword connection_options: dict of further keyword arguments of the
+        kombu connection, e.g. `{'heartbeat': 10, 'connect_timeout': 5}`
+    :keyword reconnect: reconnect when the broker connection is lost,
+        re-declare the queues of all servers and resume consuming
+    :keyword confirms: publish the responses of all servers with publisher
+        confirms
+    """
+
+    def __init__(self,
+                 amqp_host='localhost',
+                 amqp_user='guest',
+                 amqp_password='guest',
+                 amqp_vhost='/',
+                 amqp_port=5672,
+                 ssl=False,
+                 durable=False,
+                 auto_delete=True,
+                 transport_options=None,
+                 connection_options=None,
+                 reconnect=False,
+                 confirms=False):
+        super(ServerGroup, self).__init__(amqp_host, amqp_user, amqp_password,
+                                          amqp_vhost, amqp_port, ssl,
+                                          transport_options,
+                                          connection_options, reconnect)
+        self._amqp_params = dict(amqp_host=amqp_host,
+                                 amqp_user=amqp_user,
+                                 amqp_password=amqp_password,
+                                 amqp_vhost=amqp_vhost,
+                                 amqp_port=amqp_port,
+                                 ssl=ssl,
+                                 transport_options=transport_options,
+                                 connection_options=connection_options,
+                                 reconnect=reconnect)
+        self._durable = durable
+        self._auto_delete = auto_delete
+        self._servers = []
+        self._running = threading.Event()
+        self._stop_requested = threading.Event()
+        self._drain_deadline = None
+        self._confirms = confirms
+        self._control_queue = self._make_control_queue('servergroup')
+
+    @property
+    def is_running(self):
+        """Return whether the server group is running."""
+        return self._running.is_set()
+
+    @property
+    def servers(self):
+        """Return the servers of the group."""
+        return list(self._servers)
+
+    def add_service(self, server_id, functions=None, **kwargs):
+        """Add a server to the group. Servers can't be added while the group
+        is running.
+
+        :param server_id: id of the server
+        :param functions: dict of functions keyed by name or list of
+            functions to register on the server
+        :param kwargs: further keyword arguments of :class:`Server`
+        :rtype: the new :class:`Server`
+        """
+        if self.is_running:
+            raise RuntimeError("Can't add a server to a running group.")
+        kwargs.update(self._amqp_params)
+        server = Server(server_id,
+                        durable=self._durable,
+                        auto_delete=self._auto_delete,
+                        **kwargs)
+        if isinstance(functions, dict):
+            for name, func in functions.items():
+                server.register_function(func, name)
+        else:
+            for func in functions or []:
+                server.register_function(func)
+        self._servers.append(server)
+        return server
+
+    def start(self):
+        """Start all servers of the group."""
+        LOG.info("Server group with %s servers started.",
+                 len(self._servers))
+        reply_publisher = publisher.ReplyPublisher(
+            self._conn,
+            functools.partial(self._make_exchange,
+                              durable=self._durable,
+                              auto_delete=True),
+            name='servergroup_publisher',
+            confirms=self._confirms)
+        reply_publisher.start()
+        self._stop_requested.clear()
+        try:
+            with kombu.connections[self._conn].acquire(block=True) as conn:
+                _serve_until_stopped(self, conn, self._servers,
+                                     self._running, self._control_queue,
+                                     'Server group',
+                                     reply_publisher=reply_publisher)
+        except base.connection_errors(self._conn):
+            raise exc.ConnectionError("Broker connection failed")
+        finally:
+            deadline, self._drain_deadline = self._drain_deadline, None
+            if deadline is None:
+                reply_publisher.stop()
+            else:
+                reply_publisher.stop(wait=True,
+                                     timeout=max(0, deadline - time.time()))
+
+    def wait(self):
+        """Wait until the server group is started."""
+        self._running.wait()
+
+    def stop(self):
+        """Stop all servers of the group."""
+        LOG.debug("Stopping the server group.")
+        running = self.is_running
+        self._stop_requested.set()
         self._running.clear()
+        if running:
+            self._wakeup(self._control_queue)
+
+    def drain(self, timeout=30):
+        """Stop all servers of the group gracefully, see
+        :func:`Server.drain`.
+
+        :keyword timeout: the maximal number of seconds to wait for the
+            requests in flight
+        """
+        LOG.debug("Draining the server group.")
+        self._drain_deadline = time.time() + timeout
+        for server in self._servers:
+            server._drain_deadline = self._drain_deadline
+        self.stop()
+
+
+def _on_control(body, message):
+    """Acknowledge a wake up message of a consume loop."""
+    message.ack()
+
+
+def _cancel_consumer(consumer):
+    """Cancel a consumer, which fails if its connection was lost."""
+    try:
+        consumer.cancel()
+    except Exception as e:
+        LOG.warning("Failed to cancel a consumer: %s", e)
+
+
+def _serve_until_stopped(owner, conn, servers, running, control_queue, name,
+                         reply_publisher=None):
+    """Consume the requests of servers with :func:`_serve`, and if the
+    `owner` reconnects, reconnect and consume again whenever the connection
+    is lost until the owner is stopped.
+
+    :param owner: the server or server group running the loop
+    :raise: the connection error if the owner doesn't reconnect
+    """
+    while True:
+        try:
+            _serve(conn, servers, running, control_queue, name,
+                   reply_publisher=reply_publisher)
+            return
+        except base.connection_errors(conn) as e:
+            if not owner._reconnect or owner._stop_requested.is_set():
+                raise
+            LOG.warning("%s lost its broker connection: %s, reconnecting.",
+                        name, e)
+        if not owner._reestablish(conn, owner._stop_requested):
+            return
+        servers = [s for s in servers if not s._stop_requested.is_set()]
+
+
+def _serve(conn, servers, running, control_queue, name, reply_publisher=None):
+    """Consume the requests of servers on a connection until the `running`
+    event is cleared.
+
+    :param conn: the connection to consume on
+    :param servers: list of servers
+    :param running: the event which is set while the loop runs
+    :param control_queue: the queue stop wake ups are published to
+    :param name: the name used for logging
+    :param reply_publisher: a reply publisher shared by the servers
+    """
+    opened = []
+    control = conn.Consumer(queues=control_queue,
+                            callbacks=[_on_control],
+                            accept=['json'])
+    try:
+        control.consume()
+        for server in servers:
+            opened.append((server, server._open(conn, reply_publisher)))
+        running.set()
+        while running.is_set():
+            try:
+                if conn.heartbeat:
+                    conn.heartbeat_check()
+                conn.drain_events(timeout=1)
+            except socket.timeout:
+                pass
+            except base.connection_errors(conn):
+                raise
+            except Exception:
+                LOG.exception("Draining events failed.")
+                return
+            except KeyboardInterrupt:
+                LOG.info("%s stopped.", name)
+                return
+            for server, consumers in list(opened):
+                if server.is_running:
+                    server._tick(conn, consumers)
+                else:
+                    opened.remove((server, consumers))
+                    server._close(consumers)
+    finally:
+        running.clear()
+        for server, consumers in opened:
+            server._close(consumers)
+        _cancel_consumer(control)
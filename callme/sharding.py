@@ -0,0 +1,68 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import bisect
+import hashlib
+
+
+def _hash(key):
+    return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """This class is used to map keys, such as server ids, to brokers by
+    consistent hashing: adding or removing a broker only moves the keys of
+    the neighbouring points of the ring.
+
+    Every broker is placed on the ring `replicas` times, so the keys are
+    spread evenly. The mapping only depends on the set of brokers, not on
+    their order, so every proxy and server configured with the same brokers
+    agrees on it.
+
+    :param brokers: list of broker URLs
+    :keyword replicas: the number of points of every broker on the ring
+    """
+
+    def __init__(self, brokers, replicas=100):
+        brokers = sorted(set(brokers))
+        if not brokers:
+            raise ValueError("A hash ring needs at least one broker.")
+        self.brokers = brokers
+        points = sorted((_hash('{0}#{1}'.format(broker, i)), broker)
+                        for broker in brokers
+                        for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._brokers = [broker for _, broker in points]
+
+    def get(self, key):
+        """Return the broker a key is mapped to."""
+        i = bisect.bisect(self._keys, _hash(key))
+        return self._brokers[i % len(self._brokers)]
@@ -0,0 +1,105 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+import threading
+
+import mock
+
+from callme import base
+from callme import test
+
+
+class TestBase(test.MockTestCase):
+
+    def setUp(self):
+        super(TestBase, self).setUp()
+
+        # mock kombu Connection
+        self.conn_mock, self.conn_inst_mock = self._mock_class(
+            base.kombu, 'BrokerConnection')
+        self.conn_inst_mock.connection_errors = ()
+
+    def test_connection_arguments(self):
+        base.Base('h', 'guest', 'guest', '/', 5672, False)
+        self.conn_mock.assert_called_once_with(
+            hostname='h', userid='guest', password='guest',
+            virtual_host='/', port=5672, ssl=False)
+
+    def test_connection_url_without_amqp_defaults(self):
+        base.Base('redis://localhost:6379/0', 'guest', 'guest', '/', 5672,
+                  False, transport_options={'visibility_timeout': 60})
+        self.conn_mock.assert_called_once_with(
+            hostname='redis://localhost:6379/0',
+            transport_options={'visibility_timeout': 60})
+
+    def test_connection_url_with_arguments(self):
+        base.Base('redis://localhost', 'u', 'p', '/', 6380, False)
+        self.conn_mock.assert_called_once_with(
+            hostname='redis://localhost', userid='u', password='p',
+            port=6380)
+
+    def test_retry_options(self):
+        self.assertEqual(base.Base('h', 'u', 'p', '/', 1, False)
+                         ._retry_options(), {})
+        options = base.Base('h', 'u', 'p', '/', 1, False,
+                            reconnect=True)._retry_options()
+        self.assertEqual(options, {'retry': True,
+                                   'retry_policy': base.RETRY_POLICY})
+
+    @mock.patch.object(base.time, 'sleep')
+    def test_reestablish_backoff(self, sleep_mock):
+        b = base.Base('h', 'u', 'p', '/', 1, False, reconnect=True)
+        conn = mock.Mock(connection_errors=())
+        conn.connect.side_effect = [socket.error, socket.error,
+                                    socket.error, None]
+        self.assertTrue(b._reestablish(conn))
+        self.assertEqual(sleep_mock.call_args_list,
+                         [mock.call(1), mock.call(2), mock.call(4)])
+        self.assertEqual(conn.collect.call_count, 4)
+
+    def test_reestablish_stopped(self):
+        b = base.Base('h', 'u', 'p', '/', 1, False, reconnect=True)
+        conn = mock.Mock(connection_errors=())
+        conn.connect.side_effect = socket.error
+        stop_event = threading.Event()
+        stop_event.set()
+        self.assertFalse(b._reestablish(conn, stop_event))
+        conn.connect.assert_called_once_with()
+
+    @mock.patch.object(base.time, 'sleep')
+    @mock.patch.object(base.time, 'time', return_value=100)
+    def test_reestablish_deadline(self, time_mock, sleep_mock):
+        b = base.Base('h', 'u', 'p', '/', 1, False, reconnect=True)
+        conn = mock.Mock(connection_errors=())
+        conn.connect.side_effect = socket.error
+        self.assertFalse(b._reestablish(conn, deadline=100))
+        self.assertFalse(sleep_mock.called)
@@ -0,0 +1,86 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+
+from callme import batch
+from callme import test
+
+
+class TestBatcher(test.TestCase):
+
+    def test_invalid_batch_size(self):
+        self.assertRaises(ValueError, batch.Batcher, lambda items: None, 0)
+
+    def test_max_batch(self):
+        batches = []
+        done = threading.Event()
+
+        def handler(items):
+            batches.append(items)
+            if sum(len(b) for b in batches) == 4:
+                done.set()
+
+        b = batch.Batcher(handler, max_batch=2, max_wait=60)
+        for i in range(5):
+            b.add(i)
+        b.start()
+        try:
+            self.assertTrue(done.wait(5))
+        finally:
+            b.stop(wait=True)
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+
+    def test_max_wait(self):
+        batches = []
+        done = threading.Event()
+
+        def handler(items):
+            batches.append(items)
+            done.set()
+
+        b = batch.Batcher(handler, max_batch=10, max_wait=0.01)
+        b.start()
+        try:
+            b.add(1)
+            self.assertTrue(done.wait(5))
+        finally:
+            b.stop(wait=True)
+        self.assertEqual(batches, [[1]])
+
+    def test_stop_flushes_items(self):
+        batches = []
+        b = batch.Batcher(batches.append, max_batch=10, max_wait=60)
+        b.start()
+        b.add(1)
+        b.add(2)
+        b.stop(wait=True)
+        self.assertEqual(batches, [[1, 2]])
@@ -0,0 +1,126 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+import mock
+
+from callme import exceptions as exc
+from callme import test
+from callme.benchmarks import load
+from callme.benchmarks import throughput
+
+
+class TestThroughput(test.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(throughput.percentile(values, 50), 50)
+        self.assertEqual(throughput.percentile(values, 99), 99)
+        self.assertEqual(throughput.percentile(values, 100), 100)
+        self.assertEqual(throughput.percentile([7], 90), 7)
+        self.assertIsNone(throughput.percentile([], 50))
+
+    def test_summarize(self):
+        summary = throughput.summarize([0.002, 0.001, 0.003], 2)
+        self.assertEqual(summary['calls'], 3)
+        self.assertEqual(summary['calls_per_sec'], 1.5)
+        self.assertAlmostEqual(summary['latency_ms']['p50'], 2)
+        self.assertAlmostEqual(summary['latency_ms']['max'], 3)
+        self.assertAlmostEqual(summary['latency_ms']['mean'], 2)
+
+    def test_summarize_empty(self):
+        summary = throughput.summarize([], 1)
+        self.assertEqual(summary['calls'], 0)
+        self.assertIsNone(summary['latency_ms']['p99'])
+
+
+class TestLatencyHistogram(test.TestCase):
+
+    def test_percentile(self):
+        h = load.LatencyHistogram()
+        for ms in range(1, 101):
+            h.record(ms / 1000.0)
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.percentile(50), 0.05, places=3)
+        self.assertAlmostEqual(h.percentile(99), 0.099, places=3)
+        self.assertEqual(h.percentile(100), 0.1)
+        self.assertIsNone(load.LatencyHistogram().percentile(50))
+
+    def test_relative_error(self):
+        h = load.LatencyHistogram(significant_bits=7)
+        h.record(12.345678)
+        h.record(0.001)
+        value = h.percentile(50)
+        self.assertLessEqual(abs(value - 0.001) / 0.001, 1 / 128.0)
+
+    def test_expected_interval(self):
+        h = load.LatencyHistogram()
+        h.record(0.01, expected_interval=0.002)
+        # the calls missed while waiting took 8, 6, 4 and 2 ms
+        self.assertEqual(h.count, 5)
+        self.assertAlmostEqual(h.percentile(20), 0.002, places=4)
+        self.assertAlmostEqual(h.summary()['mean'], 6)
+
+    def test_merge(self):
+        a = load.LatencyHistogram()
+        b = load.LatencyHistogram()
+        a.record(0.001)
+        b.record(0.003)
+        a.merge(b)
+        self.assertEqual(a.count, 2)
+        self.assertEqual(a.max, 3000)
+        self.assertAlmostEqual(a.summary()['mean'], 2)
+
+
+class TestLoad(test.TestCase):
+
+    def test_run_closed(self):
+        proxy = mock.Mock()
+        proxy.echo.side_effect = [1, ValueError(), exc.RpcTimeout()] * 1000
+        result = load.run([proxy], 'echo', [1], 0.05)
+        self.assertGreater(result['calls'], 0)
+        self.assertGreater(result['errors'], 0)
+        self.assertGreater(result['timeouts'], 0)
+        proxy.echo.assert_called_with(1)
+
+    def test_run_open_loop_corrected(self):
+        proxy = mock.Mock()
+        proxy.echo.side_effect = lambda: time.sleep(0.05)
+        result = load.run([proxy], 'echo', [], 0.1, rate=100)
+        self.assertEqual(result['calls'], 10)
+        # the requests scheduled while the client was busy waited for it
+        self.assertGreater(result['latency_ms']['max'], 400)
+        self.assertLess(result['uncorrected_latency_ms']['max'], 100)
+
+    def test_main_requires_mode(self):
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, load.main, ['--local'])
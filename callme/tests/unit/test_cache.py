@@ -0,0 +1,89 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mock
+
+from callme import cache
+from callme import test
+
+
+class TestMakeKey(test.TestCase):
+
+    def test_equal_arguments(self):
+        self.assertEqual(cache.make_key((1, 2), {'a': 1, 'b': 2}),
+                         cache.make_key([1, 2], {'b': 2, 'a': 1}))
+
+    def test_different_arguments(self):
+        self.assertNotEqual(cache.make_key((1, 2), {}),
+                            cache.make_key((2, 1), {}))
+
+    def test_unpicklable_arguments(self):
+        self.assertIsNone(cache.make_key((lambda: None,), {}))
+
+
+class TestResultCache(test.TestCase):
+
+    def test_get_set(self):
+        c = cache.ResultCache()
+        self.assertEqual(c.get('key'), (False, None))
+        c.set('key', 'result')
+        self.assertEqual(c.get('key'), (True, 'result'))
+        self.assertEqual(c.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_lru_eviction(self):
+        c = cache.ResultCache(size=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertEqual(c.get('a'), (True, 1))
+        self.assertEqual(c.get('b'), (False, None))
+        self.assertEqual(c.get('c'), (True, 3))
+
+    @mock.patch.object(cache.time, 'time')
+    def test_ttl(self, time_mock):
+        time_mock.return_value = 100
+        c = cache.ResultCache(ttl=10)
+        c.set('key', 'result')
+        time_mock.return_value = 105
+        self.assertEqual(c.get('key'), (True, 'result'))
+        time_mock.return_value = 111
+        self.assertEqual(c.get('key'), (False, None))
+        self.assertEqual(c.stats()['size'], 0)
+
+    def test_clear(self):
+        c = cache.ResultCache()
+        c.set('key', 'result')
+        c.clear()
+        self.assertEqual(c.get('key'), (False, None))
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, cache.ResultCache, 0)
@@ -0,0 +1,123 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+
+import mock
+
+from callme import confirms
+from callme import test
+
+
+class TestConfirmWindow(test.TestCase):
+
+    def setUp(self):
+        super(TestConfirmWindow, self).setUp()
+        self.channel = mock.Mock(events={'basic_ack': set(),
+                                         'basic_nack': set()})
+        self.nacked = []
+
+    def _confirm(self, event, delivery_tag, multiple=False):
+        for callback in self.channel.events[event]:
+            callback(delivery_tag, multiple)
+
+    def _make_window(self, size=1024):
+        return confirms.ConfirmWindow(self.channel, self.nacked.append,
+                                      size=size)
+
+    def test_confirm_select(self):
+        self._make_window()
+        self.channel.confirm_select.assert_called_once_with()
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, confirms.ConfirmWindow, object(),
+                          self.nacked.append)
+
+    def test_ack(self):
+        window = self._make_window()
+        for message in 'abc':
+            window.track(message)
+        self._confirm('basic_ack', 2)
+        self.assertEqual(len(window), 2)
+        self._confirm('basic_ack', 3, multiple=True)
+        self.assertEqual(len(window), 0)
+        self.assertEqual(self.nacked, [])
+
+    def test_nack(self):
+        window = self._make_window()
+        for message in 'abcd':
+            window.track(message)
+        self._confirm('basic_nack', 2, multiple=True)
+        self._confirm('basic_nack', 4)
+        self.assertEqual(self.nacked, ['a', 'b', 'd'])
+        self.assertEqual(window.unconfirmed(), ['c'])
+        self.assertEqual(len(window), 0)
+
+    def test_wait(self):
+        window = self._make_window(size=2)
+        window.track('a')
+        self.assertFalse(window.full())
+        window.track('b')
+        self.assertTrue(window.full())
+        conn = mock.Mock()
+        conn.drain_events.side_effect = lambda timeout: self._confirm(
+            'basic_ack', 1)
+        self.assertTrue(window.wait(conn))
+        self.assertEqual(len(window), 1)
+
+    def test_wait_empty(self):
+        window = self._make_window()
+        window.track('a')
+        window.track('b')
+        conn = mock.Mock()
+        conn.drain_events.side_effect = lambda timeout: self._confirm(
+            'basic_ack', 2, multiple=True)
+        self.assertTrue(window.wait(conn, empty=True))
+        self.assertEqual(len(window), 0)
+
+    def test_wait_timeout(self):
+        window = self._make_window(size=1)
+        window.track('a')
+        conn = mock.Mock()
+        conn.drain_events.side_effect = socket.timeout
+        self.assertFalse(window.wait(conn, timeout=0))
+
+    def test_settle(self):
+        conn = mock.Mock()
+        conn.drain_events.side_effect = [None, None, socket.timeout]
+        confirms.settle(conn)
+        self.assertEqual(conn.drain_events.call_args_list,
+                         [mock.call(timeout=0)] * 3)
+
+    def test_settle_limit(self):
+        conn = mock.Mock()
+        confirms.settle(conn, limit=5)
+        self.assertEqual(conn.drain_events.call_count, 5)
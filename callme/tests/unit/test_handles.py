@@ -0,0 +1,79 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mock
+
+from callme import handles
+from callme import test
+
+
+class TestHandleTable(test.TestCase):
+
+    def test_add_get(self):
+        t = handles.HandleTable()
+        obj = [1, 2]
+        handle_id = t.add(obj)
+        self.assertIs(t.get(handle_id), obj)
+        self.assertRaises(KeyError, t.get, 'unknown')
+
+    def test_release(self):
+        t = handles.HandleTable()
+        obj = object()
+        handle_id = t.add(obj)
+        self.assertEqual(t.add(obj), handle_id)
+        t.release(handle_id)
+        self.assertIs(t.get(handle_id), obj)
+        t.release(handle_id)
+        self.assertRaises(KeyError, t.get, handle_id)
+        self.assertEqual(len(t), 0)
+        t.release(handle_id)
+
+    def test_ttl(self):
+        t = handles.HandleTable(ttl=10)
+        with mock.patch.object(handles.time, 'time', return_value=100):
+            handle_id = t.add(object())
+        with mock.patch.object(handles.time, 'time', return_value=105):
+            t.get(handle_id)
+        with mock.patch.object(handles.time, 'time', return_value=114):
+            t.get(handle_id)
+        with mock.patch.object(handles.time, 'time', return_value=125):
+            self.assertRaises(KeyError, t.get, handle_id)
+
+    def test_size(self):
+        t = handles.HandleTable(size=2)
+        first = t.add(object())
+        t.add(object())
+        t.add(object())
+        self.assertEqual(len(t), 2)
+        self.assertRaises(KeyError, t.get, first)
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, handles.HandleTable, size=0)
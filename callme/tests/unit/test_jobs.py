@@ -0,0 +1,81 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+from callme import jobs
+from callme import protocol
+from callme import test
+
+
+class _ResultStoreTests(object):
+
+    def test_lifecycle(self):
+        store = self._make_store()
+        store.create('j1')
+        self.assertEqual(store.get('j1'), (jobs.PENDING, None))
+        store.set_running('j1')
+        self.assertEqual(store.get('j1'), (jobs.RUNNING, None))
+        store.set_result('j1', protocol.RpcResponse([1, 2]))
+        state, response = store.get('j1')
+        self.assertEqual(state, jobs.DONE)
+        self.assertEqual(response.result, [1, 2])
+
+    def test_delete(self):
+        store = self._make_store()
+        store.create('j1')
+        store.delete('j1')
+        self.assertRaises(KeyError, store.get, 'j1')
+        store.delete('j1')
+
+
+class TestMemoryResultStore(_ResultStoreTests, test.TestCase):
+
+    def _make_store(self):
+        return jobs.MemoryResultStore()
+
+
+class TestSqliteResultStore(_ResultStoreTests, test.TestCase):
+
+    def setUp(self):
+        super(TestSqliteResultStore, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'jobs.sqlite')
+
+    def _make_store(self):
+        return jobs.SqliteResultStore(self.path)
+
+    def test_persistent(self):
+        self._make_store().create('j1')
+        self.assertEqual(self._make_store().get('j1'), (jobs.PENDING, None))
@@ -0,0 +1,93 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+try:
+    from urllib import request as urllib_request
+except ImportError:  # pragma: no cover
+    import urllib2 as urllib_request
+
+from callme import metrics
+from callme import test
+
+
+class TestHistogram(test.TestCase):
+
+    def test_observe(self):
+        h = metrics.Histogram(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            h.observe(value)
+        self.assertEqual(h.count, 4)
+        self.assertEqual(h.sum, 6)
+        self.assertEqual(h.cumulative_counts(),
+                         [(1, 2), (2, 3), ('+Inf', 4)])
+
+
+class TestMetricsRegistry(test.TestCase):
+
+    def test_counters(self):
+        r = metrics.MetricsRegistry()
+        r.inc('requests', {'function': 'add'})
+        r.inc('requests', {'function': 'add'}, 2)
+        self.assertEqual(r.get_counter('requests', {'function': 'add'}), 3)
+        self.assertEqual(r.get_counter('requests', {'function': 'sub'}), 0)
+
+    def test_histograms(self):
+        r = metrics.MetricsRegistry()
+        r.observe('latency', 0.5)
+        r.observe('latency', 1.5)
+        self.assertEqual(r.get_histogram('latency'), (2, 2.0))
+        self.assertEqual(r.get_histogram('other'), (0, 0.0))
+
+    def test_render(self):
+        r = metrics.MetricsRegistry(buckets=(1,))
+        r.inc('requests_total', {'function': 'a"b'})
+        r.observe('latency_seconds', 0.5, {'function': 'add'})
+        self.assertEqual(r.render(), '\n'.join([
+            '# TYPE requests_total counter',
+            'requests_total{function="a\\"b"} 1',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{function="add",le="1"} 1',
+            'latency_seconds_bucket{function="add",le="+Inf"} 1',
+            'latency_seconds_sum{function="add"} 0.5',
+            'latency_seconds_count{function="add"} 1',
+        ]) + '\n')
+
+    def test_serve_prometheus(self):
+        r = metrics.MetricsRegistry()
+        r.inc('requests_total')
+        httpd = metrics.serve_prometheus(r, port=0, host='127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:{0}/metrics'.format(httpd.server_port)
+            body = urllib_request.urlopen(url).read().decode('utf-8')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        self.assertIn('requests_total 1\n', body)
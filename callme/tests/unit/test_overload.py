@@ -0,0 +1,76 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mock
+
+from callme import overload
+from callme import test
+
+
+class TestLoadShedder(test.TestCase):
+
+    def test_no_limits(self):
+        shedder = overload.LoadShedder()
+        for _ in range(100):
+            self.assertTrue(shedder.accept())
+        self.assertEqual(shedder.backlog, 100)
+
+    def test_max_backlog(self):
+        shedder = overload.LoadShedder(max_backlog=2)
+        self.assertTrue(shedder.accept())
+        self.assertTrue(shedder.accept())
+        self.assertFalse(shedder.accept())
+        shedder.finish(0.1)
+        self.assertTrue(shedder.accept())
+        self.assertEqual(shedder.backlog, 2)
+
+    @mock.patch.object(overload.time, 'time')
+    def test_max_latency(self, time_mock):
+        time_mock.return_value = 100
+        shedder = overload.LoadShedder(max_latency=1, window=10)
+        self.assertTrue(shedder.accept())
+        self.assertTrue(shedder.accept())
+        shedder.finish(0.5)
+        self.assertTrue(shedder.accept())
+        shedder.finish(3)
+        self.assertFalse(shedder.accept())
+
+        # slow requests leave the window
+        time_mock.return_value = 111
+        self.assertTrue(shedder.accept())
+
+    def test_finish_without_duration(self):
+        shedder = overload.LoadShedder(max_latency=1)
+        shedder.accept()
+        shedder.accept()
+        shedder.finish(count=2)
+        self.assertEqual(shedder.backlog, 0)
+        self.assertTrue(shedder.accept())
@@ -0,0 +1,124 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+
+from callme import exceptions
+from callme import pipeline
+from callme import protocol
+from callme import test
+
+
+class TestPromiseTable(test.TestCase):
+
+    def test_get(self):
+        t = pipeline.PromiseTable()
+        t.set('c1', protocol.RpcResponse(42))
+        self.assertEqual(t.get('c1'), 42)
+
+    def test_get_exception(self):
+        t = pipeline.PromiseTable()
+        t.set('c1', protocol.RpcResponse(KeyError('user')))
+        self.assertRaises(KeyError, t.get, 'c1')
+
+    def test_get_unknown(self):
+        t = pipeline.PromiseTable()
+        self.assertRaises(exceptions.RpcTimeout, t.get, 'c1', 0.01)
+        self.assertEqual(t._pending, {})
+
+    def test_get_waits_for_unannounced(self):
+        # the call passing the promise arrives before the promised call
+        t = pipeline.PromiseTable()
+
+        def arrive():
+            t.expect('c1')
+            t.set('c1', protocol.RpcResponse(42))
+        timer = threading.Timer(0.05, arrive)
+        timer.start()
+        try:
+            self.assertEqual(t.get('c1', 5), 42)
+        finally:
+            timer.join()
+
+    def test_get_dropped(self):
+        t = pipeline.PromiseTable()
+        t.expect('c1')
+        t.set('c1')
+        self.assertRaises(ValueError, t.get, 'c1')
+
+    def test_get_timeout(self):
+        t = pipeline.PromiseTable()
+        t.expect('c1')
+        self.assertRaises(exceptions.RpcTimeout, t.get, 'c1', 0.01)
+
+    def test_get_waits(self):
+        t = pipeline.PromiseTable()
+        t.expect('c1')
+        timer = threading.Timer(0.05, t.set,
+                                args=('c1', protocol.RpcResponse(42)))
+        timer.start()
+        try:
+            self.assertEqual(t.get('c1', 5), 42)
+        finally:
+            timer.join()
+
+    def test_get_waiting_evicted(self):
+        t = pipeline.PromiseTable(size=1)
+        t.expect('c1')
+
+        def finish():
+            t.set('c1', protocol.RpcResponse(42))
+            t.set('c2', protocol.RpcResponse(43))
+        timer = threading.Timer(0.05, finish)
+        timer.start()
+        try:
+            # the result is evicted by then, but handed to the waiting call
+            self.assertEqual(t.get('c1', 5), 42)
+        finally:
+            timer.join()
+        self.assertRaises(exceptions.RpcTimeout, t.get, 'c1', 0.01)
+
+    def test_resolve(self):
+        t = pipeline.PromiseTable()
+        t.set('c1', protocol.RpcResponse(1))
+        t.set('c2', protocol.RpcResponse(2))
+        request = protocol.RpcRequest(
+            'test', (protocol.RpcPromise('c1'), 'a'),
+            {'b': protocol.RpcPromise('c2')})
+        resolved = t.resolve(request)
+        self.assertEqual(resolved.func_name, 'test')
+        self.assertEqual(resolved.func_args, (1, 'a'))
+        self.assertEqual(resolved.func_keywords, {'b': 2})
+
+    def test_resolve_without_promises(self):
+        t = pipeline.PromiseTable()
+        request = protocol.RpcRequest('test', (1,), {})
+        self.assertIs(t.resolve(request), request)
@@ -0,0 +1,182 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+
+import mock
+
+from callme import pool
+from callme import scheduler
+from callme import test
+
+
+class TestWorkerPool(test.TestCase):
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, pool.WorkerPool, 0)
+
+    def test_submit(self):
+        results = []
+        done = threading.Event()
+
+        def func(a, b=0):
+            results.append(a + b)
+            if len(results) == 3:
+                done.set()
+
+        p = pool.WorkerPool(2)
+        p.start()
+        try:
+            p.submit(func, 1)
+            p.submit(func, 1, b=2)
+            p.submit(func, 5)
+            self.assertTrue(done.wait(5))
+        finally:
+            p.stop(wait=True)
+        self.assertEqual(sorted(results), [1, 3, 5])
+
+    def test_ready(self):
+        p = pool.WorkerPool(1)
+        p.submit(len, 'a')
+        self.assertEqual((p.pending, p.ready), (1, 1))
+        tasks = scheduler.FairScheduler(rate=0.001, burst=1)
+        p = pool.WorkerPool(1, tasks=tasks)
+        p.submit_for('client', len, 'a')
+        p.submit_for('client', len, 'b')
+        self.assertEqual((p.pending, p.ready), (2, 1))
+
+    def test_failing_call_keeps_worker(self):
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError('test')
+
+        p = pool.WorkerPool(1)
+        p.start()
+        try:
+            p.submit(fail)
+            p.submit(done.set)
+            self.assertTrue(done.wait(5))
+        finally:
+            p.stop(wait=True)
+
+    def test_resize(self):
+        release = threading.Event()
+        started = []
+        all_started = threading.Event()
+
+        def block():
+            started.append(True)
+            if len(started) == 3:
+                all_started.set()
+            release.wait()
+
+        p = pool.WorkerPool(1)
+        p.start()
+        try:
+            p.resize(3)
+            self.assertEqual(p.size, 3)
+            for _ in range(3):
+                p.submit(block)
+            self.assertTrue(all_started.wait(5))
+            self.assertEqual(p.busy, 3)
+            p.resize(1)
+            self.assertEqual(p.size, 1)
+        finally:
+            release.set()
+            p.stop(wait=True)
+        self.assertEqual(p.busy, 0)
+
+    def test_resize_invalid(self):
+        p = pool.WorkerPool(1)
+        self.assertRaises(ValueError, p.resize, 0)
+
+
+class TestSlots(test.TestCase):
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, pool.Slots, 0)
+
+    def test_acquire_timeout(self):
+        slots = pool.Slots(1)
+        self.assertTrue(slots.acquire(timeout=0))
+        self.assertFalse(slots.acquire(timeout=0.01))
+        slots.release()
+        self.assertTrue(slots.acquire(timeout=0))
+
+    def test_release_wakes_up_waiter(self):
+        slots = pool.Slots(1)
+        slots.acquire()
+        t = threading.Timer(0.05, slots.release)
+        t.start()
+        self.assertTrue(slots.acquire(timeout=5))
+        t.join()
+
+
+class TestAutoscaler(test.TestCase):
+
+    def test_invalid_range(self):
+        self.assertRaises(ValueError, pool.Autoscaler, 0, 4)
+        self.assertRaises(ValueError, pool.Autoscaler, 5, 4)
+
+    def test_grow(self):
+        a = pool.Autoscaler(1, 8)
+        self.assertEqual(a.desired_size(2, 2, 3), 5)
+        self.assertEqual(a.desired_size(2, 2, 30), 8)
+
+    def test_steady(self):
+        a = pool.Autoscaler(1, 8)
+        self.assertEqual(a.desired_size(4, 2, 0), 4)
+        self.assertEqual(a.desired_size(4, 0, 2), 4)
+
+    @mock.patch.object(pool.time, 'time')
+    def test_shrink_after_cooldown(self, time_mock):
+        a = pool.Autoscaler(2, 16, cooldown=30)
+        time_mock.return_value = 100
+        self.assertEqual(a.desired_size(16, 4, 0), 16)
+        time_mock.return_value = 120
+        self.assertEqual(a.desired_size(16, 4, 0), 16)
+        time_mock.return_value = 131
+        self.assertEqual(a.desired_size(16, 4, 0), 5)
+        time_mock.return_value = 200
+        self.assertEqual(a.desired_size(5, 0, 0), 5)
+        time_mock.return_value = 231
+        self.assertEqual(a.desired_size(5, 0, 0), 2)
+
+    @mock.patch.object(pool.time, 'time')
+    def test_load_resets_cooldown(self, time_mock):
+        a = pool.Autoscaler(1, 16, cooldown=30)
+        time_mock.return_value = 100
+        self.assertEqual(a.desired_size(16, 0, 0), 16)
+        time_mock.return_value = 120
+        self.assertEqual(a.desired_size(16, 8, 0), 16)
+        time_mock.return_value = 140
+        self.assertEqual(a.desired_size(16, 0, 0), 16)
@@ -0,0 +1,67 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from callme import profiling
+from callme import test
+
+
+def _fib(n):
+    return n if n < 2 else _fib(n - 1) + _fib(n - 2)
+
+
+class TestProfiler(test.TestCase):
+
+    def test_call(self):
+        p = profiling.Profiler(_fib)
+        self.assertEqual(p(10), 55)
+        self.assertEqual(p(5), 5)
+        summary = p.summary()
+        self.assertEqual(summary['calls'], 2)
+        self.assertEqual(summary['skipped'], 0)
+        rows = dict((row['function'].rsplit('(', 1)[1], row)
+                    for row in summary['functions'])
+        self.assertEqual(rows['_fib)']['ncalls'], 177 + 15)
+
+    def test_exception(self):
+        p = profiling.Profiler(lambda: {}['a'])
+        self.assertRaises(KeyError, p)
+        self.assertEqual(p.summary()['calls'], 1)
+
+    def test_summary_limit(self):
+        p = profiling.Profiler(_fib)
+        p(3)
+        functions = p.summary(limit=1)['functions']
+        self.assertEqual(len(functions), 1)
+
+    def test_summary_empty(self):
+        p = profiling.Profiler(_fib)
+        self.assertEqual(p.summary(), {'calls': 0, 'skipped': 0,
+                                       'functions': []})
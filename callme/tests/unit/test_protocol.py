@@ -29,6 +29,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import mock
+
 from callme import protocol
 from callme import test
 
@@ -55,3 +57,19 @@ class TestRpcResponse(test.TestCase):
         response = protocol.RpcResponse(Exception('test'))
         self.assertIsInstance(response.result, Exception)
         self.assertTrue(response.is_exception)
+
+
+class TestSummary(test.TestCase):
+
+    def test_summarize_truncates(self):
+        summary = protocol.summarize('x' * 1000)
+        self.assertLess(len(summary), 100)
+        self.assertIn('...', summary)
+
+    def test_summary_is_lazy(self):
+        with mock.patch.object(protocol, 'summarize',
+                               return_value='value') as summarize_mock:
+            summary = protocol.Summary([1, 2])
+            self.assertFalse(summarize_mock.called)
+            self.assertEqual(str(summary), 'value')
+        summarize_mock.assert_called_once_with([1, 2])
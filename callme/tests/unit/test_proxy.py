@@ -31,7 +31,16 @@
 
 # pylint: disable=W0212
 
+import socket
+
+import mock
+
+from callme import exceptions
+from callme import metrics
+from callme import protocol
 from callme import proxy
+from callme import sharding
+from callme import tracing
 from callme import test
 
 
@@ -63,3 +72,233 @@ class TestProxy(test.MockTestCase):
         s.use_server('test_server', 30)
         self.assertEqual(s._server_id, 'test_server')
         self.assertEqual(s._timeout, 30)
+
+    def test_client_id(self):
+        s = proxy.Proxy('fooserver')
+        self.assertEqual(s._headers, {})
+        s = proxy.Proxy('fooserver', client_id='fooclient')
+        self.assertEqual(s._headers, {'client_id': 'fooclient'})
+
+    def test_use_server_priority(self):
+        s = proxy.Proxy('fooserver', priority=1)
+        self.assertEqual(s._priority, 1)
+        s.use_server(priority=9)
+        self.assertEqual(s._priority, 9)
+        s.use_server()
+        self.assertEqual(s._priority, 9)
+
+    def test_call_async_cancel(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_publish') as publish_mock:
+            handle = s.call_async('test', 1)
+            self.assertEqual(s._pending, {handle.correlation_id: handle})
+            self.assertTrue(handle.cancel())
+            self.assertFalse(handle.cancel())
+        self.assertTrue(handle.cancelled)
+        self.assertEqual(s._pending, {})
+        request = publish_mock.call_args[0][1]
+        self.assertEqual(request.func_name, protocol.CANCEL_FUNC_NAME)
+        self.assertEqual(request.func_args, (handle.correlation_id,))
+        self.assertRaises(exceptions.RpcCancelled, handle.result)
+
+    def test_call_async_result(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_publish'):
+            handle = s.call_async('test')
+        message = mock.Mock(
+            properties={'correlation_id': handle.correlation_id})
+        s._on_response(protocol.RpcResponse(42), message)
+        self.assertTrue(handle.ready())
+        self.assertEqual(handle.result(), 42)
+        self.assertFalse(handle.cancel())
+
+    def test_call_async_promise(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_publish') as publish_mock:
+            handle = s.call_async('test')
+        self.assertEqual(publish_mock.call_args[1]['headers'],
+                         {'deadline': mock.ANY, 'sent_at': mock.ANY})
+        # the server doesn't keep the result
+        self.assertRaises(ValueError, getattr, handle, 'promise')
+
+    def test_pipeline(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_publish') as publish_mock:
+            handle = s.pipeline('test')
+        self.assertEqual(publish_mock.call_args[1]['headers'],
+                         {'pipelined': True, 'deadline': mock.ANY,
+                          'sent_at': mock.ANY})
+        self.assertEqual(handle.promise.correlation_id, handle.correlation_id)
+
+    def test_remote_object(self):
+        s = proxy.Proxy('fooserver')
+        handle = proxy.AsyncResult(s, 'c1', 'barserver', 60)
+        handle._set_response(protocol.RpcResponse(
+            protocol.RpcHandle('h1', 'barserver', 'i1')))
+        remote = handle.result()
+        self.assertIsInstance(remote, proxy.RemoteObject)
+        with mock.patch.object(s, '_send') as send_mock:
+            send_mock.return_value.result.return_value = 3
+            self.assertEqual(remote.rows.count(1), 3)
+        send_mock.assert_called_once_with('callme.handle.h1.rows.count',
+                                          (1,), {}, server_id='barserver',
+                                          instance_id='i1')
+        self.assertRaises(AttributeError, getattr, remote, '_private')
+
+    def test_submit(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_send') as send_mock:
+            send_mock.return_value.result.return_value = 'j1'
+            self.assertEqual(s.submit.test(1, a=2), 'j1')
+        send_mock.assert_called_once_with('test', (1,), {'a': 2}, job=True)
+
+    def test_job_result(self):
+        s = proxy.Proxy('fooserver')
+        with mock.patch.object(s, '_send') as send_mock:
+            send_mock.return_value.result.side_effect = [
+                'pending', 'done', 42]
+            self.assertEqual(s.job_result('j1', poll_interval=0), 42)
+        self.assertEqual([c[0][0] for c in send_mock.call_args_list],
+                         ['callme.job_status', 'callme.job_status',
+                          'callme.job_result'])
+
+    def test_connection_lost(self):
+        p = proxy.Proxy('fooserver')
+        self.conn_inst_mock.connection_errors = ()
+        self.conn_inst_mock.drain_events.side_effect = socket.error
+        with mock.patch.object(p, '_publish'):
+            handle = p.call_async('foo')
+        self.assertRaises(exceptions.ConnectionError, handle.result)
+        self.assertEqual(p._pending, {})
+
+    def test_connection_lost_reconnect(self):
+        p = proxy.Proxy('fooserver', reconnect=True, idempotent=['get'])
+        self.conn_inst_mock.connection_errors = ()
+        with mock.patch.object(p, '_publish') as publish_mock:
+            get = p.call_async('get', 1)
+            put = p.call_async('put', 1)
+
+            def lost(timeout):
+                self.conn_inst_mock.drain_events.side_effect = None
+                raise socket.error()
+            self.conn_inst_mock.drain_events.side_effect = lost
+            with mock.patch.object(p, '_reestablish',
+                                   return_value=True) as reestablish_mock:
+                self.assertRaises(exceptions.ConnectionError, put.result)
+        reestablish_mock.assert_called_once_with(self.conn_inst_mock,
+                                                 deadline=mock.ANY)
+        # the reply queue is consumed again
+        self.assertEqual(self.consumer_inst_mock.consume.call_count, 2)
+        # only the idempotent call is published again
+        self.assertEqual(publish_mock.call_count, 3)
+        self.assertEqual(publish_mock.call_args[0][2], get.correlation_id)
+        self.assertEqual(list(p._pending), [get.correlation_id])
+
+    def test_brokers(self):
+        brokers = ['amqp://a', 'amqp://b', 'amqp://c']
+        ring = sharding.HashRing(brokers)
+        p = proxy.Proxy('fooserver', brokers=brokers)
+        self.assertFalse(self.consumer_inst_mock.consume.called)
+        with mock.patch.object(proxy.kombu, 'producers') as producers_mock:
+            handle = p.use_server(shard_key='user1').call_async('foo')
+        hosts = [c[1]['hostname'] for c in self.conn_mock.call_args_list]
+        # the request goes to the broker of the shard key and the response
+        # comes back from the broker of the server id
+        self.assertEqual(sorted(hosts[1:]),
+                         sorted(set([ring.get('fooserver'),
+                                     ring.get('user1')])))
+        self.assertIs(handle._conn, p._conns[ring.get('fooserver')])
+        producers_mock.__getitem__.assert_called_once_with(
+            p._conns[ring.get('user1')])
+
+    def test_dedicated_queue(self):
+        p = proxy.Proxy('fooserver', queues={'fib': 'slow'})
+        with mock.patch.object(proxy.kombu, 'producers') as producers_mock:
+            p.call_async('fib', 10)
+            p.call_async('foo')
+        producer = producers_mock.__getitem__.return_value.acquire. \
+            return_value.__enter__.return_value
+        (_, fib_kw), (_, foo_kw) = producer.publish.call_args_list
+        self.assertEqual(fib_kw['routing_key'], 'fib')
+        queue, = fib_kw['declare']
+        self.assertEqual(queue.name, 'server_fooserver_queue_slow')
+        self.assertEqual([b.routing_key for b in queue.bindings], ['fib'])
+        self.assertIsNone(foo_kw['routing_key'])
+        queue, = foo_kw['declare']
+        self.assertEqual(queue.name, 'server_fooserver_queue')
+
+    def test_instance_queue(self):
+        p = proxy.Proxy('fooserver')
+        with mock.patch.object(proxy.kombu, 'producers') as producers_mock:
+            p._send('callme.handle.h1.total', (), {}, instance_id='i1')
+        producer = producers_mock.__getitem__.return_value.acquire. \
+            return_value.__enter__.return_value
+        kwargs = producer.publish.call_args[1]
+        self.assertEqual(kwargs['routing_key'], 'i1')
+        # the exclusive queue of the instance is not declared
+        self.assertEqual(kwargs['declare'], [kwargs['exchange']])
+
+    def test_confirms(self):
+        channel = self.conn_inst_mock.channel.return_value
+        channel.events = {'basic_ack': set(), 'basic_nack': set()}
+        p = proxy.Proxy('fooserver', confirms=True)
+        channel.confirm_select.assert_called_once_with()
+        producer = mock.Mock()
+        window = p._confirmers[id(self.conn_inst_mock)][1]
+        p._confirmers[id(self.conn_inst_mock)] = (producer, window)
+        ok = p.call_async('foo')
+        failed = p.call_async('foo')
+        self.assertEqual(producer.publish.call_count, 2)
+        self.assertEqual(len(window), 2)
+        for callback in channel.events['basic_nack']:
+            callback(2, False)
+        self.assertRaises(exceptions.RpcPublishFailed, failed.result)
+        self.assertEqual(list(p._pending), [ok.correlation_id])
+
+    def test_transport_options(self):
+        proxy.Proxy('fooserver', amqp_host='memory://',
+                    transport_options={'polling_interval': 0.01},
+                    connection_options={'heartbeat': 10})
+        self.conn_mock.assert_called_once_with(
+            hostname='memory://',
+            transport_options={'polling_interval': 0.01}, heartbeat=10)
+
+    def test_metrics(self):
+        registry = metrics.MetricsRegistry()
+        s = proxy.Proxy('fooserver', metrics=registry)
+        labels = {'function': 'test'}
+        with mock.patch.object(s, '_publish'), \
+                mock.patch.object(proxy.AsyncResult, 'result',
+                                  side_effect=[1, exceptions.RpcTimeout,
+                                               KeyError]):
+            self.assertEqual(s.test(), 1)
+            self.assertRaises(exceptions.RpcTimeout, s.test)
+            self.assertRaises(KeyError, s.test)
+        self.assertEqual(
+            registry.get_counter('callme_client_requests_total', labels), 3)
+        self.assertEqual(
+            registry.get_counter('callme_client_timeouts_total', labels), 1)
+        self.assertEqual(
+            registry.get_counter('callme_client_errors_total', labels), 1)
+        self.assertEqual(registry.get_histogram(
+            'callme_client_latency_seconds', labels)[0], 3)
+        self.assertEqual(registry.get_histogram(
+            'callme_client_serialization_seconds', labels)[0], 3)
+
+    def test_tracing(self):
+        tracer = mock.Mock()
+        s = proxy.Proxy('fooserver', tracer=tracer)
+        with mock.patch.object(s, '_publish') as publish_mock:
+            with tracing.activate(tracing.SpanContext('t1', 's1')):
+                handle = s.call_async('test')
+        headers = publish_mock.call_args[1]['headers']
+        self.assertEqual(headers['trace_id'], 't1')
+        message = mock.Mock(
+            properties={'correlation_id': handle.correlation_id})
+        s._on_response(protocol.RpcResponse(42), message)
+        spans = [c[0][0] for c in tracer.record.call_args_list]
+        self.assertEqual([span.name for span in spans],
+                         ['callme.publish', 'callme.receive', 'callme.call'])
+        self.assertEqual(spans[2].span_id, headers['span_id'])
+        self.assertEqual(spans[2].parent_id, 's1')
+        self.assertEqual(spans[1].parent_id, headers['span_id'])
@@ -0,0 +1,205 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# pylint: disable=W0212
+
+import kombu
+import mock
+
+from callme import publisher
+from callme import test
+
+
+class TestReplyPublisher(test.MockTestCase):
+
+    def setUp(self):
+        super(TestReplyPublisher, self).setUp()
+
+        # mock kombu Producer
+        self.producer_mock, self.producer_inst_mock = self._mock_class(
+            publisher.kombu, 'Producer')
+
+        self.conn_mock = mock.Mock(name='connection')
+        self.conn_mock.clone.return_value.heartbeat = None
+        self.conn_mock.clone.return_value.connection_errors = ()
+        self.conn_mock.clone.return_value.channel_errors = ()
+        self.make_exchange_mock = mock.Mock(side_effect=lambda name: name)
+
+    def _make_publisher(self, **kwargs):
+        return publisher.ReplyPublisher(self.conn_mock,
+                                        self.make_exchange_mock, **kwargs)
+
+    def test_publish_not_running(self):
+        p = self._make_publisher()
+        self.assertFalse(p.publish('response', 'reply_to', 'corr_id'))
+
+    def test_publish(self):
+        p = self._make_publisher()
+        p.start()
+        self.assertTrue(p.publish('r1', 'client1', 'c1'))
+        self.assertTrue(p.publish('r2', 'client1', 'c2'))
+        self.assertTrue(p.publish('r3', 'client2', 'c3'))
+        p.stop(wait=True)
+        self.assertFalse(p.publish('r4', 'client1', 'c4'))
+
+        self.assertEqual(self.producer_inst_mock.publish.call_args_list, [
+            mock.call(body='r1', serializer='pickle', exchange='client1',
+                      correlation_id='c1', declare=['client1']),
+            mock.call(body='r2', serializer='pickle', exchange='client1',
+                      correlation_id='c2', declare=[]),
+            mock.call(body='r3', serializer='pickle', exchange='client2',
+                      correlation_id='c3', declare=['client2']),
+        ])
+        self.conn_mock.clone.return_value.release.assert_called_once_with()
+
+    def test_publish_callback(self):
+        published = mock.Mock()
+        p = self._make_publisher()
+        p.start()
+        p.publish('r1', 'client1', 'c1', published)
+        p.stop(wait=True)
+
+        self.assertEqual(self.producer_inst_mock.publish.call_count, 1)
+        published.assert_called_once_with(mock.ANY)
+
+    def test_declared_exchanges_are_bounded(self):
+        p = self._make_publisher(max_declared=1)
+        p.start()
+        p.publish('r1', 'client1', 'c1')
+        p.publish('r2', 'client2', 'c2')
+        p.publish('r3', 'client1', 'c3')
+        p.stop(wait=True)
+
+        declares = [c[1]['declare']
+                    for c in self.producer_inst_mock.publish.call_args_list]
+        self.assertEqual(declares, [['client1'], ['client2'], ['client1']])
+
+    @mock.patch.object(publisher.time, 'sleep')
+    def test_publish_failure_redeclares(self, sleep_mock):
+        self.producer_inst_mock.publish.side_effect = [None, IOError, None,
+                                                       None]
+        p = self._make_publisher()
+        p.start()
+        p.publish('r1', 'client1', 'c1')
+        p.publish('r2', 'client1', 'c2')
+        p.publish('r3', 'client1', 'c3')
+        p.stop(wait=True)
+
+        calls = self.producer_inst_mock.publish.call_args_list
+        declares = [c[1]['declare'] for c in calls]
+        self.assertEqual(declares, [['client1'], [], ['client1'], []])
+        # the response lost with the connection is published again
+        self.assertEqual([c[1]['body'] for c in calls],
+                         ['r1', 'r2', 'r2', 'r3'])
+        self.assertEqual(self.conn_mock.clone.call_count, 2)
+
+    def test_publish_error_drops_response(self):
+        self.producer_inst_mock.publish.side_effect = [ValueError, None]
+        p = self._make_publisher()
+        p.start()
+        p.publish('r1', 'client1', 'c1')
+        p.publish('r2', 'client1', 'c2')
+        p.stop(wait=True)
+
+        bodies = [c[1]['body']
+                  for c in self.producer_inst_mock.publish.call_args_list]
+        self.assertEqual(bodies, ['r1', 'r2'])
+        self.assertEqual(self.conn_mock.clone.call_count, 1)
+
+    def test_heartbeat_check_while_idle(self):
+        conn = self.conn_mock.clone.return_value
+        conn.heartbeat = 10
+        p = self._make_publisher()
+        with mock.patch.object(p._queue, 'get',
+                               side_effect=[publisher.queue.Empty, 'r1',
+                                            publisher.queue.Empty]):
+            p._fill(self.producer_inst_mock, conn)
+        self.assertEqual(list(p._pending), [('r1', 0)])
+        conn.heartbeat_check.assert_called_once_with()
+
+    def test_channel_closed_publishes_again(self):
+        conn = mock.Mock(heartbeat=None, connection_errors=(),
+                         channel_errors=(ValueError,))
+        errors = [ValueError("NOT_FOUND - no exchange 'client1' in vhost "
+                             "'/'")]
+
+        def drain_events(timeout):
+            if errors:
+                raise errors.pop()
+            raise publisher.cf.socket.timeout()
+        conn.drain_events.side_effect = drain_events
+        self.make_exchange_mock.side_effect = kombu.Exchange
+        p = self._make_publisher(max_burst=3)
+        # the exchange of client1 was deleted after its first response
+        p._declared['client1'] = True
+        for item in [('r1', 'client1', 'c1', None),
+                     ('r2', 'client2', 'c2', None),
+                     ('r3', 'client1', 'c3', None), None]:
+            p._queue.put(item)
+        producer = mock.Mock()
+        channel = producer.channel
+        self.assertTrue(p._publish_bursts(producer, conn))
+
+        # the failed response and the ones discarded after it are published
+        # again, declaring their exchanges
+        calls = producer.publish.call_args_list
+        self.assertEqual([c[1]['body'] for c in calls],
+                         ['r1', 'r2', 'r3', 'r1', 'r2', 'r3'])
+        self.assertEqual([[e.name for e in c[1]['declare']] for c in calls],
+                         [[], ['client2'], [], ['client1'], ['client2'], []])
+        producer.revive.assert_called_once_with(conn.channel.return_value)
+        channel.close.assert_called_once_with()
+
+    def test_confirms(self):
+        conn = mock.Mock(heartbeat=None, connection_errors=())
+        channel = mock.Mock(events={'basic_ack': set(),
+                                    'basic_nack': set()})
+        p = self._make_publisher(confirms=True)
+        window = publisher.cf.ConfirmWindow(channel, p._on_nack)
+        channel.confirm_select.assert_called_once_with()
+        for item in [('r1', 'client1', 'c1'), ('r2', 'client1', 'c2'),
+                     ('r3', 'client1', 'c3'), None]:
+            p._queue.put(item)
+        confirms = iter([('basic_nack', 2, False), ('basic_ack', 3, True),
+                         ('basic_ack', 4, True)])
+
+        def drain_events(timeout):
+            event, tag, multiple = next(confirms)
+            for callback in channel.events[event]:
+                callback(tag, multiple)
+        conn.drain_events.side_effect = drain_events
+        producer = mock.Mock()
+        self.assertTrue(p._publish_bursts(producer, conn, window))
+
+        # the response the broker failed to take over is published again
+        bodies = [c[1]['body'] for c in producer.publish.call_args_list]
+        self.assertEqual(bodies, ['r1', 'r2', 'r3', 'r2'])
+        self.assertEqual(len(window), 0)
@@ -0,0 +1,105 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+
+import mock
+
+from callme import protocol
+from callme import requestlog
+from callme import test
+
+
+class TestRequestLog(test.TestCase):
+
+    def setUp(self):
+        super(TestRequestLog, self).setUp()
+        self.request = protocol.RpcRequest('f', ('x' * 1000,), {})
+
+    def _log(self, log, *args, **kwargs):
+        with mock.patch.object(requestlog, 'LOG') as log_mock, \
+                mock.patch.object(requestlog, 'SLOW_LOG') as slow_mock:
+            log.log(self.request, *args, **kwargs)
+        return log_mock, slow_mock
+
+    def test_sampling(self):
+        log = requestlog.RequestLog(sample_every=3)
+        logged = [self._log(log, 0.1)[0].log.called for _ in range(6)]
+        self.assertEqual(logged, [True, False, False, True, False, False])
+
+    def test_record(self):
+        log = requestlog.RequestLog(sample_every=1)
+        log_mock, _ = self._log(log, 0.5, correlation_id='c1')
+        level, _, fields = log_mock.log.call_args[0]
+        self.assertEqual(level, logging.INFO)
+        self.assertEqual(fields['func_name'], 'f')
+        self.assertEqual(fields['correlation_id'], 'c1')
+        self.assertEqual(fields['duration'], 0.5)
+        self.assertLess(len(fields['args']), 100)
+        self.assertEqual(log_mock.log.call_args[1], {'extra': {
+            'callme': fields}})
+
+    def test_error_always_logged(self):
+        log = requestlog.RequestLog(sample_every=None)
+        self.assertFalse(self._log(log, 0.1)[0].log.called)
+        log_mock, _ = self._log(log, 0.1, error=ValueError('boom'))
+        level, _, fields = log_mock.log.call_args[0]
+        self.assertEqual(level, logging.WARNING)
+        self.assertIn('boom', fields['error'])
+
+    def test_slow_always_logged(self):
+        log = requestlog.RequestLog(sample_every=None, slow_threshold=1)
+        log_mock, slow_mock = self._log(log, 1.5)
+        self.assertFalse(log_mock.log.called)
+        self.assertEqual(slow_mock.log.call_args[0][0], logging.WARNING)
+
+    def test_disabled_logger(self):
+        log = requestlog.RequestLog(sample_every=1)
+        with mock.patch.object(requestlog, 'LOG') as log_mock, \
+                mock.patch.object(protocol, 'summarize') as summarize_mock:
+            log_mock.isEnabledFor.return_value = False
+            log.log(self.request, 0.1)
+        self.assertFalse(log_mock.log.called)
+        self.assertFalse(summarize_mock.called)
+
+    def test_invalid_sample_every(self):
+        self.assertRaises(ValueError, requestlog.RequestLog, sample_every=0)
+
+    def test_formatting(self):
+        log = requestlog.RequestLog(sample_every=1)
+        with mock.patch.object(requestlog.LOG, 'isEnabledFor',
+                               return_value=True), \
+                mock.patch.object(requestlog.LOG, 'handle') as handle_mock:
+            log.log(self.request, 0.25, correlation_id='c1')
+        record = handle_mock.call_args[0][0]
+        self.assertIn("f(*('xxx", record.getMessage())
+        self.assertIn('[c1] took 0.250000s', record.getMessage())
+        self.assertEqual(record.callme['func_name'], 'f')
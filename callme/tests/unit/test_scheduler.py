@@ -0,0 +1,141 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mock
+
+from callme import scheduler
+from callme import test
+
+
+class TestTokenBucket(test.TestCase):
+
+    @mock.patch.object(scheduler.time, 'time')
+    def test_take(self, time_mock):
+        time_mock.return_value = 100
+        bucket = scheduler.TokenBucket(rate=2, burst=2)
+        self.assertTrue(bucket.take(100))
+        self.assertTrue(bucket.take(100))
+        self.assertFalse(bucket.take(100))
+        self.assertAlmostEqual(bucket.delay(100), 0.5)
+        self.assertTrue(bucket.take(100.5))
+        self.assertFalse(bucket.is_full(100.5))
+        self.assertTrue(bucket.is_full(101.5))
+
+
+class TestFairScheduler(test.TestCase):
+
+    def _drain(self, s):
+        items = []
+        while True:
+            try:
+                items.append(s.get_nowait())
+            except scheduler.queue.Empty:
+                return items
+
+    def test_round_robin(self):
+        s = scheduler.FairScheduler()
+        for i in range(4):
+            s.put(('heavy', i), key='heavy')
+        s.put(('light', 0), key='light')
+        self.assertEqual(s.qsize(), 5)
+        self.assertEqual(self._drain(s), [('heavy', 0), ('light', 0),
+                                          ('heavy', 1), ('heavy', 2),
+                                          ('heavy', 3)])
+        self.assertEqual(s.qsize(), 0)
+
+    def test_weights(self):
+        s = scheduler.FairScheduler(weights={'a': 2})
+        for i in range(3):
+            s.put(('a', i), key='a')
+            s.put(('b', i), key='b')
+        self.assertEqual(self._drain(s), [('a', 0), ('a', 1), ('b', 0),
+                                          ('a', 2), ('b', 1), ('b', 2)])
+
+    def test_control_items_last(self):
+        s = scheduler.FairScheduler()
+        s.put(None)
+        s.put('task', key='client')
+        self.assertEqual(self._drain(s), ['task', None])
+
+    @mock.patch.object(scheduler.time, 'time')
+    def test_rate_limit(self, time_mock):
+        time_mock.return_value = 100
+        s = scheduler.FairScheduler(rate=1, burst=1)
+        s.put(('a', 0), key='a')
+        s.put(('a', 1), key='a')
+        s.put(('b', 0), key='b')
+        self.assertEqual(self._drain(s), [('a', 0), ('b', 0)])
+        self.assertEqual(s.qsize(), 1)
+        self.assertRaises(scheduler.queue.Empty, s.get, timeout=0)
+
+        time_mock.return_value = 101
+        self.assertEqual(self._drain(s), [('a', 1)])
+
+    @mock.patch.object(scheduler.time, 'time')
+    def test_ready(self, time_mock):
+        time_mock.return_value = 100
+        s = scheduler.FairScheduler(rate=1, burst=2)
+        for i in range(5):
+            s.put(('heavy', i), key='heavy')
+        s.put(('light', 0), key='light')
+        s.put(None)
+        self.assertEqual(s.qsize(), 7)
+        self.assertEqual(s.ready(), 3)
+        self.assertEqual(self._drain(s), [('heavy', 0), ('light', 0),
+                                          ('heavy', 1)])
+        # the throttled client's calls aren't ready
+        self.assertEqual(s.qsize(), 4)
+        self.assertEqual(s.ready(), 0)
+
+        time_mock.return_value = 101
+        self.assertEqual(s.ready(), 1)
+
+    def test_get_waits_for_rate_limit(self):
+        s = scheduler.FairScheduler(rate=100, burst=1)
+        s.put('first', key='a')
+        s.put('second', key='a')
+        self.assertEqual(s.get(), 'first')
+        self.assertEqual(s.get(timeout=5), 'second')
+
+
+class TestPriorityScheduler(test.TestCase):
+
+    def test_priority_order(self):
+        s = scheduler.PriorityScheduler()
+        s.put(None)
+        s.put('low', key=0)
+        s.put('high', key=9)
+        s.put('low2', key=0)
+        s.put('mid', key=5)
+        self.assertEqual(s.qsize(), 5)
+        self.assertEqual([s.get_nowait() for _ in range(5)],
+                         ['high', 'mid', 'low', 'low2', None])
+        self.assertRaises(scheduler.queue.Empty, s.get, timeout=0.01)
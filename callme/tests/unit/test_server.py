@@ -31,8 +31,28 @@
 
 # pylint: disable=W0212
 
+import pickle
+import socket
+import threading
+import time
+
+import mock
+
+from callme import exceptions
+from callme import jobs
+from callme import metrics
+from callme import pool
+from callme import protocol
 from callme import server
+from callme import sharding
 from callme import test
+from callme import tracing
+
+
+def _make_message(correlation_id, reply_to, headers=None):
+    return mock.Mock(headers=headers or {},
+                     properties={'correlation_id': correlation_id,
+                                 'reply_to': reply_to})
 
 
 class TestServer(test.MockTestCase):
@@ -77,3 +97,827 @@ class TestServer(test.MockTestCase):
     def test_register_function_not_callable(self):
         s = server.Server('fooserver')
         self.assertRaises(ValueError, s.register_function, 1)
+
+    def test_register_function_queue(self):
+        def func():
+            pass
+        s = server.Server('fooserver')
+        s.register_function(func, 'test', queue='slow', max_concurrency=4)
+        s.register_function(func, 'test2', queue='slow')
+        self.assertEqual(s._func_dict['test'], func)
+        self.assertEqual(s._func_queues, {'test': 'slow', 'test2': 'slow'})
+        self.assertEqual(s._queue_limits, {'slow': 4})
+
+    def test_register_function_queue_default_concurrency(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow')
+        self.assertEqual(s._queue_limits, {'slow': 1})
+
+    def test_register_function_queue_conflicting_concurrency(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow',
+                            max_concurrency=4)
+        self.assertRaises(ValueError, s.register_function, lambda: None,
+                          'test2', queue='slow', max_concurrency=2)
+
+    def test_register_function_concurrency_without_queue(self):
+        s = server.Server('fooserver')
+        self.assertRaises(ValueError, s.register_function, lambda: None,
+                          'test', max_concurrency=2)
+
+    def test_register_function_moved_to_default_queue(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow')
+        s.register_function(lambda: None, 'test')
+        self.assertEqual(s._func_queues, {})
+
+    def test_forward_request_keeps_priority(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow')
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1')
+        message.properties.update(priority=7, expiration='2500')
+        with mock.patch.object(server.kombu, 'producers') as producers_mock:
+            s._on_request(request, message)
+        acquire = producers_mock.__getitem__.return_value.acquire
+        producer = acquire.return_value.__enter__.return_value
+        kwargs = producer.publish.call_args[1]
+        self.assertEqual(kwargs['routing_key'], 'test')
+        self.assertEqual(kwargs['priority'], 7)
+        self.assertEqual(kwargs['expiration'], 2.5)
+
+    def test_call_function_memoized(self):
+        func = mock.Mock(return_value=3)
+        s = server.Server('fooserver')
+        s.register_function(func, 'test', memoize=True)
+        request = protocol.RpcRequest('test', (1, 2), {})
+        self.assertEqual(s._call_function(request), 3)
+        self.assertEqual(s._call_function(request), 3)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(s.cache_stats(),
+                         {'test': {'hits': 1, 'misses': 1, 'size': 1}})
+
+        s.invalidate_cache('test')
+        self.assertEqual(s._call_function(request), 3)
+        self.assertEqual(func.call_count, 2)
+
+    def test_call_function_memoized_exception(self):
+        func = mock.Mock(side_effect=ValueError)
+        s = server.Server('fooserver')
+        s.register_function(func, 'test', memoize=True)
+        request = protocol.RpcRequest('test', (), {})
+        self.assertRaises(ValueError, s._call_function, request)
+        self.assertRaises(ValueError, s._call_function, request)
+        self.assertEqual(func.call_count, 2)
+
+    def test_call_function_control(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', memoize=True)
+        request = protocol.RpcRequest('callme.cache_stats', (), {})
+        self.assertEqual(s._call_function(request),
+                         {'test': {'hits': 0, 'misses': 0, 'size': 0}})
+
+    def test_call_function_unknown(self):
+        s = server.Server('fooserver')
+        request = protocol.RpcRequest('test', (), {})
+        self.assertRaises(KeyError, s._call_function, request)
+
+    def test_register_batch_function(self):
+        def func(calls):
+            pass
+        s = server.Server('fooserver')
+        s.register_function(func, 'test')
+        s.register_batch_function(func, 'test', max_batch=8, max_wait_ms=10)
+        self.assertEqual(s._func_dict, {})
+        self.assertEqual(s._batch_dict, {'test': (func, 8, 0.01)})
+
+    def test_register_batch_function_invalid(self):
+        s = server.Server('fooserver')
+        self.assertRaises(ValueError, s.register_batch_function, 1)
+        self.assertRaises(ValueError, s.register_batch_function,
+                          lambda calls: calls, 'test', max_batch=0)
+
+    def test_process_batch(self):
+        s = server.Server('fooserver')
+        s.register_batch_function(lambda calls: [a + b for a, b in calls],
+                                  'madd')
+        items = [(protocol.RpcRequest('madd', (1, 2), {}),
+                  _make_message('c1', 'r1')),
+                 (protocol.RpcRequest('madd', (3, 4), {}),
+                  _make_message('c2', 'r2')),
+                 (protocol.RpcRequest('madd', (3,), {'b': 4}),
+                  _make_message('c3', 'r3'))]
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_batch('madd', items)
+        replies = [(c[0][0].result, c[0][1], c[0][2])
+                   for c in publish_mock.call_args_list]
+        self.assertIsInstance(replies[0][0], TypeError)
+        self.assertEqual(replies[0][1:], ('r3', 'c3'))
+        self.assertEqual(replies[1:], [(3, 'r1', 'c1'), (7, 'r2', 'c2')])
+
+    def test_process_batch_wrong_result_count(self):
+        s = server.Server('fooserver')
+        s.register_batch_function(lambda calls: [], 'test')
+        items = [(protocol.RpcRequest('test', (1,), {}),
+                  _make_message('c1', 'r1'))]
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_batch('test', items)
+        response = publish_mock.call_args[0][0]
+        self.assertIsInstance(response.result, ValueError)
+
+    def test_batch_pipelined_same_batch(self):
+        s = server.Server('fooserver')
+        s.register_batch_function(lambda calls: [a * 2 for a, in calls],
+                                  'double', max_batch=2, max_wait_ms=100)
+        s._start_batchers()
+        self.addCleanup(s._stop_batchers)
+        replies = {}
+        done = threading.Event()
+
+        def publish(response, reply_to, correlation_id, span=None):
+            replies[correlation_id] = response.result
+            if len(replies) == 2:
+                done.set()
+
+        chained = protocol.RpcRequest('double', (protocol.RpcPromise('c1'),),
+                                      {})
+        with mock.patch.object(s, '_publish_response', side_effect=publish):
+            s._on_request(protocol.RpcRequest('double', (3,), {}),
+                          _make_message('c1', 'r1', {'pipelined': True}))
+            s._on_request(chained, _make_message('c2', 'r1'))
+            self.assertTrue(done.wait(5))
+        self.assertEqual(replies, {'c1': 6, 'c2': 12})
+
+    def test_admit_request_overloaded(self):
+        s = server.Server('fooserver', max_backlog=1)
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1')
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            self.assertTrue(s._admit_request(request, message))
+            self.assertFalse(s._admit_request(request, message))
+        response, reply_to, correlation_id = publish_mock.call_args[0]
+        self.assertIsInstance(response.result, exceptions.RpcOverloaded)
+        self.assertEqual((reply_to, correlation_id), ('r1', 'c1'))
+
+    def test_process_request_finishes_admitted_request(self):
+        s = server.Server('fooserver', max_backlog=1)
+        s.register_function(lambda: 1, 'test')
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1')
+        with mock.patch.object(s, '_publish_response'):
+            self.assertTrue(s._admit_request(request, message))
+            s._process_request(request, message)
+            self.assertTrue(s._admit_request(request, message))
+
+    def test_min_workers_without_max_workers(self):
+        self.assertRaises(ValueError, server.Server, 'fooserver',
+                          min_workers=2)
+
+    def test_autoscale(self):
+        s = server.Server('fooserver', min_workers=1, max_workers=8)
+        s._default_pool = mock.Mock(size=2, busy=2, ready=1)
+        queue = mock.Mock()
+        queue.return_value.queue_declare.return_value.message_count = 3
+        s._autoscale('channel', queue)
+        queue.assert_called_once_with('channel')
+        queue.return_value.queue_declare.assert_called_once_with(passive=True)
+        s._default_pool.resize.assert_called_once_with(6)
+
+        # the next check is delayed
+        s._autoscale('channel', queue)
+        self.assertEqual(queue.call_count, 1)
+
+    def test_scheduler_without_max_workers(self):
+        self.assertRaises(ValueError, server.Server, 'fooserver',
+                          scheduler=mock.Mock())
+
+    def test_get_client_id(self):
+        message = mock.Mock(headers={'client_id': 'foo'},
+                            properties={'reply_to': 'bar'})
+        self.assertEqual(server.Server._get_client_id(message), 'foo')
+        message = mock.Mock(headers={}, properties={'reply_to': 'bar'})
+        self.assertEqual(server.Server._get_client_id(message), 'bar')
+
+    def test_reload_functions(self):
+        def func():
+            pass
+        s = server.Server('fooserver')
+        s.register_function(func, 'old')
+        s.register_function(func, 'kept', memoize=True)
+        s.register_function(func, 'replaced', memoize=True)
+        s._caches['kept'].set('key', 1)
+        s._caches['replaced'].set('key', 1)
+
+        s.reload_functions({'kept': {'func': func, 'memoize': True},
+                            'replaced': {'func': lambda: None,
+                                         'memoize': True},
+                            'new': func})
+        self.assertEqual(sorted(s._func_dict), ['kept', 'new', 'replaced'])
+        self.assertEqual(s._caches['kept'].get('key'), (True, 1))
+        self.assertEqual(s._caches['replaced'].get('key'), (False, None))
+
+    def test_reload_functions_replaces_settings(self):
+        def func():
+            return 1
+        s = server.Server('fooserver')
+        s.register_function(lambda cancelled: 0, 'test', cancellable=True,
+                            priority=3)
+        s.register_function(func, 'slow', queue='slow', memoize=True)
+
+        s.reload_functions({'test': func,
+                            'fast': {'func': func, 'by_reference': True}})
+        self.assertEqual(s._func_queues, {})
+        self.assertEqual(s._caches, {})
+        self.assertEqual(s._func_priorities, {})
+        self.assertEqual(s._cancellable, set())
+        self.assertEqual(s._by_reference, set(['fast']))
+        # the replacement isn't called with the `cancelled` flag
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(protocol.RpcRequest('test', (), {}),
+                               _make_message('c1', 'r1'))
+        self.assertEqual(publish_mock.call_args[0][0].result, 1)
+
+    def test_reload_functions_dropped_not_forwarded(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'slow', queue='slow')
+        s.reload_functions({'test': lambda: None})
+        with mock.patch.object(s, '_forward_request') as forward_mock, \
+                mock.patch.object(s, '_publish_response') as publish_mock:
+            s._on_request(protocol.RpcRequest('slow', (), {}),
+                          _make_message('c1', 'r1'))
+        self.assertFalse(forward_mock.called)
+        self.assertIsInstance(publish_mock.call_args[0][0].result, KeyError)
+
+    def test_reload_functions_new_queue_running(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow')
+        s._running.set()
+        s.reload_functions({'test2': {'func': lambda: None,
+                                      'queue': 'slow'}})
+        self.assertRaises(ValueError, s.reload_functions,
+                          {'test': {'func': lambda: None, 'queue': 'other'}})
+        self.assertEqual(s._func_queues, {'test2': 'slow'})
+
+    def test_reload_functions_not_callable(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test')
+        self.assertRaises(ValueError, s.reload_functions, {'test': 1})
+        self.assertIn('test', s._func_dict)
+
+    def test_wait_for_requests(self):
+        s = server.Server('fooserver')
+        message = mock.Mock(headers={}, properties={})
+        self.assertTrue(s._admit_request('request', message))
+        self.assertFalse(s._wait_for_requests(time.time() + 0.01))
+        s._finish_requests()
+        self.assertTrue(s._wait_for_requests(time.time() + 0.01))
+
+    def test_close_drains(self):
+        s = server.Server('fooserver')
+        consumer = mock.Mock()
+        s._drain_deadline = 100
+        with mock.patch.object(s, '_wait_for_requests') as wait_mock:
+            with mock.patch.object(s, '_stop_publisher') as stop_mock:
+                s._close([consumer])
+        consumer.cancel.assert_called_once_with()
+        wait_mock.assert_called_once_with(100)
+        stop_mock.assert_called_once_with(100)
+        self.assertIsNone(s._drain_deadline)
+
+    def test_get_priority(self):
+        s = server.Server('fooserver', max_priority=9)
+        s.register_function(lambda: None, 'test', priority=3)
+        s.register_function(lambda: None, 'test2')
+        message = mock.Mock(properties={'priority': 7})
+        request = protocol.RpcRequest('test', (), {})
+        self.assertEqual(s._get_priority(request, message), 7)
+        message = mock.Mock(properties={'priority': 0})
+        self.assertEqual(s._get_priority(request, message), 3)
+        request = protocol.RpcRequest('test2', (), {})
+        self.assertEqual(s._get_priority(request, message), 0)
+
+    def test_submit_by_priority(self):
+        s = server.Server('fooserver', max_priority=9)
+        worker_pool = mock.Mock()
+        request = protocol.RpcRequest('test', (), {})
+        message = mock.Mock(properties={'priority': 7})
+        s._submit(worker_pool, request, message)
+        worker_pool.submit_for.assert_called_once_with(
+            7, s._process_request, request, message)
+
+    def test_submit_fifo(self):
+        s = server.Server('fooserver')
+        worker_pool = mock.Mock()
+        s._submit(worker_pool, 'request', 'message')
+        worker_pool.submit.assert_called_once_with(
+            s._process_request, 'request', 'message')
+
+    def test_cancel_queued_request(self):
+        func = mock.Mock()
+        s = server.Server('fooserver')
+        s.register_function(func, 'test')
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1')
+        cancel = protocol.RpcRequest(protocol.CANCEL_FUNC_NAME, ('c1',), {})
+        s._on_request(cancel, _make_message('c2', 'r1'))
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            self.assertTrue(s._admit_request(request, message))
+            s._process_request(request, message)
+        self.assertFalse(func.called)
+        self.assertFalse(publish_mock.called)
+        self.assertEqual(s._inflight, 0)
+        self.assertEqual(len(s._cancelled), 0)
+
+    def test_cancel_running_request(self):
+        started = threading.Event()
+
+        def func(cancelled):
+            started.set()
+            return cancelled.wait(5)
+        s = server.Server('fooserver')
+        s.register_function(func, 'test', cancellable=True)
+        request = protocol.RpcRequest('test', (), {})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            t = threading.Thread(target=s._process_request,
+                                 args=(request, _make_message('c1', 'r1')))
+            t.start()
+            self.assertTrue(started.wait(5))
+            s._cancel_request('c1')
+            t.join(5)
+        self.assertFalse(publish_mock.called)
+        self.assertEqual(s._running_calls, {})
+
+    def test_not_cancellable(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda **kwargs: kwargs, 'test')
+        request = protocol.RpcRequest('test', (), {})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(request, _make_message('c1', 'r1'))
+        self.assertEqual(publish_mock.call_args[0][0].result, {})
+
+    def test_cancelled_limit(self):
+        s = server.Server('fooserver')
+        with mock.patch.object(server, 'MAX_CANCELLED', 2):
+            for correlation_id in ('c1', 'c2', 'c3'):
+                s._cancel_request(correlation_id)
+        self.assertEqual(list(s._cancelled), ['c2', 'c3'])
+
+    def test_pipelined_request(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda user_id: {'id': user_id}, 'get_user')
+        s.register_function(lambda user: [user['id']], 'get_orders')
+        headers = {'pipelined': True}
+        get_user = protocol.RpcRequest('get_user', (7,), {})
+        get_orders = protocol.RpcRequest(
+            'get_orders', (protocol.RpcPromise('c1'),), {})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._on_request(get_user, _make_message('c1', 'r1', headers))
+            s._on_request(get_orders, _make_message('c2', 'r1'))
+        self.assertEqual(publish_mock.call_args[0][0].result, [7])
+
+    def test_pipelined_request_dropped(self):
+        func = mock.Mock()
+        s = server.Server('fooserver')
+        s.register_function(func, 'test')
+        message = _make_message('c1', 'r1', {'pipelined': True,
+                                             'deadline': time.time() - 1})
+        request = protocol.RpcRequest('test', (protocol.RpcPromise('c1'),),
+                                      {})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._on_request(protocol.RpcRequest('test', (), {}), message)
+            s._on_request(request, _make_message('c2', 'r1'))
+        self.assertEqual(func.call_count, 0)
+        self.assertIsInstance(publish_mock.call_args[0][0].result,
+                              ValueError)
+
+    def test_by_reference(self):
+        class Dataset(object):
+            name = 'sales'
+
+            def __len__(self):
+                return 3
+
+            def total(self, factor=1):
+                return 6 * factor
+
+        s = server.Server('fooserver')
+        s.register_function(Dataset, 'load', by_reference=True)
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(protocol.RpcRequest('load', (), {}),
+                               _make_message('c1', 'r1'))
+        handle = publish_mock.call_args[0][0].result
+        self.assertIsInstance(handle, protocol.RpcHandle)
+        self.assertEqual(handle.server_id, 'fooserver')
+        self.assertEqual(handle.instance_id, s._instance_id)
+
+        prefix = protocol.HANDLE_FUNC_PREFIX + handle.handle_id
+        self.assertEqual(s._lookup_function(prefix + '.total')(factor=2), 12)
+        self.assertEqual(s._lookup_function(prefix + '.__len__')(), 3)
+        self.assertEqual(s._lookup_function(prefix + '.name')(), 'sales')
+        self.assertRaises(AttributeError, s._lookup_function,
+                          prefix + '.__class__')
+        s._lookup_function('callme.release_handle')(handle.handle_id)
+        self.assertRaises(KeyError, s._lookup_function, prefix + '.total')
+
+    def test_job(self):
+        store = jobs.MemoryResultStore()
+        s = server.Server('fooserver', result_store=store)
+        s.register_function(lambda a: a * 2, 'test')
+        request = protocol.RpcRequest('test', (21,), {})
+        message = _make_message('c1', 'r1', {'job': True})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._on_request(request, message)
+        publish_mock.assert_called_once_with(mock.ANY, 'r1', 'c1')
+        self.assertEqual(publish_mock.call_args[0][0].result, 'c1')
+        self.assertEqual(s.job_status('c1'), jobs.DONE)
+        self.assertEqual(s.job_result('c1'), 42)
+        s.forget_job('c1')
+        self.assertRaises(KeyError, s.job_status, 'c1')
+
+    def test_job_exception(self):
+        s = server.Server('fooserver', result_store=jobs.MemoryResultStore())
+        s.register_function(lambda: {}['a'], 'test')
+        with mock.patch.object(s, '_publish_response'):
+            s._on_request(protocol.RpcRequest('test', (), {}),
+                          _make_message('c1', 'r1', {'job': True}))
+        self.assertRaises(KeyError, s.job_result, 'c1')
+
+    def test_job_unpicklable_result(self):
+        store = jobs.SqliteResultStore(':memory:')
+        s = server.Server('fooserver', result_store=store)
+        s.register_function(lambda: threading.Lock(), 'test')
+        with mock.patch.object(s, '_publish_response'):
+            s._on_request(protocol.RpcRequest('test', (), {}),
+                          _make_message('c1', 'r1', {'job': True}))
+        self.assertEqual(s.job_status('c1'), jobs.DONE)
+        self.assertRaises((TypeError, pickle.PicklingError), s.job_result,
+                          'c1')
+
+    def test_job_pending(self):
+        store = jobs.MemoryResultStore()
+        s = server.Server('fooserver', result_store=store)
+        store.create('c1')
+        self.assertEqual(s._lookup_function('callme.job_status')('c1'),
+                         jobs.PENDING)
+        self.assertRaises(ValueError, s.job_result, 'c1')
+
+    def test_metrics(self):
+        registry = metrics.MetricsRegistry()
+        s = server.Server('fooserver', metrics=registry)
+        s.register_function(lambda a: 1 / a, 'div')
+        labels = {'function': 'div'}
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(
+                protocol.RpcRequest('div', (1,), {}),
+                _make_message('c1', 'r1', {'sent_at': time.time() - 1}))
+            s._process_request(protocol.RpcRequest('div', (0,), {}),
+                               _make_message('c2', 'r1'))
+            s._process_request(protocol.RpcRequest('nope', (), {}),
+                               _make_message('c3', 'r1'))
+        self.assertEqual(
+            registry.get_counter('callme_server_requests_total', labels), 2)
+        self.assertEqual(
+            registry.get_counter('callme_server_errors_total', labels), 1)
+        self.assertEqual(registry.get_counter('callme_server_requests_total',
+                                              {'function': 'unknown'}), 1)
+        count, total = registry.get_histogram('callme_server_queue_seconds',
+                                              labels)
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(total, 1)
+        self.assertEqual(registry.get_histogram(
+            'callme_server_execution_seconds', labels)[0], 2)
+        self.assertEqual(registry.get_histogram(
+            'callme_server_serialization_seconds', labels)[0], 2)
+        body = publish_mock.call_args_list[0][0][0]
+        self.assertEqual(pickle.loads(body).result, 1)
+
+    def test_tracing(self):
+        tracer = mock.Mock()
+        s = server.Server('fooserver', tracer=tracer)
+        s.register_function(tracing.current_context, 'context')
+        message = _make_message('c1', 'r1', {'trace_id': 't1',
+                                             'span_id': 's1',
+                                             'sent_at': time.time()})
+        with mock.patch.object(s, '_publisher') as publisher_mock:
+            s._process_request(protocol.RpcRequest('context', (), {}),
+                               message)
+            # the reply publisher reports when it actually published
+            response, _, _, published = publisher_mock.publish.call_args[0]
+            self.assertEqual(len(tracer.record.call_args_list), 2)
+            published(time.time())
+        spans = dict((c[0][0].name, c[0][0])
+                     for c in tracer.record.call_args_list)
+        self.assertEqual(sorted(spans), ['callme.execute', 'callme.queue_wait',
+                                         'callme.reply_publish'])
+        execute = spans['callme.execute']
+        self.assertEqual(execute.trace_id, 't1')
+        self.assertEqual(execute.parent_id, 's1')
+        self.assertEqual(spans['callme.queue_wait'].parent_id, 's1')
+        self.assertEqual(spans['callme.reply_publish'].parent_id,
+                         execute.span_id)
+        self.assertEqual(response.result.span_id, execute.span_id)
+
+    def test_process_batch_instrumented(self):
+        registry = metrics.MetricsRegistry()
+        tracer = mock.Mock()
+        request_log = mock.Mock()
+        s = server.Server('fooserver', metrics=registry, tracer=tracer,
+                          request_log=request_log)
+        s.register_batch_function(lambda calls: [1 / a for a, in calls],
+                                  'inv')
+        labels = {'function': 'inv'}
+        items = [(protocol.RpcRequest('inv', (1,), {}),
+                  _make_message('c1', 'r1', {'sent_at': time.time()})),
+                 (protocol.RpcRequest('inv', (0,), {}),
+                  _make_message('c2', 'r1')),
+                 (protocol.RpcRequest('inv', (2,), {}),
+                  _make_message('c3', 'r1', {'deadline': time.time() - 1}))]
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_batch('inv', items)
+        self.assertEqual(
+            registry.get_counter('callme_server_requests_total', labels), 3)
+        self.assertEqual(
+            registry.get_counter('callme_server_errors_total', labels), 2)
+        self.assertEqual(
+            registry.get_counter('callme_server_timeouts_total', labels), 1)
+        self.assertEqual(registry.get_histogram(
+            'callme_server_queue_seconds', labels)[0], 1)
+        self.assertEqual(registry.get_histogram(
+            'callme_server_execution_seconds', labels)[0], 2)
+        self.assertEqual(registry.get_histogram(
+            'callme_server_serialization_seconds', labels)[0], 2)
+        body = publish_mock.call_args_list[0][0][0]
+        self.assertIsInstance(pickle.loads(body).result, ZeroDivisionError)
+        spans = [c[0][0] for c in tracer.record.call_args_list]
+        self.assertEqual([span.name for span in spans],
+                         ['callme.execute', 'callme.execute'])
+        self.assertEqual(spans[0].attributes['batch_size'], 2)
+        self.assertEqual([c[0][3] for c in request_log.log.call_args_list],
+                         ['c1', 'c2'])
+
+    def test_profile(self):
+        def func(a):
+            return sum(range(a))
+        s = server.Server('fooserver')
+        s.register_function(func, 'test')
+        result = {}
+
+        def profile():
+            result.update(s.profile('test', duration=0.2))
+        t = threading.Thread(target=profile)
+        t.start()
+        time.sleep(0.05)
+        self.assertRaises(RuntimeError, s.profile, 'test', 1)
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(protocol.RpcRequest('test', (10,), {}),
+                               _make_message('c1', 'r1'))
+        t.join()
+        self.assertEqual(publish_mock.call_args[0][0].result, 45)
+        self.assertEqual(result['calls'], 1)
+        self.assertTrue(result['functions'])
+        self.assertIs(s._func_dict['test'], func)
+
+    def test_profile_invalid(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test')
+        self.assertRaises(ValueError, s.profile, 'test', 0)
+        self.assertRaises(ValueError, s.profile, 'test',
+                          server.MAX_PROFILE_DURATION + 1)
+        self.assertRaises(KeyError, s.profile, 'nope', 1)
+        self.assertRaises(RuntimeError,
+                          s._lookup_function('callme.profile'), 'test', 1)
+
+    def test_request_log(self):
+        request_log = mock.Mock()
+        s = server.Server('fooserver', request_log=request_log)
+        s.register_function(lambda: 1 / 0, 'div')
+        request = protocol.RpcRequest('div', (), {})
+        with mock.patch.object(s, '_publish_response'):
+            s._process_request(request, _make_message('c1', 'r1'))
+        args = request_log.log.call_args[0]
+        self.assertEqual(args[0], request)
+        self.assertIsInstance(args[2], ZeroDivisionError)
+        self.assertEqual(args[3], 'c1')
+
+    def test_brokers(self):
+        brokers = ['amqp://a', 'amqp://b', 'amqp://c']
+        s = server.Server('fooserver', brokers=brokers)
+        home = sharding.HashRing(brokers).get('fooserver')
+        hosts = [c[1]['hostname'] for c in self.conn_mock.call_args_list]
+        self.assertEqual(hosts[0], home)
+        self.assertEqual(sorted(hosts[1:]),
+                         sorted(b for b in brokers if b != home))
+        self.assertEqual(len(s._shard_conns), 2)
+
+    def test_consume_reconnects(self):
+        s = server.Server('fooserver', reconnect=True)
+        conn = mock.Mock(connection_errors=())
+        stopped = threading.Event()
+        with mock.patch.object(s, '_drain',
+                               side_effect=[socket.error, None]) as drain, \
+                mock.patch.object(s, '_reestablish',
+                                  return_value=True) as reestablish:
+            s._consume(conn, stopped)
+        self.assertEqual(drain.call_count, 2)
+        reestablish.assert_called_once_with(conn, stopped)
+        self.assertFalse(conn.release.called)
+
+    def test_consume_queue_releases_connection(self):
+        s = server.Server('fooserver')
+        conn = mock.Mock(connection_errors=())
+        with mock.patch.object(s, '_drain') as drain:
+            s._consume(conn, threading.Event(), 'slow')
+        drain.assert_called_once_with(conn, mock.ANY, 'slow')
+        conn.release.assert_called_once_with()
+
+    def test_start_consumers(self):
+        s = server.Server('fooserver', brokers=['amqp://a', 'amqp://b'])
+        s.register_function(lambda: None, 'test', queue='slow')
+        with mock.patch.object(s, '_consume') as consume:
+            s._start_consumers()
+            s._stop_consumers()
+        queue_names = sorted((c[0][2] for c in consume.call_args_list),
+                             key=str)
+        self.assertEqual(queue_names, [None, 'slow', 'slow'])
+
+    def test_on_queue_request_waits_for_worker(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: 1, 'test', queue='slow')
+        s._slots['slow'] = slots = pool.Slots(1)
+        s._pools['slow'] = mock.Mock()
+        conn = mock.Mock(heartbeat=None)
+        stopped = threading.Event()
+        stopped.set()
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1')
+        slots.acquire()
+        with mock.patch.object(s, '_publish_response'):
+            # all workers are busy, the message is left to the broker
+            s._on_queue_request('slow', conn, stopped, request, message)
+            self.assertFalse(message.ack.called)
+            slots.release()
+            s._on_queue_request('slow', conn, stopped, request, message)
+            message.ack.assert_called_once_with()
+            self.assertFalse(slots.acquire(timeout=0))
+            process = s._pools['slow'].submit.call_args[0][0]
+            process(request, message)
+        self.assertTrue(slots.acquire(timeout=0))
+
+    def test_stop_wakes_up_running_loop_only(self):
+        s = server.Server('fooserver')
+        with mock.patch.object(s, '_wakeup') as wakeup_mock:
+            s.stop()
+            self.assertFalse(wakeup_mock.called)
+            s._running.set()
+            s.stop()
+        wakeup_mock.assert_called_once_with(s._control_queue)
+        self.assertFalse(s.is_running)
+
+    def test_drain(self):
+        s = server.Server('fooserver')
+        conn = mock.Mock(heartbeat=None)
+        stopped = threading.Event()
+        conn.drain_events.side_effect = lambda timeout: stopped.set()
+        s._drain(conn, stopped)
+        consumer = conn.Consumer.return_value
+        consumer.consume.assert_called_once_with()
+        consumer.cancel.assert_called_once_with()
+
+    def test_instance_queue(self):
+        # servers running with the same id share the default queue, the
+        # objects kept by reference are reached through the instance queue
+        s1 = server.Server('fooserver')
+        s2 = server.Server('fooserver')
+        self.assertNotEqual(s1._instance_id, s2._instance_id)
+        conn = mock.Mock()
+        exchange = s1._make_server_exchange()
+        self.assertEqual(len(s1._make_consumers(conn, exchange)), 1)
+
+        s1.register_function(lambda: None, 'load', by_reference=True)
+        conn.reset_mock()
+        self.assertEqual(len(s1._make_consumers(conn, exchange)), 2)
+        self.assertIs(conn.Consumer.call_args[1]['queues'],
+                      self.queue_inst_mock)
+        self.queue_mock.assert_called_with(
+            name='server_fooserver_instance_{0}'.format(s1._instance_id),
+            exchange=exchange, routing_key=s1._instance_id, exclusive=True,
+            auto_delete=True)
+
+    def test_drain_queue_prefetch(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: None, 'test', queue='slow',
+                            max_concurrency=3)
+        conn = mock.Mock(heartbeat=None)
+        stopped = threading.Event()
+        conn.drain_events.side_effect = lambda timeout: stopped.set()
+        s._drain(conn, stopped, 'slow')
+        self.assertEqual(conn.Consumer.call_args[1]['prefetch_count'], 3)
+        conn.Consumer.return_value.consume.assert_called_once_with()
+
+
+class TestServerGroup(test.MockTestCase):
+
+    def setUp(self):
+        super(TestServerGroup, self).setUp()
+
+        # mock kombu Connection
+        self.conn_mock, self.conn_inst_mock = self._mock_class(
+            server.kombu, 'BrokerConnection')
+
+        # mock kombu Queue
+        self.queue_mock, self.queue_inst_mock = self._mock_class(
+            server.kombu, 'Queue')
+
+    def test_add_service(self):
+        def func():
+            pass
+        g = server.ServerGroup(amqp_host='foohost', durable=True)
+        s1 = g.add_service('fooserver', {'test': func})
+        s2 = g.add_service('barserver', [func], threaded=True)
+        self.assertEqual(g.servers, [s1, s2])
+        self.assertEqual(s1._func_dict, {'test': func})
+        self.assertEqual(s2._func_dict, {'func': func})
+        self.assertTrue(s1._durable)
+        self.assertTrue(s2._threaded)
+
+    def test_add_service_running(self):
+        g = server.ServerGroup()
+        g._running.set()
+        self.assertRaises(RuntimeError, g.add_service, 'fooserver')
+
+    def test_serve(self):
+        running = threading.Event()
+        conn = mock.Mock()
+        conn.drain_events.side_effect = lambda timeout: running.clear()
+        servers = [mock.Mock(is_running=True), mock.Mock(is_running=False)]
+        server._serve(conn, servers, running, 'control_queue', 'test',
+                      reply_publisher='publisher')
+
+        for s in servers:
+            s._open.assert_called_once_with(conn, 'publisher')
+            s._close.assert_called_once_with(s._open.return_value)
+        servers[0]._tick.assert_called_once_with(
+            conn, servers[0]._open.return_value)
+        self.assertFalse(servers[1]._tick.called)
+        conn.Consumer.return_value.cancel.assert_called_once_with()
+        self.assertFalse(running.is_set())
+
+    def test_serve_raises_connection_errors(self):
+        running = threading.Event()
+        conn = mock.Mock(heartbeat=10, connection_errors=())
+        conn.drain_events.side_effect = socket.error
+        servers = [mock.Mock(is_running=True)]
+        self.assertRaises(socket.error, server._serve, conn, servers,
+                          running, 'control_queue', 'test')
+        conn.heartbeat_check.assert_called_once_with()
+        servers[0]._close.assert_called_once_with(
+            servers[0]._open.return_value)
+        self.assertFalse(running.is_set())
+
+    def test_serve_until_stopped_reconnects(self):
+        owner = mock.Mock(_reconnect=True)
+        owner._stop_requested.is_set.return_value = False
+        conn = mock.Mock(connection_errors=())
+        s1 = mock.Mock()
+        s1._stop_requested.is_set.return_value = False
+        s2 = mock.Mock()
+        s2._stop_requested.is_set.return_value = True
+        with mock.patch.object(server, '_serve',
+                               side_effect=[socket.error, None]) as serve:
+            server._serve_until_stopped(owner, conn, [s1, s2], 'running',
+                                        'control_queue', 'test')
+        owner._reestablish.assert_called_once_with(conn,
+                                                   owner._stop_requested)
+        # servers stopped meanwhile are not consumed again
+        self.assertEqual(serve.call_args_list[1][0][1], [s1])
+
+    def test_serve_until_stopped_without_reconnect(self):
+        owner = mock.Mock(_reconnect=False)
+        conn = mock.Mock(connection_errors=())
+        with mock.patch.object(server, '_serve', side_effect=socket.error):
+            self.assertRaises(socket.error, server._serve_until_stopped,
+                              owner, conn, [], 'running', 'control_queue',
+                              'test')
+        self.assertFalse(owner._reestablish.called)
+
+    def test_process_request_expired(self):
+        func = mock.Mock()
+        s = server.Server('fooserver')
+        s.register_function(func, 'test')
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1', {'deadline': time.time() - 1})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            self.assertTrue(s._admit_request(request, message))
+            s._process_request(request, message)
+        self.assertFalse(func.called)
+        self.assertFalse(publish_mock.called)
+        self.assertEqual(s._inflight, 0)
+
+    def test_process_request_deadline_not_reached(self):
+        s = server.Server('fooserver')
+        s.register_function(lambda: 1, 'test')
+        request = protocol.RpcRequest('test', (), {})
+        message = _make_message('c1', 'r1', {'deadline': time.time() + 60})
+        with mock.patch.object(s, '_publish_response') as publish_mock:
+            s._process_request(request, message)
+        self.assertEqual(publish_mock.call_args[0][0].result, 1)
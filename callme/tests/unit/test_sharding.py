@@ -0,0 +1,72 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from callme import sharding
+from callme import test
+
+
+class TestHashRing(test.TestCase):
+
+    def test_get(self):
+        ring = sharding.HashRing(['amqp://a', 'amqp://b'])
+        self.assertIn(ring.get('fooserver'), ['amqp://a', 'amqp://b'])
+        self.assertEqual(ring.get('fooserver'), ring.get('fooserver'))
+
+    def test_get_non_string_key(self):
+        ring = sharding.HashRing(['amqp://a', 'amqp://b'])
+        self.assertEqual(ring.get(42), ring.get('42'))
+
+    def test_order_independent(self):
+        ring1 = sharding.HashRing(['amqp://a', 'amqp://b', 'amqp://c'])
+        ring2 = sharding.HashRing(['amqp://c', 'amqp://a', 'amqp://b'])
+        for i in range(100):
+            key = 'server{0}'.format(i)
+            self.assertEqual(ring1.get(key), ring2.get(key))
+
+    def test_spread(self):
+        ring = sharding.HashRing(['amqp://a', 'amqp://b', 'amqp://c'])
+        counts = dict((broker, 0) for broker in ring.brokers)
+        for i in range(3000):
+            counts[ring.get('server{0}'.format(i))] += 1
+        for count in counts.values():
+            self.assertGreater(count, 600)
+
+    def test_adding_broker_moves_few_keys(self):
+        ring1 = sharding.HashRing(['amqp://a', 'amqp://b', 'amqp://c'])
+        ring2 = sharding.HashRing(['amqp://a', 'amqp://b', 'amqp://c',
+                                   'amqp://d'])
+        keys = ['server{0}'.format(i) for i in range(1000)]
+        moved = [k for k in keys if ring1.get(k) != ring2.get(k)]
+        self.assertLess(len(moved), 400)
+        self.assertTrue(all(ring2.get(k) == 'amqp://d' for k in moved))
+
+    def test_no_brokers(self):
+        self.assertRaises(ValueError, sharding.HashRing, [])
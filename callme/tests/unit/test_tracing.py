@@ -0,0 +1,89 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from callme import test
+from callme import tracing
+
+
+class TestTracing(test.TestCase):
+
+    def test_activate(self):
+        self.assertIsNone(tracing.current_context())
+        context = tracing.SpanContext('t1', 's1')
+        with tracing.activate(context):
+            self.assertIs(tracing.current_context(), context)
+            with tracing.activate(None):
+                self.assertIsNone(tracing.current_context())
+            self.assertIs(tracing.current_context(), context)
+        self.assertIsNone(tracing.current_context())
+
+    def test_ids(self):
+        self.assertEqual(len(tracing.new_trace_id()), 32)
+        self.assertEqual(len(tracing.new_span_id()), 16)
+        self.assertNotEqual(tracing.new_span_id(), tracing.new_span_id())
+
+    def test_record(self):
+        tracer = mock.Mock()
+        parent = tracing.Span('parent', 't1')
+        span = tracing.record(tracer, 'child', parent, 1, 2, {'a': 1})
+        tracer.record.assert_called_once_with(span)
+        self.assertEqual(span.to_dict(), {'name': 'child',
+                                          'trace_id': 't1',
+                                          'span_id': span.span_id,
+                                          'parent_id': parent.span_id,
+                                          'start': 1,
+                                          'end': 2,
+                                          'attributes': {'a': 1}})
+
+
+class TestJsonLinesExporter(test.TestCase):
+
+    def test_record(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'spans.jsonl')
+        exporter = tracing.JsonLinesExporter(path)
+        for name in ('first', 'second'):
+            span = tracing.Span(name, 't1', attributes={'obj': object()})
+            span.finish()
+            exporter.record(span)
+        exporter.close()
+        with open(path) as fp:
+            spans = [json.loads(line) for line in fp]
+        self.assertEqual([s['name'] for s in spans], ['first', 'second'])
+        self.assertTrue(spans[0]['attributes']['obj'].startswith('<object'))
@@ -0,0 +1,161 @@
+# Copyright (c) 2009-2014, Christian Haintz
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+#     * Neither the name of callme nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+_local = threading.local()
+
+
+def new_trace_id():
+    """Return a new random 128-bit trace id as hex string."""
+    return uuid.uuid4().hex
+
+
+def new_span_id():
+    """Return a new random 64-bit span id as hex string."""
+    return uuid.uuid4().hex[:16]
+
+
+class SpanContext(object):
+    """This class is used to identify a span across processes.
+
+    :param trace_id: the id of the trace the span belongs to
+    :param span_id: the id of the span
+    """
+
+    def __init__(self, trace_id, span_id):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+
+def current_context():
+    """Return the :class:`SpanContext` of the call the current thread is
+    executing on a server, `None` outside of calls.
+
+    Proxies with a tracer continue its trace, so traces follow calls made
+    by remote functions.
+    """
+    return getattr(_local, 'context', None)
+
+
+@contextlib.contextmanager
+def activate(context):
+    """Make a :class:`SpanContext` the current context of the thread while
+    the block is executed.
+    """
+    previous = current_context()
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+class Span(object):
+    """This class is used to record a timed phase of a call.
+
+    :param name: the name of the phase
+    :param trace_id: the id of the trace the span belongs to
+    :keyword parent_id: the id of the parent span
+    :keyword start: the start time, defaults to now
+    :keyword attributes: dict of further information
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, start=None,
+                 attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+
+    @property
+    def context(self):
+        """Return the :class:`SpanContext` of the span."""
+        return SpanContext(self.trace_id, self.span_id)
+
+    def finish(self, end=None):
+        """Set the end time of the span, defaults to now."""
+        self.end = end if end is not None else time.time()
+
+    def to_dict(self):
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'end': self.end,
+                'attributes': self.attributes}
+
+
+class JsonLinesExporter(object):
+    """This class is used to write finished spans to a file, one JSON object
+    per line.
+
+    Tracers are objects with a `record(span)` method called with every
+    finished :class:`Span`, e.g. to hand the spans over to OpenTelemetry.
+    This one is thread-safe.
+
+    :param path: the path of the file the spans are appended to
+    """
+
+    def __init__(self, path):
+        self._fp = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        """Write a finished span."""
+        line = json.dumps(span.to_dict(), sort_keys=True, default=repr)
+        with self._lock:
+            self._fp.write(line + '\n')
+            self._fp.flush()
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            self._fp.close()
+
+
+def record(tracer, name, parent, start, end=None, attributes=None):
+    """Record a finished child span of a span or span context.
+
+    :rtype: the recorded :class:`Span`
+    """
+    span = Span(name, parent.trace_id, parent.span_id, start, attributes)
+    span.finish(end)
+    tracer.record(span)
+    return span
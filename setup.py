@@ -22,6 +22,11 @@ setuptools.setup(
     version=read_version(),
     packages=setuptools.find_packages(),
     install_requires=['kombu>=3.0.0'],
+    entry_points={
+        'console_scripts': [
+            'callme-bench = callme.benchmarks.load:main',
+        ],
+    },
 
     # metadata for upload to PyPI
     author="Christian Haintz",